@@ -1,6 +1,6 @@
 import traceback
 
-from flask import Flask, render_template, g, request
+from flask import Flask, render_template, g, request, jsonify
 from blueprint import (
     customer_blueprint,
     admin_user_blueprint,
@@ -11,6 +11,11 @@ from blueprint import (
 from dotenv import load_dotenv
 from datetime import timedelta, datetime
 from service.slack_service import SlackService
+from repository.engine_registry import pool_stats
+from service.meta_rate_governor import governor
+from service.redis_client import is_degraded, local_cache
+from service.slack_dispatcher import dispatcher
+from service.image_optimizer import image_optimizer
 
 
 load_dotenv()
@@ -103,5 +108,36 @@ def flask_health_check():
     return "success"
 
 
+@app.route("/flask-health-check/db-pool")
+def db_pool_stats():
+    return jsonify({"status": "success", "pools": pool_stats()})
+
+
+@app.route("/flask-health-check/meta-usage")
+def meta_usage():
+    return jsonify({"status": "success", "meta": governor.metrics()})
+
+
+@app.route("/flask-health-check/redis")
+def redis_stats():
+    """Redis に接続できない間はプロセス内キャッシュで動く。その状態と統計"""
+    return jsonify(
+        {"status": "success", "degraded": is_degraded(), "local_cache": local_cache.stats()}
+    )
+
+
+@app.route("/flask-health-check/slack")
+def slack_stats():
+    return jsonify({"status": "success", "slack": dispatcher.stats})
+
+
+@app.route("/flask-health-check/images")
+def image_stats():
+    """このプロセスで縮小した画像の件数と削減したバイト数"""
+    return jsonify(
+        {"status": "success", "enabled": image_optimizer.enabled, "images": image_optimizer.stats}
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,131 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from blueprint.batch_blueprint import (  # noqa: E402
+    BATCH_ENGINE,
+    MAX_WORKERS,
+    process_health_probe,
+    process_tasks,
+    process_tasks_async,
+)
+from service.batch_jobs import WORKER_TTL, BatchJobService  # noqa: E402
+from service.meta_rate_governor import governor  # noqa: E402
+from service.redis_client import create_redis  # noqa: E402
+
+# 非同期エンジンで一度に取り出すタスク数
+ASYNC_CHUNK_SIZE = 200
+# スレッドごとに一度に取り出すタスク数（投稿一覧はこの単位でバッチリクエストする）
+THREAD_CHUNK_SIZE = int(os.getenv("BATCH_THREAD_CHUNK_SIZE", "10"))
+# 顧客のWordPress疎通・決済状態を確認する間隔（秒）。0なら確認しない
+HEALTH_PROBE_INTERVAL = int(os.getenv("HEALTH_PROBE_INTERVAL", "600"))
+HEALTH_PROBE_LOCK_KEY = "health:probe_lock"
+
+
+# コンテナの再起動でホスト名・PIDが同じになっても、前のプロセスと区別する
+PROCESS_ID = uuid.uuid4().hex[:8]
+
+
+def worker_id(index: int) -> str:
+    """処理中リストの持ち主を表すID（ホスト・プロセス・スレッドごと）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{PROCESS_ID}:{index}"
+
+
+def wait_for_meta_budget() -> bool:
+    """Meta API が一時停止中なら、新しいタスクを取り出さずに待つ"""
+    paused_for = governor.paused_for()
+    if paused_for > 0:
+        print(f"Meta API paused, waiting {paused_for:.0f}s")
+        time.sleep(min(paused_for, 30))
+        return True
+    return False
+
+
+def run_heartbeat(worker_ids: list[str]):
+    """ワーカーの生存を記録し、止まったワーカーが処理中だったタスクを回収する"""
+    job_service = BatchJobService(create_redis())
+    while True:
+        try:
+            job_service.heartbeat(worker_ids)
+            recovered = job_service.recover_stale()
+            if recovered:
+                print(f"recovered {recovered} tasks from stopped workers")
+        except redis.RedisError as e:
+            print(f"Redis error: {e}")
+        time.sleep(WORKER_TTL / 4)
+
+
+def run_thread_worker(index: int):
+    job_service = BatchJobService(create_redis(), worker_id(index))
+    while True:
+        if wait_for_meta_budget():
+            continue
+        try:
+            tasks = job_service.pop_many(THREAD_CHUNK_SIZE)
+        except redis.RedisError as e:
+            print(f"Redis error: {e}")
+            time.sleep(5)
+            continue
+        if tasks:
+            process_tasks(job_service, tasks)
+
+
+def run_async_worker():
+    job_service = BatchJobService(create_redis(), worker_id(0))
+    while True:
+        if wait_for_meta_budget():
+            continue
+        try:
+            tasks = job_service.pop_many(ASYNC_CHUNK_SIZE)
+        except redis.RedisError as e:
+            print(f"Redis error: {e}")
+            time.sleep(5)
+            continue
+        if tasks:
+            process_tasks_async(job_service, tasks)
+
+
+def run_health_prober():
+    """一定間隔で顧客の状態を確認する。複数のワーカーが起動していても1つだけが実行する"""
+    redis_cli = create_redis()
+    while True:
+        try:
+            if redis_cli.set(
+                HEALTH_PROBE_LOCK_KEY, 1, nx=True, ex=HEALTH_PROBE_INTERVAL
+            ):
+                process_health_probe()
+        except redis.RedisError as e:
+            print(f"Redis error: {e}")
+        except Exception as e:
+            print(f"Health probe failed: {e}")
+        time.sleep(min(HEALTH_PROBE_INTERVAL, 60))
+
+
+if __name__ == "__main__":
+    print(f"batch worker started: engine={BATCH_ENGINE}")
+    if HEALTH_PROBE_INTERVAL > 0:
+        threading.Thread(target=run_health_prober, daemon=True).start()
+    worker_count = 1 if BATCH_ENGINE == "async" else MAX_WORKERS
+    threading.Thread(
+        target=run_heartbeat,
+        args=([worker_id(index) for index in range(worker_count)],),
+        daemon=True,
+    ).start()
+    if BATCH_ENGINE == "async":
+        run_async_worker()
+    else:
+        threads = [
+            threading.Thread(target=run_thread_worker, args=(index,), daemon=True)
+            for index in range(MAX_WORKERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -24,8 +24,10 @@ from service.admin_users_service import (
 from repository.unit_of_work import UnitOfWork
 from domain.customers import Customer, CustomerValidator
 from service.customers_service import CustomersService, CustomerValidationError
+from service.counters_service import CountersService
+from service.image_optimizer import image_optimizer
 from service.posts_service import PostsService
-from service.redis_client import get_redis
+from service.redis_client import incr_with_ttl, redis_call
 
 # from service.rate_limiter import rate_limit, get_rate_limiter, check_brute_force_protection
 
@@ -39,10 +41,9 @@ def get_client_ip():
 
 def check_login_lock(ip_address):
     """Check if IP is locked due to too many failed attempts"""
-    redis_client = get_redis()
     key = f"{ip_address}_login_fail"
     try:
-        fail_count = redis_client.get(key)
+        fail_count = redis_call(lambda redis_client: redis_client.get(key))
         if fail_count and int(fail_count) >= 10:
             return True
     except Exception:
@@ -53,18 +54,12 @@ def check_login_lock(ip_address):
 
 def record_login_failure(ip_address):
     """Record a login failure"""
-    redis_client = get_redis()
     key = f"{ip_address}_login_fail"
     try:
-        current_count = redis_client.get(key)
-        if current_count:
-            # Increment existing value
-            new_count = redis_client.incr(key)
-        else:
-            # Set initial value to 1 with 30 minutes expiry
-            redis_client.setex(key, 1800, 1)  # 1800 seconds = 30 minutes
-            new_count = 1
-        return new_count
+        # 初回は30分の有効期限付きで作成し、以降は加算のみ（1往復）
+        return redis_call(
+            lambda redis_client: incr_with_ttl(redis_client, key, 1800)
+        )  # 1800 seconds = 30 minutes
     except Exception:
         # Redis接続エラー時は記録できない
         return 0
@@ -133,22 +128,18 @@ def index():
         admin_user_service = AdminUsersService(admin_user_repo)
         admin_user = admin_user_service.find_by_id(admin_user_id)
         customers_repo = CustomersRepository(unit_of_work.session)
-        customer_service = CustomersService(customers_repo)
         posts_repo = PostsRepository(unit_of_work.session)
-        posts_service = PostsService(posts_repo)
         
-        # Get total counts for dashboard
-        total_customers = customers_repo.count()  # Get total customer count
-        total_admin_users = admin_user_repo.count()  # Get total admin user count
-        total_posts = posts_repo.count()  # Get total posts count
+        # Get total counts for dashboard (kept in Redis by CountersService)
+        totals = CountersService().totals(customers_repo, admin_user_repo, posts_repo)
         
         unit_of_work.commit()
     return render_template(
         "admin_user/index.html",
         login_name=admin_user.name,
-        total_customers=total_customers,
-        total_admin_users=total_admin_users,
-        total_posts=total_posts,
+        total_customers=totals["customers"],
+        total_admin_users=totals["admin_users"],
+        total_posts=totals["posts"],
     )
 
 
@@ -157,6 +148,8 @@ def index():
 def customers_list():
     customer_page = request.args.get("page", 1, type=int)
     search_query = request.args.get("search", "").strip()
+    after_id = request.args.get("after_id", type=int)
+    before_id = request.args.get("before_id", type=int)
     
     admin_user_id = session.get("admin_user_id")
     with UnitOfWork() as unit_of_work:
@@ -166,12 +159,16 @@ def customers_list():
         customers_repo = CustomersRepository(unit_of_work.session)
         customer_service = CustomersService(customers_repo)
         
+        customers_page = None
+        customers_block = None
+        customers_total = None
         if search_query:
             customers = customer_service.search_by_name(search_query, customer_page)
             customers_block = customer_service.search_block_count(search_query)
         else:
-            customers = customer_service.find_all(customer_page)
-            customers_block = customer_service.block_count()
+            customers_page = customer_service.find_page(after_id, before_id)
+            customers = customers_page.items
+            customers_total = customer_service.approximate_count()
         
         unit_of_work.commit()
     return render_template(
@@ -180,13 +177,16 @@ def customers_list():
         login_name=admin_user.name,
         customers_block=customers_block,
         customer_page=customer_page,
+        customers_page=customers_page,
+        customers_total=customers_total,
     )
 
 
 @bp.route("/admin/admin-users")
 @admin_login_required
 def admin_users_list():
-    admin_page = request.args.get("page", 1, type=int)
+    after_id = request.args.get("after_id", type=int)
+    before_id = request.args.get("before_id", type=int)
     
     admin_user_id = session.get("admin_user_id")
     with UnitOfWork() as unit_of_work:
@@ -194,29 +194,24 @@ def admin_users_list():
         admin_user_service = AdminUsersService(admin_user_repo)
         admin_user = admin_user_service.find_by_id(admin_user_id)
         
-        admin_users = admin_user_service.find_all(admin_page)
-        admin_users_block = admin_user_service.block_count()
+        admin_users_page = admin_user_service.find_page(after_id, before_id)
+        admin_users_total = admin_user_service.approximate_count()
         
         unit_of_work.commit()
     return render_template(
         "admin_user/admin_users_list.html",
-        admin_users=admin_users,
+        admin_users=admin_users_page.items,
         login_name=admin_user.name,
-        admin_users_block=admin_users_block,
-        admin_page=admin_page,
+        admin_users_page=admin_users_page,
+        admin_users_total=admin_users_total,
     )
 
 
 @bp.route("/admin/customers/<customer_id>")
 @admin_login_required
 def show_customer(customer_id):
-    post_page = request.args.get("post_page")
-    if post_page is None:
-        post_page = 1
-    elif str(post_page).isdecimal() is False:
-        post_page = 1
-    else:
-        post_page = int(post_page)
+    after_id = request.args.get("after_id", type=int)
+    before_id = request.args.get("before_id", type=int)
 
     with UnitOfWork() as unit_of_work:
         customer_repo = CustomersRepository(unit_of_work.session)
@@ -224,14 +219,17 @@ def show_customer(customer_id):
         customer = customer_service.get_customer_by_id(customer_id)
         post_repo = PostsRepository(unit_of_work.session)
         posts_service = PostsService(post_repo)
-        posts = posts_service.find_by_customer_id_for_page(customer_id, post_page)
-        posts_block = posts_service.block_count()
+        posts_page = posts_service.find_page_by_customer_id(
+            customer_id, after_id, before_id
+        )
+        posts_total = CountersService().customer_post_count(customer.id, post_repo)
     return render_template(
         "admin_user/customer.html",
         customer=customer,
-        posts=posts,
-        post_page=post_page,
-        posts_block=posts_block,
+        posts=posts_page.items,
+        posts_page=posts_page,
+        posts_total=posts_total,
+        image_savings=image_optimizer.savings(customer.wordpress_url),
     )
 
 
@@ -259,6 +257,7 @@ def register_customer():
                 customers_service.check_use_email(request.form["email"])
                 customers_service.register_customer(new_customer.dict())
                 unit_of_work.commit()
+                CountersService().add("customers")
                 return redirect(url_for("admin_user.index"))
     except CustomerValidationError as e:
         flash(message=str(e), category="warning")
@@ -279,6 +278,7 @@ def delete_customer():
             customer_service = CustomersService(customer_repo)
             customer_service.remove_customer_by_id(customer_id)
             unit_of_work.commit()
+        CountersService().remove_customer(int(customer_id))
     return redirect(url_for("admin_user.index"))
 
 
@@ -329,6 +329,7 @@ def register_user():
                 new_admin_user.generate_hash_password()
                 admin_user_service.register_user(new_admin_user.dict())
                 unit_of_work.commit()
+                CountersService().add("admin_users")
                 return redirect(url_for("admin_user.index"))
     except AdminUserValidationError as e:
         flash(message=str(e), category="warning")
@@ -349,6 +350,7 @@ def delete_user():
             admin_user_service = AdminUsersService(admin_user_repo)
             admin_user_service.remove_user(admin_user_id)
             unit_of_work.commit()
+        CountersService().add("admin_users", -1)
     return redirect(url_for("admin_user.index"))
 
 
@@ -17,6 +17,7 @@ from service.admin_users_service import (
 )
 from repository.unit_of_work import UnitOfWork
 from service.customers_service import CustomersService
+from service.payment_cache_service import PaymentCacheService
 # from service.rate_limiter import rate_limit
 
 
@@ -76,3 +77,27 @@ def admin_users():
             admin_users_service = AdminUsersService(admin_users_repo)
             result = admin_users_service.register_users(admin_users)
     return jsonify({"status": "success", "data": result})
+
+
+@bp.route("/api/v1/payments/invalidate", methods=("POST",))
+def invalidate_payment_cache():
+    """
+    支払い情報・請求書のキャッシュを破棄する（Stripeのwebhookを受けた側から呼ぶ）。
+    message に customer_id / email / stripe_customer_id のいずれかを指定する。
+    """
+    message = request.json["message"]
+    customer_id = message.get("customer_id")
+    if customer_id is None and message.get("email"):
+        with UnitOfWork() as unit_of_work:
+            customers_repo = CustomersRepository(unit_of_work.session)
+            customer = customers_repo.find_by_email(message["email"])
+            customer_id = customer.id if customer is not None else None
+    payment_cache_service = PaymentCacheService()
+    if customer_id is None and message.get("stripe_customer_id"):
+        customer_id = payment_cache_service.find_customer_id(
+            message["stripe_customer_id"]
+        )
+    if customer_id is None:
+        return jsonify({"status": "success", "invalidated": False})
+    payment_cache_service.invalidate(int(customer_id))
+    return jsonify({"status": "success", "invalidated": True, "customer_id": customer_id})
@@ -2,13 +2,22 @@ import os
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import redis
+
+from repository.admin_user_repository import AdminUserRepository
 from repository.customers_repository import CustomersRepository
 from repository.posts_repository import PostsRepository
 from repository.unit_of_work import UnitOfWork
+from service.async_batch import run_async_batch
+from service.batch_jobs import BatchJobService
+from service.counters_service import CountersService
 from service.customers_service import CustomersService
+from service.health_service import HealthService
 from service.meta_service import MetaService, MetaApiError
 from service.posts_service import PostsService
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
 from service.slack_service import SlackService, send_support_team
+from service.sync_journal import SyncJournal
 from service.wordpress_service_factory import WordpressServiceFactory
 from domain.customers import Customer
 from util.const import EXPIRED, NOT_CONNECTED
@@ -23,132 +32,370 @@ bp = Blueprint("batch", __name__)
 # 並列実行の最大スレッド数
 MAX_WORKERS = 12  # 必要に応じて調整
 
+# バッチの実行方式: thread（ThreadPoolExecutor） / async（asyncio）
+BATCH_ENGINE = os.getenv("BATCH_ENGINE", "thread")
+
+# トークンの有効期限の何日前から更新対象にするか
+TOKEN_REFRESH_WINDOW_DAYS = int(os.getenv("TOKEN_REFRESH_WINDOW_DAYS", "14"))
+# 更新日を顧客ごとに何日の範囲でずらすか（WINDOW より小さくする）
+TOKEN_REFRESH_SPREAD_DAYS = int(os.getenv("TOKEN_REFRESH_SPREAD_DAYS", "7"))
+
+# /batch/health の一括確認はリクエストの外で実行する（全顧客分はタイムアウトを超えるため）
+HEALTH_PROBE_RUNNING_KEY = "health:probe_running"
+# 実行中を示すロックの有効期限（実行中のプロセスが落ちた場合の保険）
+HEALTH_PROBE_RUNNING_TTL = 1800
+_health_probe_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="health-probe"
+)
+
 
-def handle_customer_auth(customer: Customer):
-    """Facebookトークンの更新処理"""
+def handle_customer_auth(customer: Customer) -> str:
+    """
+    Facebookトークンの更新処理。有効期限が近いものだけ更新する。
+    :return: refreshed / skipped / failed
+    """
     with UnitOfWork() as unit_of_work:
-        meta_service = MetaService()
+        meta_service = MetaService(governed=True)
         customers_repo = CustomersRepository(unit_of_work.session)
         customer_service = CustomersService(customers_repo)
         try:
-            new_token = meta_service.refresh_token(customer.facebook_token)
-            customer_service.update_facebook_token(customer.id, new_token)
+            if customer.token_expires_at is None:
+                # 有効期限が未記録のトークンは、まず debug_token で調べる
+                customer.token_expires_at = lookup_token_expires_at(
+                    meta_service, customer.facebook_token
+                )
+                if customer.token_expires_at is not None:
+                    customer_service.update_token_expires_at(
+                        customer.id, customer.token_expires_at
+                    )
+            if not customer.token_refresh_due(
+                TOKEN_REFRESH_WINDOW_DAYS, TOKEN_REFRESH_SPREAD_DAYS
+            ):
+                unit_of_work.commit()
+                return "skipped"
+            new_token, expires_at = meta_service.refresh_token(customer.facebook_token)
+            if expires_at is None:
+                expires_at = lookup_token_expires_at(meta_service, new_token)
+            customer_service.update_facebook_token(customer.id, new_token, expires_at)
             unit_of_work.commit()
+            return "refreshed"
         except Exception as e:
             send_alert(e, customer)
             unit_of_work.rollback()
+            return "failed"
+
 
+def lookup_token_expires_at(meta_service: MetaService, access_token: str):
+    """取得できなければ None（その場合は更新対象として扱う）"""
+    try:
+        return meta_service.debug_token(access_token)
+    except MetaApiError as e:
+        print(f"debug_token failed: {e}")
+        return None
 
-def handle_customer(customer: Customer):
-    """投稿データの取得 & WordPress連携処理"""
+
+def handle_customer(customer: Customer, prefetched=None) -> bool:
+    """
+    投稿データの取得 & WordPress連携処理（成功時True）
+    :param prefetched: バッチリクエストで取得済みの投稿リスト、または MetaApiError
+    """
     with UnitOfWork() as unit_of_work:
         posts_repo = PostsRepository(unit_of_work.session)
         posts_service = PostsService(posts_repo)
-        meta_service = MetaService()
+        meta_service = MetaService(governed=True)
         customer_repository = CustomersRepository(unit_of_work.session)
         try:
             print(f"<Start> customer_id: {customer.id}, customer_name: {customer.name}")
 
             wordpress_service = WordpressServiceFactory.create_service(customer)
-            instagram_media_list = meta_service.get_media_list(
-                customer.facebook_token, customer.instagram_business_account_id
+            if isinstance(prefetched, MetaApiError):
+                raise prefetched
+            if prefetched is not None:
+                instagram_media_list = prefetched
+            else:
+                instagram_media_list = meta_service.get_media_list_for_sync(
+                    customer.facebook_token,
+                    customer.instagram_business_account_id,
+                    customer.media_watermark(),
+                )
+            linked_media_ids = posts_service.find_linked_media_ids(
+                customer.id, instagram_media_list
             )
-            linked_post = posts_service.find_by_customer_id(customer.id)
             targets = posts_service.abstract_targets(
-                instagram_media_list, linked_post, customer.start_date
+                instagram_media_list, linked_media_ids, customer.start_date
             )
-            results = wordpress_service.posts(targets)
-            posts_service.save_posts(results, customer.id)
+            # 投稿できたものから記録し、途中で失敗しても次回は投稿し直さない
+            journal = SyncJournal(customer.id)
+            results = journal.sync(wordpress_service, targets)
+            saved = posts_service.save_posts(results, customer.id)
+            update_watermark(customer, instagram_media_list, customer_repository)
             unit_of_work.commit()
+            journal.clear(result["media_id"] for result in results)
+            CountersService().add_posts(customer.id, saved["inserted"])
+            return True
 
         except MetaApiError as e:
-            if str(e.error_subcode) == "463":
-                customer_repository.update(customer.id, instagram_token_status=EXPIRED)
-                SlackService().send_alert(
-                    f"463_認証切れ: {customer.name} ```{e.message}```"
-                )
-                send_support_team(customer)
-                unit_of_work.commit()
-            elif str(e.error_subcode) == "460":
-                customer_repository.update(customer.id, instagram_token_status=EXPIRED)
-                SlackService().send_alert(
-                    f"460_パスワードが変更されました: {customer.name} ```{e.message}```"
-                )
-                send_support_team(customer)
-                unit_of_work.commit()
-            elif str(e.error_subcode) == "33":
-                customer_repository.update(
-                    customer.id, instagram_token_status=NOT_CONNECTED
-                )
-                SlackService().send_alert(
-                    f"インスタグラムアカウントがみつかりません: {customer.name}, {customer.instagram_business_account_id}"
-                )
-                unit_of_work.commit()
-            else:
-                send_alert(e, customer)
-                unit_of_work.rollback()
+            handle_meta_api_error(e, customer, unit_of_work, customer_repository)
         except Exception as e:
             send_alert(e, customer)
             unit_of_work.rollback()
+        return False
+
+
+def update_watermark(
+    customer: Customer,
+    instagram_media_list: list,
+    customer_repository: CustomersRepository,
+):
+    """今回取得した投稿はすべて処理済みなので、次回はその最新投稿以降だけを取得する"""
+    if not instagram_media_list:
+        return
+    newest = max(media.timestamp for media in instagram_media_list)
+    CustomersService(customer_repository).update_media_synced_at(customer.id, newest)
+
+
+def handle_meta_api_error(
+    e: MetaApiError,
+    customer: Customer,
+    unit_of_work: UnitOfWork,
+    customer_repository: CustomersRepository,
+):
+    """Meta APIのエラーコードに応じて顧客のトークン状態を更新"""
+    if str(e.error_subcode) == "463":
+        customer_repository.update(customer.id, instagram_token_status=EXPIRED)
+        SlackService().send_alert(
+            f"463_認証切れ: {customer.name} ```{e.message}```"
+        )
+        send_support_team(customer)
+        unit_of_work.commit()
+    elif str(e.error_subcode) == "460":
+        customer_repository.update(customer.id, instagram_token_status=EXPIRED)
+        SlackService().send_alert(
+            f"460_パスワードが変更されました: {customer.name} ```{e.message}```"
+        )
+        send_support_team(customer)
+        unit_of_work.commit()
+    elif str(e.error_subcode) == "33":
+        customer_repository.update(
+            customer.id, instagram_token_status=NOT_CONNECTED
+        )
+        SlackService().send_alert(
+            f"インスタグラムアカウントがみつかりません: {customer.name}, {customer.instagram_business_account_id}"
+        )
+        unit_of_work.commit()
+    else:
+        send_alert(e, customer)
+        unit_of_work.rollback()
+
+
+def load_linked_media_ids(customer: Customer, instagram_media_list: list) -> set[str]:
+    """取得した投稿のうち連携済みのmedia_id（非同期バッチ用）"""
+    with UnitOfWork() as unit_of_work:
+        posts_service = PostsService(PostsRepository(unit_of_work.session))
+        return posts_service.find_linked_media_ids(customer.id, instagram_media_list)
+
+
+def save_results(customer: Customer, results: list[dict], instagram_media_list: list):
+    """連携結果を保存（非同期バッチ用）"""
+    with UnitOfWork() as unit_of_work:
+        posts_service = PostsService(PostsRepository(unit_of_work.session))
+        saved = posts_service.save_posts(results, customer.id)
+        customer_repository = CustomersRepository(unit_of_work.session)
+        update_watermark(customer, instagram_media_list, customer_repository)
+        unit_of_work.commit()
+    SyncJournal(customer.id).clear(result["media_id"] for result in results)
+    CountersService().add_posts(customer.id, saved["inserted"])
+
+
+def handle_async_error(customer: Customer, e: Exception):
+    """非同期バッチで発生したエラーの処理"""
+    if isinstance(e, MetaApiError):
+        with UnitOfWork() as unit_of_work:
+            customer_repository = CustomersRepository(unit_of_work.session)
+            handle_meta_api_error(e, customer, unit_of_work, customer_repository)
+    else:
+        send_alert(e, customer)
 
 
 def send_alert(e: Exception, customer):
     """エラーログをSlackに送信"""
     err_txt = str(e)
-    stack_trace = traceback.format_exc()
+    stack_trace = "".join(traceback.format_exception(e))
     msg = f"```{customer.name}\n\n{err_txt}\n\n{stack_trace}```"
     SlackService().send_alert(msg)
 
 
-def process_batch():
-    """バッチ処理: 各顧客の投稿データを処理"""
+def prefetch_media_lists(customers: list[Customer]) -> dict:
+    """投稿一覧をバッチリクエストでまとめて取得。失敗した場合は顧客ごとの取得に任せる"""
+    if not customers:
+        return {}
+    try:
+        return MetaService(governed=True).get_media_lists_for_sync(customers)
+    except Exception as exc:
+        print(f"Meta batch fetch failed: {str(exc)}")
+        return {}
+
+
+def find_customer(customer_id: int) -> Customer | None:
+    with UnitOfWork() as unit_of_work:
+        customer_repo = CustomersRepository(unit_of_work.session)
+        return customer_repo.find_by_id(customer_id)
+
+
+def process_tasks(job_service: BatchJobService, tasks: list[dict]):
+    """
+    キューから取り出した顧客単位のタスクを順に実行（バッチワーカー用）。
+    投稿一覧は先にバッチリクエストでまとめて取得する。
+    """
+    pending = []
+    for task in tasks:
+        customer = find_customer(task["customer_id"])
+        if customer is None:
+            # 処理待ちの間に削除された顧客は完了扱い
+            job_service.mark_done(task)
+        else:
+            pending.append((task, customer))
+    media_lists = prefetch_media_lists([customer for _, customer in pending])
+    for task, customer in pending:
+        try:
+            ok = handle_customer(customer, media_lists.get(customer.id))
+        except Exception as exc:
+            print(f"Exception for customer {customer.name}: {str(exc)}")
+            ok = False
+        record_task_result(job_service, task, ok)
+
+
+def process_tasks_async(job_service: BatchJobService, tasks: list[dict]):
+    """複数タスクを非同期エンジンでまとめて実行（バッチワーカー用）"""
+    customers = []
+    for task in tasks:
+        customer = find_customer(task["customer_id"])
+        if customer is None:
+            job_service.mark_done(task)
+        else:
+            customers.append(customer)
+    results = run_async_batch(
+        customers, load_linked_media_ids, save_results, handle_async_error
+    )
+    for task in tasks:
+        if task["customer_id"] in results:
+            record_task_result(job_service, task, results[task["customer_id"]])
+
+
+def record_task_result(job_service: BatchJobService, task: dict, ok: bool):
+    if ok:
+        job_service.mark_done(task)
+    elif not job_service.requeue(task):
+        job_service.mark_failed(task)
+
+
+def process_batch_auth() -> dict[str, int]:
+    """バッチ処理: Facebookトークンの更新（有効期限が近いもののみ）"""
     with UnitOfWork() as unit_of_work:
         customer_repo = CustomersRepository(unit_of_work.session)
         customer_service = CustomersService(customer_repo)
         customers = customer_service.find_already_linked()
 
+    summary = {"refreshed": 0, "skipped": 0, "failed": 0}
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         futures = {
-            executor.submit(handle_customer, customer): customer
+            executor.submit(handle_customer_auth, customer): customer
             for customer in customers
         }
         for future in as_completed(futures):
             try:
-                future.result()
+                summary[future.result()] += 1
             except Exception as exc:
                 customer = futures[future]
                 print(f"Exception for customer {customer.name}: {str(exc)}")
+                summary["failed"] += 1
+    print(f"<Auth> {summary}")
+    return summary
 
 
-def process_batch_auth():
-    """バッチ処理: Facebookトークンの更新"""
+def process_health_probe() -> dict:
+    """バッチ処理: 連携済みの顧客のWordPress疎通・決済状態を確認して保存"""
     with UnitOfWork() as unit_of_work:
         customer_repo = CustomersRepository(unit_of_work.session)
         customer_service = CustomersService(customer_repo)
         customers = customer_service.find_already_linked()
+    summary = HealthService().probe_all(customers)
+    print(f"<HealthProbe> {summary}")
+    return summary
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {
-            executor.submit(handle_customer_auth, customer): customer
-            for customer in customers
-        }
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as exc:
-                customer = futures[future]
-                print(f"Exception for customer {customer.name}: {str(exc)}")
+
+def run_health_probe_in_background() -> None:
+    try:
+        process_health_probe()
+    except Exception as e:
+        print(f"<HealthProbe> failed: {e}")
+    finally:
+        try:
+            get_shared_redis().delete(HEALTH_PROBE_RUNNING_KEY)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+
+@bp.errorhandler(redis.RedisError)
+def handle_redis_error(e):
+    """ジョブの管理はRedisが無いとできないため、LocalCache には切り替えずに 503 を返す"""
+    mark_shared_redis_failed(e)
+    return jsonify({"status": "error", "message": "redis is unavailable"}), 503
 
 
 @bp.route("/batch", methods=("POST",))
 def execute():
-    """投稿データの取得バッチを非同期実行"""
-    process_batch()
-    return jsonify({"status": "success"})
+    """投稿データの取得バッチをキューに登録（処理はバッチワーカーが行う）"""
+    with UnitOfWork() as unit_of_work:
+        customer_repo = CustomersRepository(unit_of_work.session)
+        customer_service = CustomersService(customer_repo)
+        customers = customer_service.find_already_linked()
+    job_service = BatchJobService(get_shared_redis())
+    job_id, created = job_service.enqueue([customer.id for customer in customers])
+    return jsonify({"status": "success", "job_id": job_id, "created": created})
+
+
+@bp.route("/batch/jobs/<job_id>", methods=("GET",))
+def job_status(job_id):
+    """バッチジョブの進捗"""
+    status = BatchJobService(get_shared_redis()).status(job_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "job not found"}), 404
+    return jsonify({"status": "success", "job": status})
+
+
+@bp.route("/batch/jobs/<job_id>/retry", methods=("POST",))
+def retry_job(job_id):
+    """失敗した顧客のみ再実行"""
+    count = BatchJobService(get_shared_redis()).retry_failed(job_id)
+    return jsonify({"status": "success", "job_id": job_id, "retried": count})
+
+
+@bp.route("/batch/counters", methods=("POST",))
+def rebuild_counters():
+    """管理画面の件数をDBから数え直す（定期実行用）"""
+    with UnitOfWork() as unit_of_work:
+        totals = CountersService().rebuild(
+            CustomersRepository(unit_of_work.session),
+            AdminUserRepository(unit_of_work.session),
+            PostsRepository(unit_of_work.session),
+        )
+    return jsonify({"status": "success", "totals": totals})
+
+
+@bp.route("/batch/health", methods=("POST",))
+def execute_health_probe():
+    """顧客のWordPress疎通・決済状態をまとめて確認（定期実行用）。確認はバックグラウンドで行う"""
+    if not get_shared_redis().set(
+        HEALTH_PROBE_RUNNING_KEY, 1, nx=True, ex=HEALTH_PROBE_RUNNING_TTL
+    ):
+        return jsonify({"status": "success", "started": False})
+    _health_probe_executor.submit(run_health_probe_in_background)
+    return jsonify({"status": "success", "started": True}), 202
 
 
 @bp.route("/batch/auth", methods=("POST",))
 def execute_auth():
     """Facebook認証バッチを非同期実行"""
-    process_batch_auth()
-    return jsonify({"status": "success"})
+    summary = process_batch_auth()
+    return jsonify({"status": "success", **summary})
@@ -29,19 +29,23 @@ from repository.posts_repository import PostsRepository
 from repository.unit_of_work import UnitOfWork
 from repository.customers_repository import CustomersRepository
 from service.customers_service import CustomersService
+from service.counters_service import CountersService
+from service.health_service import HealthService
+from service.payment_cache_service import PaymentCacheService
 from domain.errors import CustomerNotFoundError, CustomerAuthError
 from service.openai_service import OpenAIService
 from service.posts_service import PostsService
 from service.meta_service import MetaService, MetaApiError, MetaAccountNotFoundError
-from service.redis_client import get_redis
+from service.redis_client import incr_with_ttl, redis_call
 from service.slack_service import SlackService
+from service.sync_journal import SyncJournal
 from service.wordpress_service import WordpressAuthError
 from service.wordpress_service_stripe import (
     WordpressStripeAuthError,
 )
 from service.wordpress_service_factory import WordpressServiceFactory
 from domain.instagram_media import convert_to_json
-from domain.customers import Customer, get_payment_info
+from domain.customers import Customer
 from domain.errors import CustomerValidationError
 from service.account_service import AccountService
 from service.sendgrid_service import SendGridService
@@ -68,10 +72,9 @@ def login_required(view):
 
 def check_customer_login_lock(ip_address):
     """Check if IP is locked due to too many failed customer login attempts"""
-    redis_client = get_redis()
     key = f"{ip_address}_customer_login_fail"
     try:
-        fail_count = redis_client.get(key)
+        fail_count = redis_call(lambda redis_client: redis_client.get(key))
         if fail_count and int(fail_count) >= 10:
             return True
     except Exception:
@@ -82,18 +85,12 @@ def check_customer_login_lock(ip_address):
 
 def record_customer_login_failure(ip_address):
     """Record a customer login failure"""
-    redis_client = get_redis()
     key = f"{ip_address}_customer_login_fail"
     try:
-        current_count = redis_client.get(key)
-        if current_count:
-            # Increment existing value
-            new_count = redis_client.incr(key)
-        else:
-            # Set initial value to 1 with 30 minutes expiry
-            redis_client.setex(key, 1800, 1)  # 1800 seconds = 30 minutes
-            new_count = 1
-        return new_count
+        # 初回は30分の有効期限付きで作成し、以降は加算のみ（1往復）
+        return redis_call(
+            lambda redis_client: incr_with_ttl(redis_client, key, 1800)
+        )  # 1800 seconds = 30 minutes
     except Exception:
         # Redis接続エラー時は記録できない
         return 0
@@ -169,9 +166,11 @@ def send_verification_email():
             customer_service = CustomersService(customer_repo)
             customer_service.check_use_email(email)
             token = generate_register_uuid()
-            redis_cli = get_redis()
-            account_service = AccountService(redis_cli)
-            account_service.set_temp_register(token, email)
+            redis_call(
+                lambda redis_cli: AccountService(redis_cli).set_temp_register(
+                    token, email
+                )
+            )
             SendGridService().send_register_mail(email, token)
         return render_template("customer/mail_confirm.html")
     except CustomerValidationError as e:
@@ -183,9 +182,9 @@ def send_verification_email():
 @protected
 def verify_email_token():
     token = request.args.get("token")
-    redis_cli = get_redis()
-    account_service = AccountService(redis_cli)
-    user = account_service.get_temp_register(token)
+    user = redis_call(
+        lambda redis_cli: AccountService(redis_cli).get_temp_register(token)
+    )
     if user is None:
         flash(
             "メール認証URLの有効期限が切れています。新しくメールアドレスを入力してください。",
@@ -287,7 +286,7 @@ def index():
             dashboard_status = DashboardStatus.AUTH_PENDING.value
         else:
             dashboard_status = DashboardStatus.HEALTHY.value
-    a_root_status = customer.a_root_status()
+    a_root_status = HealthService().a_root_status(customer)
     return render_template(
         "customer/index.html",
         customer=customer,
@@ -305,7 +304,7 @@ def account():
         customer_repo = CustomersRepository(unit_of_work.session)
         customers_service = CustomersService(customer_repo)
         customer = customers_service.get_customer_by_id(customer_id)
-        a_root_status = customer.a_root_status()
+    a_root_status = HealthService().a_root_status(customer)
     return render_template(
         "customer/account.html",
         customer=customer,
@@ -366,11 +365,17 @@ def facebook_auth():
                 f"```[認証]\nID:{customer_id}, 名前: {customer.name}```"
             )
             meta_service = MetaService()
-            long_token = meta_service.get_long_term_token(access_token)
+            long_token, token_expires_at = meta_service.get_long_term_token(
+                access_token
+            )
             SlackService().send_message(f"```[トークン]\n{long_token}```")
             instagram = meta_service.get_instagram_account(access_token)
             customer_service.update_customer_after_login(
-                customer_id, long_token, instagram["id"], instagram["username"]
+                customer_id,
+                long_token,
+                instagram["id"],
+                instagram["username"],
+                token_expires_at,
             )
             unit_of_work.commit()
             flash(
@@ -442,6 +447,7 @@ def register():
             customers_repo = CustomersRepository(unit_of_work.session)
             customer_service = CustomersService(customers_repo)
 
+            removed_id = None
             exist = customer_service.find_by_email(customer.email)
             if exist:
                 if exist.check_password(password):
@@ -449,9 +455,13 @@ def register():
                 else:
                     customer_service.remove_customer_by_id(exist.id)
                     unit_of_work.session.flush()
+                    removed_id = exist.id
 
             customer_service.register_customer(customer.dict())
             unit_of_work.commit()
+            if removed_id is not None:
+                CountersService().remove_customer(removed_id)
+            CountersService().add("customers")
 
             new_customer = customer_service.get_customer_by_email(customer.email)
             session["customer_id"] = new_customer.id
@@ -495,7 +505,6 @@ def get_posts_timeline():
         with UnitOfWork() as unit_of_work:
             posts_repo = PostsRepository(unit_of_work.session)
             posts_service = PostsService(posts_repo)
-            posts = posts_service.find_by_customer_id(customer_id)
 
             # Group posts by date for timeline chart
             from collections import defaultdict
@@ -510,14 +519,12 @@ def get_posts_timeline():
                 date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
                 daily_counts[date] = 0
 
-            for post in posts:
-                if post.created_at and post.wordpress_link:  # Only synced posts
-                    date_str = post.created_at.strftime("%Y-%m-%d")
-                    daily_counts[date_str] += 1
-
-                    # Count media types (from Instagram data if available)
-                    # For now, we'll assume all are images since we don't store media_type
-                    media_type_counts["IMAGE"] += 1
+            # Counted in MySQL (synced posts only)
+            daily_counts.update(posts_service.daily_counts(customer_id))
+            total_posts = sum(daily_counts.values())
+            if total_posts:
+                # For now, we'll assume all are images since we don't store media_type
+                media_type_counts["IMAGE"] = total_posts
 
             # Sort dates and prepare data for Chart.js
             sorted_dates = sorted(daily_counts.keys())
@@ -531,8 +538,10 @@ def get_posts_timeline():
                 {
                     "timeline": {"labels": labels, "data": data},
                     "media_types": dict(media_type_counts),
-                    "total_posts": len([p for p in posts if p.wordpress_link]),
-                    "total_instagram_posts": len(posts),
+                    "total_posts": total_posts,
+                    "total_instagram_posts": posts_service.count_by_customer_id(
+                        customer_id
+                    ),
                 }
             )
 
@@ -549,7 +558,6 @@ def get_monthly_stats():
         with UnitOfWork() as unit_of_work:
             posts_repo = PostsRepository(unit_of_work.session)
             posts_service = PostsService(posts_repo)
-            posts = posts_service.find_by_customer_id(customer_id)
 
             from collections import defaultdict
             from datetime import datetime, timedelta
@@ -563,10 +571,8 @@ def get_monthly_stats():
                 month_key = date.strftime("%Y-%m")
                 monthly_counts[month_key] = 0
 
-            for post in posts:
-                if post.created_at and post.wordpress_link:  # Only synced posts
-                    month_key = post.created_at.strftime("%Y-%m")
-                    monthly_counts[month_key] += 1
+            # Counted in MySQL (synced posts only)
+            monthly_counts.update(posts_service.monthly_counts(customer_id))
 
             # Sort months and prepare data
             sorted_months = sorted(monthly_counts.keys())
@@ -624,16 +630,18 @@ def sync_selected_posts():
 
             # Get Instagram posts data
             meta_service = MetaService()
-            media_id_list = meta_service.get_media_list(
+            selected_posts = []
+            remaining_ids = set(selected_post_ids)
+            # 選択された投稿がすべて見つかった時点でページの取得をやめる
+            for post in meta_service.iter_media(
                 customer.facebook_token, customer.instagram_business_account_id
-            )
-
-            print(f"Total Instagram posts: {len(media_id_list)}")
-
-            # Filter only selected posts
-            selected_posts = [
-                post for post in media_id_list if post.id in selected_post_ids
-            ]
+            ):
+                if post.id in remaining_ids:
+                    selected_posts.append(post)
+                    remaining_ids.discard(post.id)
+                    if not remaining_ids:
+                        break
+            selected_posts.reverse()
 
             print(f"Selected posts found: {len(selected_posts)}")
             for post in selected_posts:
@@ -645,11 +653,14 @@ def sync_selected_posts():
             # Test WordPress connection first
             wordpress_service = WordpressServiceFactory.create_service(customer)
 
-            # Sync to WordPress
-            result = wordpress_service.posts(selected_posts)
-            posts_service.save_posts(result, customer_id)
+            # Sync to WordPress（前回途中まで投稿済みのものは投稿し直さない）
+            journal = SyncJournal(customer_id)
+            result = journal.sync(wordpress_service, selected_posts)
+            saved = posts_service.save_posts(result, customer_id)
 
             unit_of_work.commit()
+            journal.clear(r["media_id"] for r in result)
+            CountersService().add_posts(customer_id, saved["inserted"])
 
             return jsonify(
                 {
@@ -688,16 +699,19 @@ def post_wordpress():
             customer = customer_service.get_customer_by_id(customer_id)
             wordpress_service = WordpressServiceFactory.create_service(customer)
             meta_service = MetaService()
-            media_id_list = meta_service.get_media_list(
-                customer.facebook_token, customer.instagram_business_account_id
+            targets = posts_service.collect_targets(
+                customer.id,
+                meta_service.iter_media(
+                    customer.facebook_token, customer.instagram_business_account_id
+                ),
+                customer.start_date,
             )
-            linked_post = posts_service.find_by_customer_id(customer.id)
-            targets = posts_service.abstract_targets(
-                media_id_list, linked_post, customer.start_date
-            )
-            result = wordpress_service.posts(targets)
-            posts_service.save_posts(result, customer_id)
+            journal = SyncJournal(customer_id)
+            result = journal.sync(wordpress_service, targets)
+            saved = posts_service.save_posts(result, customer_id)
             unit_of_work.commit()
+            journal.clear(r["media_id"] for r in result)
+            CountersService().add_posts(customer_id, saved["inserted"])
             return jsonify({"status": "success"})
     except Exception as e:
         err_txt = str(e)
@@ -746,7 +760,9 @@ def withdraw():
                 product_id = os.getenv("PRODUCT_ID")
 
                 # CAREO APIからstripe_customer_idを取得
-                payment_info = get_payment_info(customer.payment_type, customer.email)
+                # （キャンセルする対象を決めるので、キャッシュした古い値は使わない）
+                payment_cache = PaymentCacheService()
+                payment_info = payment_cache.fresh_payment_info(customer)
                 stripe_customer_id = payment_info.get("stripe_customer_id")
 
                 if stripe_customer_id and product_id:
@@ -762,6 +778,7 @@ def withdraw():
                                 stripe.Subscription.modify(
                                     subscription.id, cancel_at_period_end=True
                                 )
+                    payment_cache.invalidate(customer.id)
 
             except stripe.error.StripeError as e:
                 # Stripeエラーが発生してもアカウント削除は継続
@@ -777,6 +794,8 @@ def withdraw():
             # 顧客データを削除
             customer_repo.delete(customer_id)
             unit_of_work.commit()
+            CountersService().remove_customer(customer_id)
+            PaymentCacheService().invalidate(customer_id)
 
             # セッションをクリア
             session.clear()
@@ -802,42 +821,15 @@ def get_invoices():
             customers_service = CustomersService(customer_repo)
             customer = customers_service.get_customer_by_id(customer_id)
 
-            if customer.payment_type != PAYMENT_TYPE_STRIPE:
-                return jsonify({"error": "Stripe請求書は利用できません"})
-
-            # Stripe APIキーを設定（環境変数から取得）
-            import os
-
-            stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-
-            # CAREO APIからstripe_customer_idを毎回取得
-            payment_info = get_payment_info(customer.payment_type, customer.email)
-            stripe_customer_id = payment_info.get("stripe_customer_id")
-
-            if not stripe_customer_id:
-                return jsonify({"error": "Stripe顧客IDが取得できませんでした"})
-
-            # Stripeから請求書を取得
-            invoices = stripe.Invoice.list(customer=stripe_customer_id, limit=10)
-
-            invoice_data = []
-            for invoice in invoices.data:
-                invoice_data.append(
-                    {
-                        "id": invoice.id,
-                        "number": invoice.number,
-                        "amount_paid": invoice.amount_paid / 100,  # centから円に変換
-                        "amount_due": invoice.amount_due / 100,
-                        "currency": invoice.currency,
-                        "status": invoice.status,
-                        "created": invoice.created,
-                        "due_date": invoice.due_date,
-                        "hosted_invoice_url": invoice.hosted_invoice_url,
-                        "invoice_pdf": invoice.invoice_pdf,
-                    }
-                )
+        if customer.payment_type != PAYMENT_TYPE_STRIPE:
+            return jsonify({"error": "Stripe請求書は利用できません"})
+
+        # 支払い情報・請求書はキャッシュから返す（期限切れなら裏で取り直す）
+        invoice_data = PaymentCacheService().invoices(customer)
+        if invoice_data is None:
+            return jsonify({"error": "Stripe顧客IDが取得できませんでした"})
 
-            return jsonify({"invoices": invoice_data})
+        return jsonify({"invoices": invoice_data})
 
     except stripe.error.StripeError as e:
         return jsonify({"error": f"Stripeエラー: {str(e)}"})
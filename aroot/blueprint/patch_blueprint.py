@@ -74,8 +74,15 @@ def patch_1() -> list[str]:
                 continue
 
             try:
-                meta_service.get_media_list(
-                    customer.facebook_token, customer.instagram_business_account_id
+                # トークンの有効性だけを確認するので、1件取得できれば十分
+                next(
+                    meta_service.iter_media(
+                        customer.facebook_token,
+                        customer.instagram_business_account_id,
+                        page_size=1,
+                        max_pages=1,
+                    ),
+                    None,
                 )
                 customer_service.update_instagram_token_status(
                     customer.id, const.CONNECTED
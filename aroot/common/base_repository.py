@@ -58,4 +58,31 @@ class BaseRepository(Generic[ModelType, DomainType], ABC):
                   .limit(limit)
                   .offset(offset)
                   .all())
-        return [self.to_domain(record) for record in records]
\ No newline at end of file
+        return [self.to_domain(record) for record in records]
+
+    def find_page(
+        self, limit: int = 30, after_id: Optional[int] = None, before_id: Optional[int] = None
+    ) -> List[DomainType]:
+        """Find entities with keyset pagination (returns up to limit + 1 rows)."""
+        records = keyset_page(
+            self.session.query(self.model_class), self.model_class.id, limit, after_id, before_id
+        )
+        return [self.to_domain(record) for record in records]
+
+
+def keyset_page(query, id_column, limit, after_id=None, before_id=None, descending=False):
+    """
+    Fetch one page by id instead of OFFSET, so deep pages cost the same as the first one.
+    after_id / before_id are in display order (the next / previous page).
+    Returns up to limit + 1 rows in display order; the extra row tells whether more pages exist.
+    """
+    forward = id_column.desc() if descending else id_column.asc()
+    backward = id_column.asc() if descending else id_column.desc()
+    if before_id is not None:
+        condition = id_column > before_id if descending else id_column < before_id
+        records = query.filter(condition).order_by(backward).limit(limit + 1).all()
+        records.reverse()
+        return records
+    if after_id is not None:
+        query = query.filter(id_column < after_id if descending else id_column > after_id)
+    return query.order_by(forward).limit(limit + 1).all()
\ No newline at end of file
@@ -1,9 +1,67 @@
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic, Any
+from typing import TypeVar, Generic, Any, Callable, Optional
 
 # Type variable for domain entity
 EntityType = TypeVar('EntityType')
 
+# How long list totals are cached (seconds)
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", "60"))
+
+_count_cache: dict[str, tuple[float, int]] = {}
+_count_lock = threading.Lock()
+
+
+def cached_count(key: str, count: Callable[[], int]) -> int:
+    """Cache a COUNT(*) for a short time; list views only need an approximate total."""
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    value = count()
+    with _count_lock:
+        _count_cache[key] = (now + COUNT_CACHE_TTL, value)
+    return value
+
+
+class Page(Generic[EntityType]):
+    """One page of a keyset-paginated list."""
+
+    def __init__(self, items: list, next_after_id: Optional[int], prev_before_id: Optional[int]):
+        self.items = items
+        # Use as ?after_id= for the next page / ?before_id= for the previous page
+        self.next_after_id = next_after_id
+        self.prev_before_id = prev_before_id
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_after_id is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_before_id is not None
+
+    @classmethod
+    def build(
+        cls, rows: list, limit: int, after_id: Optional[int], before_id: Optional[int]
+    ) -> "Page":
+        """Build a page from the limit + 1 rows returned by keyset_page."""
+        has_more = len(rows) > limit
+        if before_id is not None:
+            # The extra row is the first one when paging backwards
+            items = rows[1:] if has_more else rows
+            has_prev, has_next = has_more, True
+        else:
+            items = rows[:limit]
+            has_prev, has_next = after_id is not None, has_more
+        return cls(
+            items,
+            items[-1].id if has_next and items else None,
+            items[0].id if has_prev and items else None,
+        )
+
 
 class BaseService(Generic[EntityType], ABC):
     """Base service class to reduce code duplication across services."""
@@ -22,6 +80,17 @@ class BaseService(Generic[EntityType], ABC):
         """Find all entities with pagination."""
         offset = (page - 1) * self.LIMIT
         return self.repository.find_all(limit=self.LIMIT, offset=offset)
+
+    def find_page(
+        self, after_id: Optional[int] = None, before_id: Optional[int] = None
+    ) -> Page[EntityType]:
+        """Find entities with keyset pagination."""
+        rows = self.repository.find_page(self.LIMIT, after_id, before_id)
+        return Page.build(rows, self.LIMIT, after_id, before_id)
+
+    def approximate_count(self) -> int:
+        """Total for list views, cached for COUNT_CACHE_TTL seconds."""
+        return cached_count(type(self.repository).__name__, self.repository.count)
     
     def find_by_id(self, entity_id: int) -> EntityType:
         """Find entity by ID or raise error."""
@@ -1,12 +1,9 @@
 from abc import ABC, abstractmethod
-import os
 import re
-import tempfile
-import requests
-from urllib.request import urlretrieve
 from typing import Any, List, Optional
 from domain.instagram_media import InstagramMedia
 from domain.wordpress_source import WordPressSource
+from service import http_client, media_transfer
 from service.slack_service import SlackService
 
 
@@ -124,25 +121,25 @@ class WordPressServiceBase(ABC):
         
         return post_ids
     
+    def _stream_to_media_library(self, media_url: str, suffix: str, mime: str) -> Optional[str]:
+        """Stream media from the CDN straight into the WordPress media library."""
+        response, stats = media_transfer.stream_upload(
+            media_url,
+            f"{self.wordpress_source.url}/wp-json/wp/v2/media",
+            {},
+            media_transfer.generate_filename(suffix),
+            mime,
+            headers=self._get_auth_headers(),
+        )
+        print(f"<Transfer> {stats}")
+        if response.status_code == 201:
+            return response.json().get('source_url')
+        return None
+    
     def transfer_image(self, media_url: str) -> Optional[str]:
         """Download and upload image to WordPress."""
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                urlretrieve(media_url, temp_file.name)
-                
-                with open(temp_file.name, 'rb') as file:
-                    files = {'file': file}
-                    response = requests.post(
-                        f"{self.wordpress_source.url}/wp-json/wp/v2/media",
-                        files=files,
-                        headers=self._get_auth_headers()
-                    )
-                
-                os.unlink(temp_file.name)
-                
-                if response.status_code == 201:
-                    return response.json().get('source_url')
-                    
+            return self._stream_to_media_library(media_url, '.jpg', 'image/jpeg')
         except Exception as e:
             SlackService().send_alert(f"Error transferring image: {str(e)}")
             
@@ -151,22 +148,7 @@ class WordPressServiceBase(ABC):
     def transfer_video(self, media_url: str) -> Optional[str]:
         """Download and upload video to WordPress."""
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
-                urlretrieve(media_url, temp_file.name)
-                
-                with open(temp_file.name, 'rb') as file:
-                    files = {'file': file}
-                    response = requests.post(
-                        f"{self.wordpress_source.url}/wp-json/wp/v2/media",
-                        files=files,
-                        headers=self._get_auth_headers()
-                    )
-                
-                os.unlink(temp_file.name)
-                
-                if response.status_code == 201:
-                    return response.json().get('source_url')
-                    
+            return self._stream_to_media_library(media_url, '.mp4', 'video/mp4')
         except Exception as e:
             SlackService().send_alert(f"Error transferring video: {str(e)}")
             
@@ -217,7 +199,7 @@ class WordPressServiceBase(ABC):
                 'status': 'publish'
             }
             
-            response = requests.post(
+            response = http_client.post(
                 f"{self.wordpress_source.url}/wp-json/wp/v2/posts",
                 json=post_data,
                 headers=self._get_auth_headers()
@@ -1,12 +1,13 @@
 import os
 import hashlib
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import requests
 from werkzeug.security import check_password_hash, generate_password_hash
 from domain.errors import CustomerAuthError, CustomerValidationError
 from util.const import DashboardStatus, EXPIRED, NOT_CONNECTED
+from service import http_client
 
 
 class Customer:
@@ -25,6 +26,9 @@ class Customer:
         delete_hash=0,
         payment_type="none",
         type=0,
+        media_synced_at=None,
+        token_expires_at=None,
+        token_refreshed_at=None,
     ):
         self.id = id
         self.name = name
@@ -39,6 +43,9 @@ class Customer:
         self.payment_type = payment_type
         self.delete_hash = delete_hash
         self.type = type
+        self.media_synced_at = media_synced_at
+        self.token_expires_at = token_expires_at
+        self.token_refreshed_at = token_refreshed_at
 
     def set_wordpress_url(self, _wordpress_url):
         wordpress_url = _wordpress_url
@@ -83,7 +90,34 @@ class Customer:
             return None
         return self.start_date + timedelta(hours=9)
 
-    def a_root_status(self) -> int:
+    def media_watermark(self) -> Optional[datetime]:
+        """Instagramから差分取得する際の下限（連携開始日と連携済み最新投稿の新しい方）"""
+        candidates = [d for d in (self.start_date, self.media_synced_at) if d is not None]
+        if not candidates:
+            return None
+        return max(candidates).replace(tzinfo=timezone.utc)
+
+    def token_refresh_due(self, window_days: int, spread_days: int) -> bool:
+        """
+        トークンを更新すべきか。有効期限の window_days 日前から対象にし、
+        顧客ごとに最大 spread_days 日ずらして、更新が同じ日に集中しないようにする。
+        有効期限が分からない場合は更新する。
+        """
+        if self.token_expires_at is None:
+            return True
+        threshold_days = window_days - (self.id % max(spread_days, 1))
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return self.token_expires_at - now <= timedelta(days=threshold_days)
+
+    def a_root_status(
+        self,
+        wordpress_reachable: Optional[bool] = None,
+        payment_completed: Optional[bool] = None,
+    ) -> int:
+        """
+        連携状態。疎通・決済の確認結果を渡さなかった場合はその場で確認する。
+        （画面からは HealthService がキャッシュした結果を渡す）
+        """
         # インスタグラムと疎通できるか
         if self.instagram_token_status == NOT_CONNECTED:
             return 1
@@ -91,11 +125,15 @@ class Customer:
             return 2
 
         # ワードプレス側と疎通ができるか
-        if not is_wordpress_reachable(self.wordpress_url):
+        if wordpress_reachable is None:
+            wordpress_reachable = is_wordpress_reachable(self.wordpress_url)
+        if not wordpress_reachable:
             return 3
 
         # ストライプにて決済が完了しているか
-        if not is_payment_completed(self.payment_type, self.email):
+        if payment_completed is None:
+            payment_completed = is_payment_completed(self.payment_type, self.email)
+        if not payment_completed:
             return 4
 
         return 0
@@ -115,7 +153,7 @@ class Customer:
 
 def is_wordpress_reachable(url: str) -> bool:
     try:
-        response = requests.get(f"https://{url}/?rest_route=/rodut/v1/title", timeout=5)
+        response = http_client.get(f"https://{url}/?rest_route=/rodut/v1/title", timeout=5)
         return response.status_code == 200
     except requests.RequestException:
         return False
@@ -129,7 +167,9 @@ def is_payment_completed(payment_type: str, email: str) -> bool:
             "email": email,
             "product_id": os.getenv("PRODUCT_ID"),
         }
-        resp = requests.post(os.getenv("CAREO_URL") + "/users", json=req)
+        resp = http_client.post(
+            os.getenv("CAREO_URL") + "/users", json=req, timeout=10
+        )
         resp.raise_for_status()
         response_data = resp.json()
         status = response_data.get("subscription_status")
@@ -147,7 +187,7 @@ def get_payment_info(payment_type: str, email: str) -> dict:
             "email": email,
             "product_id": os.getenv("PRODUCT_ID"),
         }
-        resp = requests.post(os.getenv("CAREO_URL") + "/users", json=req)
+        resp = http_client.post(os.getenv("CAREO_URL") + "/users", json=req)
         resp.raise_for_status()
         response_data = resp.json()
         return {
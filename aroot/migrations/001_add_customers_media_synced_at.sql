@@ -0,0 +1,3 @@
+-- 差分取得用: 連携済みInstagram投稿の最新timestamp（UTC）
+ALTER TABLE `customers`
+  ADD COLUMN `media_synced_at` datetime DEFAULT NULL;
@@ -0,0 +1,10 @@
+-- 同じ投稿の二重登録を防ぐ（PostsRepository.upsert_many の ON DUPLICATE KEY UPDATE が前提とするキー）
+-- 既存の重複は最初に登録した行を残して削除する
+DELETE newer FROM `posts` AS newer
+  INNER JOIN `posts` AS older
+    ON newer.customer_id = older.customer_id
+   AND newer.media_id = older.media_id
+   AND newer.id > older.id;
+
+ALTER TABLE `posts`
+  ADD UNIQUE KEY `uq_posts_customer_media` (`customer_id`, `media_id`);
@@ -0,0 +1,3 @@
+-- 分析APIの日別・月別集計（GROUP BY created_at）用
+ALTER TABLE `posts`
+  ADD INDEX `idx_posts_customer_created_at` (`customer_id`, `created_at`);
@@ -0,0 +1,16 @@
+-- 分析APIの集計済みテーブル（ANALYTICS_ROLLUP=true のとき PostsService.save_posts が更新する）
+CREATE TABLE `post_daily_stats` (
+  `customer_id` int NOT NULL,
+  `stat_date` date NOT NULL,
+  `post_count` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`customer_id`, `stat_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- 既存の連携済み投稿から作成する
+INSERT INTO `post_daily_stats` (`customer_id`, `stat_date`, `post_count`)
+SELECT `customer_id`, DATE(`created_at`), COUNT(*)
+  FROM `posts`
+ WHERE `created_at` IS NOT NULL
+   AND `wordpress_link` IS NOT NULL
+   AND `wordpress_link` <> ''
+ GROUP BY `customer_id`, DATE(`created_at`);
@@ -0,0 +1,4 @@
+-- トークン更新バッチ用: Facebookトークンの有効期限と最終更新日時（UTC）
+ALTER TABLE `customers`
+  ADD COLUMN `token_expires_at` datetime DEFAULT NULL,
+  ADD COLUMN `token_refreshed_at` datetime DEFAULT NULL;
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from repository.models import AdminUsersModel
 from domain.admin_users import AdminUser
 from sqlalchemy import func
+from common.base_repository import keyset_page
 
 
 class AdminUserRepository:
@@ -39,6 +40,16 @@ class AdminUserRepository:
         records = query.limit(limit).offset(offset).all()
         return [AdminUser(**record.dict()) for record in records]
 
+    def find_page(self, limit, after_id=None, before_id=None):
+        records = keyset_page(
+            self.session.query(AdminUsersModel),
+            AdminUsersModel.id,
+            limit,
+            after_id,
+            before_id,
+        )
+        return [AdminUser(**record.dict()) for record in records]
+
     def delete(self, _id):
         self.session.delete(self._get(_id))
 
@@ -3,6 +3,7 @@ from typing import Any, Dict, List, Optional, Union
 from sqlalchemy.orm import Session
 from repository.models import CustomersModel
 from sqlalchemy import func, and_
+from common.base_repository import keyset_page
 from domain.customers import Customer
 from util import const
 
@@ -51,6 +52,14 @@ class CustomersRepository:
         records = query.limit(limit).offset(offset).all()
         return [Customer(**record.dict()) for record in records]
 
+    def find_page(
+        self, limit: int, after_id: Optional[int] = None, before_id: Optional[int] = None
+    ) -> List[Customer]:
+        records = keyset_page(
+            self.session.query(CustomersModel), CustomersModel.id, limit, after_id, before_id
+        )
+        return [Customer(**record.dict()) for record in records]
+
     def update(self, id_: Union[str, int], **payload: Any) -> Customer:
         record = self._get(id_)
         for key, val in payload.items():
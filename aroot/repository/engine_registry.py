@@ -0,0 +1,73 @@
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+
+# プロセス内で共有するエンジン（DSNごと）
+_engines: dict[str, Engine] = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": int(os.getenv("DATABASE_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", "10")),
+        "pool_recycle": int(os.getenv("DATABASE_POOL_RECYCLE", "3600")),
+        "pool_timeout": int(os.getenv("DATABASE_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": os.getenv("DATABASE_POOL_PRE_PING", "1") == "1",
+    }
+
+
+def get_engine(dsn: str) -> Engine:
+    """DSNに対応するエンジンを遅延生成して返す（プロセス内で共有）"""
+    _check_fork()
+    engine = _engines.get(dsn)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _engines.get(dsn)
+        if engine is None:
+            engine = create_engine(dsn, **_pool_options())
+            _engines[dsn] = engine
+    return engine
+
+
+def dispose_after_fork() -> None:
+    """fork後の子プロセスで親から引き継いだコネクションを破棄する"""
+    global _pid, _lock
+    _pid = os.getpid()
+    _lock = threading.Lock()
+    for engine in list(_engines.values()):
+        # 親プロセスのソケットは閉じずに参照だけ捨てる
+        engine.dispose(close=False)
+
+
+def _check_fork() -> None:
+    # register_at_fork のフックを経由せずにプロセスが複製された場合の保険
+    if _pid != os.getpid():
+        dispose_after_fork()
+
+
+def pool_stats() -> list[dict]:
+    """各エンジンのコネクションプール状態"""
+    stats = []
+    for engine in list(_engines.values()):
+        pool = engine.pool
+        stats.append(
+            {
+                "database": engine.url.render_as_string(hide_password=True),
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "max_overflow": getattr(pool, "_max_overflow", None),
+                "pid": os.getpid(),
+            }
+        )
+    return stats
+
+
+os.register_at_fork(after_in_child=dispose_after_fork)
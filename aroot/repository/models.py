@@ -3,9 +3,12 @@ from sqlalchemy import (
     Integer,
     String,
     DateTime,
+    Date,
     Text,
     ForeignKey,
     Boolean,
+    UniqueConstraint,
+    Index,
 )
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -48,6 +51,9 @@ class CustomersModel(Base):
     delete_hash = Column(Boolean, default=False)
     payment_type = Column(String(255), nullable=False)
     type = Column(Integer, nullable=False, default=0)
+    media_synced_at = Column(DateTime)
+    token_expires_at = Column(DateTime)
+    token_refreshed_at = Column(DateTime)
 
     def dict(self):
         return {
@@ -64,11 +70,18 @@ class CustomersModel(Base):
             "delete_hash": self.delete_hash,
             "payment_type": self.payment_type,
             "type": self.type,
+            "media_synced_at": self.media_synced_at,
+            "token_expires_at": self.token_expires_at,
+            "token_refreshed_at": self.token_refreshed_at,
         }
 
 
 class PostsModel(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        UniqueConstraint("customer_id", "media_id", name="uq_posts_customer_media"),
+        Index("idx_posts_customer_created_at", "customer_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     media_id = Column(String(45), nullable=False)
@@ -90,3 +103,11 @@ class PostsModel(Base):
             "permalink": self.permalink,
             "wordpress_link": self.wordpress_link,
         }
+
+
+class PostDailyStatsModel(Base):
+    __tablename__ = "post_daily_stats"
+
+    customer_id = Column(Integer, primary_key=True)
+    stat_date = Column(Date, primary_key=True)
+    post_count = Column(Integer, nullable=False, default=0)
@@ -1,8 +1,12 @@
 from sqlalchemy.orm import Session
+import datetime
+
 from sqlalchemy import desc, text, func
+from sqlalchemy.dialects.mysql import insert
 
 import domain.posts
-from repository.models import PostsModel
+from common.base_repository import keyset_page
+from repository.models import PostDailyStatsModel, PostsModel
 from domain.posts import Post
 
 
@@ -15,6 +19,41 @@ class PostsRepository:
         self.session.add(record)
         return Post(**record.dict())
 
+    def upsert_many(self, customer_id, posts: list[dict]) -> tuple[int, int]:
+        """
+        顧客の投稿をまとめて1回の INSERT ... ON DUPLICATE KEY UPDATE で保存する。
+        (customer_id, media_id) が既にあれば連携先の情報と連携日時を更新する。
+        件数は affected rows（追加は1行につき1、更新は2）から求めるので、
+        同時に保存された場合も実際に追加した件数になる。
+        :return: (追加した件数, 更新した件数)
+        """
+        # 同じ投稿が重複して渡された場合は後のものを使う
+        rows = list({post["media_id"]: post for post in posts}.values())
+        if not rows:
+            return 0, 0
+        stmt = insert(PostsModel).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            timestamp=stmt.inserted.timestamp,
+            media_url=stmt.inserted.media_url,
+            permalink=stmt.inserted.permalink,
+            wordpress_link=stmt.inserted.wordpress_link,
+            # 値が変わらない更新は（CLIENT_FOUND_ROWS では）追加と同じ1になるため、連携日時も更新する
+            created_at=stmt.inserted.created_at,
+        )
+        affected = self.session.execute(stmt).rowcount
+        updated = max(affected - len(rows), 0)
+        return len(rows) - updated, updated
+
+    def find_linked_media_ids(self, customer_id, media_ids: list[str]) -> set[str]:
+        """media_ids のうち登録済みのもの（uq_posts_customer_media を使う1回のIN検索）"""
+        if not media_ids:
+            return set()
+        records = self.session.query(PostsModel.media_id).filter(
+            PostsModel.customer_id == customer_id,
+            PostsModel.media_id.in_(set(media_ids)),
+        )
+        return {media_id for (media_id,) in records}
+
     def _get(self, _id) -> PostsModel | None:
         return self.session.query(PostsModel).filter(PostsModel.id == _id).first()
 
@@ -42,9 +81,77 @@ class PostsRepository:
 
         return [Post(**record.dict()) for record in records]
 
+    def find_page_by_customer_id(
+        self, customer_id, limit, after_id=None, before_id=None
+    ) -> list[domain.posts.Post]:
+        """新しい順のキーセットページ（limit + 1 件まで）"""
+        query = self.session.query(PostsModel).filter(
+            PostsModel.customer_id == customer_id
+        )
+        records = keyset_page(
+            query, PostsModel.id, limit, after_id, before_id, descending=True
+        )
+        return [Post(**record.dict()) for record in records]
+
     def count(self):
         return self.session.query(func.count(PostsModel.id)).scalar()
 
+    def count_group_by_customer(self) -> dict[int, int]:
+        """顧客ごとの投稿数（インデックスのみで集計できる）"""
+        rows = self.session.query(
+            PostsModel.customer_id, func.count(PostsModel.id)
+        ).group_by(PostsModel.customer_id)
+        return {customer_id: count for customer_id, count in rows}
+
+    def count_by_customer_id(self, customer_id) -> int:
+        return (
+            self.session.query(func.count(PostsModel.id))
+            .filter(PostsModel.customer_id == customer_id)
+            .scalar()
+        )
+
+    def _synced_filter(self, customer_id):
+        # WordPressへの連携が完了している投稿
+        return (
+            PostsModel.customer_id == customer_id,
+            PostsModel.created_at.isnot(None),
+            PostsModel.wordpress_link.isnot(None),
+            PostsModel.wordpress_link != "",
+        )
+
+    def count_synced_by(self, customer_id, date_format: str) -> dict[str, int]:
+        """
+        連携済み投稿の件数を created_at の DATE_FORMAT ごとに集計する
+        （idx_posts_customer_created_at を使う GROUP BY）
+        """
+        bucket = func.date_format(PostsModel.created_at, date_format)
+        rows = (
+            self.session.query(bucket, func.count(PostsModel.id))
+            .filter(*self._synced_filter(customer_id))
+            .group_by(bucket)
+        )
+        return {key: count for key, count in rows}
+
+    def add_daily_stats(self, customer_id, stat_date: datetime.date, count: int):
+        """post_daily_stats に連携件数を加算する"""
+        stmt = insert(PostDailyStatsModel).values(
+            customer_id=customer_id, stat_date=stat_date, post_count=count
+        )
+        stmt = stmt.on_duplicate_key_update(
+            post_count=PostDailyStatsModel.post_count + stmt.inserted.post_count
+        )
+        self.session.execute(stmt)
+
+    def daily_stats_by(self, customer_id, date_format: str) -> dict[str, int]:
+        """post_daily_stats から連携件数を DATE_FORMAT ごとに集計する"""
+        bucket = func.date_format(PostDailyStatsModel.stat_date, date_format)
+        rows = (
+            self.session.query(bucket, func.sum(PostDailyStatsModel.post_count))
+            .filter(PostDailyStatsModel.customer_id == customer_id)
+            .group_by(bucket)
+        )
+        return {key: int(count) for key, count in rows}
+
     def find_all(self, limit=None, offset=None):
         results = []
         records = self.session.execute(
@@ -1,8 +1,9 @@
 import os
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from repository.engine_registry import get_engine
+
 
 class UnitOfWork:
     def __init__(self):
@@ -15,11 +16,7 @@ class UnitOfWork:
             raise ValueError("Database connection parameters are not properly configured")
         
         connection_string = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_scheme}"
-        self.session_maker = sessionmaker(
-            bind=create_engine(
-                connection_string, pool_size=5, max_overflow=10, pool_recycle=3600
-            )
-        )
+        self.session_maker = sessionmaker(bind=get_engine(connection_string))
 
     def __enter__(self):
         self.session = self.session_maker()
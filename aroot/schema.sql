@@ -1,3 +1,4 @@
+-- 新規構築用のスキーマ。既存のDBには migrations/ 以下のSQLを番号順に適用する
 
 DROP TABLE IF EXISTS `admin_users`;
 
@@ -26,10 +27,22 @@ CREATE TABLE `posts` (
   `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `permalink` varchar(255) NOT NULL,
   `wordpress_link` varchar(255) NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_posts_customer_media` (`customer_id`,`media_id`),
+  KEY `idx_posts_customer_created_at` (`customer_id`,`created_at`)
 ) ENGINE=InnoDB AUTO_INCREMENT=53 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 
+DROP TABLE IF EXISTS `post_daily_stats`;
+
+CREATE TABLE `post_daily_stats` (
+  `customer_id` int NOT NULL,
+  `stat_date` date NOT NULL,
+  `post_count` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`customer_id`,`stat_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+
 DROP TABLE IF EXISTS `customers`;
 
 CREATE TABLE `customers` (
@@ -40,6 +53,9 @@ CREATE TABLE `customers` (
   `wordpress_url` varchar(255) NOT NULL,
   `facebook_token` varchar(255) DEFAULT NULL,
   `start_date` datetime DEFAULT NULL,
+  `media_synced_at` datetime DEFAULT NULL,
+  `token_expires_at` datetime DEFAULT NULL,
+  `token_refreshed_at` datetime DEFAULT NULL,
   PRIMARY KEY (`id`),
   UNIQUE KEY `email_UNIQUE` (`email`)
 ) ENGINE=InnoDB AUTO_INCREMENT=12 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -128,7 +128,7 @@ function upload_media(WP_REST_Request $request)
         return new WP_REST_Response(['error' => 'File size exceeds limit'], 400);
     }
 
-    $allowed_types = ['image/jpeg', 'image/png', 'video/mp4'];
+    $allowed_types = ['image/jpeg', 'image/png', 'image/webp', 'video/mp4'];
     if (!in_array($file['type'], $allowed_types)) {
         return new WP_REST_Response(['error' => 'Unsupported file type'], 400);
     }
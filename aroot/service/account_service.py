@@ -16,7 +16,10 @@ class AccountService:
             data = json.dumps(tmp_user)
             self.redis_cli.set(token, data, ex=86400)  # 有効期限: 24時間
             current_app.logger.info(f"Temporary registration saved for email: {email}")
-        except (json.JSONEncodeError, redis.RedisError) as e:
+        except (redis.ConnectionError, redis.TimeoutError):
+            # 呼び出し側（redis_call）で LocalCache に切り替えてやり直す
+            raise
+        except (TypeError, redis.RedisError) as e:
             current_app.logger.error(f"Failed to save temporary registration: {e}")
             raise ValueError(f"一時登録の保存に失敗しました: {e}")
 
@@ -28,11 +31,13 @@ class AccountService:
                 current_app.logger.warning(f"Token not found or expired: {token}")
                 return None
             
-            # MockRedisの場合は既に文字列、実際のRedisの場合はbytesの可能性
+            # decode_responses を使わないクライアントの場合はbytesの可能性
             if isinstance(data, bytes):
                 data = data.decode('utf-8')
             
             return json.loads(data)
+        except (redis.ConnectionError, redis.TimeoutError):
+            raise
         except (json.JSONDecodeError, redis.RedisError) as e:
             current_app.logger.error(f"Failed to get temporary registration: {e}")
             raise ValueError(f"一時登録情報の取得に失敗しました: {e}")
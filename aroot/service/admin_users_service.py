@@ -1,4 +1,5 @@
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
+from common.base_service import Page, cached_count
 from domain.errors import (
     AdminUserNotFoundError,
     AdminUserValidationError,
@@ -33,6 +34,17 @@ class AdminUsersService:
             limit=AdminUsersService.limit, offset=offset
         )
 
+    def find_page(
+        self, after_id: Optional[int] = None, before_id: Optional[int] = None
+    ) -> Page[AdminUser]:
+        rows = self.admin_users_repository.find_page(
+            AdminUsersService.limit, after_id, before_id
+        )
+        return Page.build(rows, AdminUsersService.limit, after_id, before_id)
+
+    def approximate_count(self) -> int:
+        return cached_count("admin_users", self.admin_users_repository.count)
+
     def check_use_email(self, email: str) -> None:
         admin_user = self.admin_users_repository.find_by_email(email)
         if admin_user is not None:
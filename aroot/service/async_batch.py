@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+from domain.customers import Customer
+from domain.instagram_media import InstagramMedia
+from domain.wordpress_source import WordPressSource
+from service import media_transfer
+from service.meta_service import (
+    MetaService,
+    MetaApiError,
+    FETCH_MODE,
+    PAGE_SIZE,
+    MAX_PAGES,
+)
+from service.image_optimizer import image_optimizer
+from service.meta_rate_governor import governor
+from service.posts_service import PostsService
+from service.slack_service import SlackService
+from service.sync_journal import SyncJournal
+from service.upload_cache import upload_cache
+from service.wordpress_service import WordpressApiError
+from service.wordpress_service_factory import WordpressServiceFactory
+
+
+# 同時に処理する顧客数
+CUSTOMER_CONCURRENCY = int(os.getenv("ASYNC_CUSTOMER_CONCURRENCY", "200"))
+# Meta Graph API への同時リクエスト数
+META_CONCURRENCY = int(os.getenv("ASYNC_META_CONCURRENCY", "20"))
+# 1つのWordPressホストへの同時リクエスト数
+HOST_CONCURRENCY = int(os.getenv("WORDPRESS_HOST_CONCURRENCY", "3"))
+# メモリ上に保持する転送中メディアの合計バイト数
+MAX_INFLIGHT_BYTES = int(os.getenv("ASYNC_MAX_INFLIGHT_BYTES", str(512 * 1024 * 1024)))
+# Content-Length が返らない場合に見積もるサイズ
+UNKNOWN_SIZE_ESTIMATE = int(os.getenv("ASYNC_UNKNOWN_SIZE_ESTIMATE", str(16 * 1024 * 1024)))
+
+
+class ByteBudget:
+    """転送中バイト数の上限を管理する非同期セマフォ"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        # 上限より大きいファイルは単独でなら流せるようにする
+        size = min(max(size, 1), self.limit)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+class AsyncBatchEngine:
+    """
+    handle_customer と同じ fetch → diff → transfer → post → save の流れをコルーチンで実行する。
+    DBアクセスは同期APIのため、呼び出し側から渡された関数をスレッドで実行する。
+    """
+
+    def __init__(
+        self,
+        load_linked: Callable[[Customer, list[InstagramMedia]], set[str]],
+        save_results: Callable[[Customer, list[dict], list[InstagramMedia]], None],
+        on_error: Callable[[Customer, Exception], None],
+    ):
+        self.load_linked = load_linked
+        self.save_results = save_results
+        self.on_error = on_error
+        self.meta_service = MetaService(governed=True)
+        self.meta_slots = asyncio.Semaphore(META_CONCURRENCY)
+        self.customer_slots = asyncio.Semaphore(CUSTOMER_CONCURRENCY)
+        self.byte_budget = ByteBudget(MAX_INFLIGHT_BYTES)
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+        self.client: httpx.AsyncClient | None = None
+
+    def host_slot(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(HOST_CONCURRENCY)
+        return self._host_slots[host]
+
+    async def run(self, customers: list[Customer]) -> dict[int, bool]:
+        limits = httpx.Limits(max_connections=500, max_keepalive_connections=100)
+        timeout = httpx.Timeout(120.0, connect=10.0)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            self.client = client
+            # 投稿一覧は Graph API のバッチリクエストでまとめて取得しておく
+            media_lists = await asyncio.to_thread(self.prefetch_media_lists, customers)
+            results = await asyncio.gather(
+                *(
+                    self.handle_customer(customer, media_lists.get(customer.id))
+                    for customer in customers
+                )
+            )
+        return {customer.id: ok for customer, ok in zip(customers, results)}
+
+    def prefetch_media_lists(self, customers: list[Customer]) -> dict:
+        if not customers:
+            return {}
+        try:
+            return self.meta_service.get_media_lists_for_sync(customers)
+        except Exception as e:
+            # 取れなかった顧客は fetch_media_list で個別に取得する
+            print(f"Meta batch fetch failed: {str(e)}")
+            return {}
+
+    async def handle_customer(self, customer: Customer, prefetched=None) -> bool:
+        async with self.customer_slots:
+            try:
+                print(f"<Start> customer_id: {customer.id}, customer_name: {customer.name}")
+                wordpress_service = WordpressServiceFactory.create_service(customer)
+                if isinstance(prefetched, MetaApiError):
+                    raise prefetched
+                if prefetched is not None:
+                    media_list = prefetched
+                else:
+                    media_list = await self.fetch_media_list(customer)
+                linked_media_ids = await asyncio.to_thread(
+                    self.load_linked, customer, media_list
+                )
+                targets = PostsService.abstract_targets(
+                    media_list, linked_media_ids, customer.start_date
+                )
+                # 前回途中まで投稿済みのものは投稿し直さず、保存だけ行う
+                journal = SyncJournal(customer.id)
+                targets, resumed = await asyncio.to_thread(journal.split, targets)
+                outcomes = await asyncio.gather(
+                    *(self.post(wordpress_service, media, journal) for media in targets),
+                    return_exceptions=True,
+                )
+                errors = [o for o in outcomes if isinstance(o, BaseException)]
+                results = [
+                    o for o in outcomes if o is not None and not isinstance(o, BaseException)
+                ]
+                # 失敗した投稿があっても、投稿できたものは保存する。
+                # その場合は失敗したものを次回取り直せるよう、取得位置（watermark）は進めない
+                await asyncio.to_thread(
+                    self.save_results,
+                    customer,
+                    resumed + results,
+                    [] if errors else media_list,
+                )
+                SlackService().send_posted(customer.name, results)
+                if errors:
+                    raise errors[0]
+                return True
+            except Exception as e:
+                await asyncio.to_thread(self.on_error, customer, e)
+                return False
+
+    async def fetch_media_list(self, customer: Customer) -> list[InstagramMedia]:
+        """MetaService.get_media_list_for_sync と同じ取得方式（古い順で返す）"""
+        watermark = customer.media_watermark()
+        result = []
+        if FETCH_MODE == "incremental" and watermark is not None:
+            async for media in self.iter_media(customer, max_pages=None):
+                if media.timestamp < watermark:
+                    break
+                result.append(media)
+        else:
+            async for media in self.iter_media(customer):
+                result.append(media)
+                if len(result) >= 100:
+                    break
+        result.reverse()
+        return result
+
+    async def iter_media(
+        self, customer: Customer, max_pages: Optional[int] = MAX_PAGES
+    ) -> AsyncIterator[InstagramMedia]:
+        """MetaService.iter_media の非同期版"""
+        url, params = self.meta_service.media_edge_request(
+            customer.facebook_token,
+            customer.instagram_business_account_id,
+            PAGE_SIZE,
+        )
+        pages = 0
+        while url is not None and (max_pages is None or pages < max_pages):
+            await asyncio.sleep(await asyncio.to_thread(governor.delay))
+            async with self.meta_slots:
+                response = await self.client.get(url, params=params)
+            pages += 1
+            error = None
+            if not 200 <= response.status_code < 300:
+                error = MetaApiError(response.json())
+            await asyncio.to_thread(
+                governor.record, response.headers, error.code if error else None
+            )
+            if error is not None:
+                raise error
+            medias, url = self.meta_service.parse_media_page(response.json())
+            params = None
+            for media in medias:
+                yield media
+
+    async def post(
+        self, wordpress_service, media: InstagramMedia, journal: SyncJournal = None
+    ) -> dict | None:
+        if media.media_type == "IMAGE":
+            resp_upload = await self.transfer(
+                wordpress_service, media.media_url, "IMAGE", media.id
+            )
+            html = wordpress_service.get_html_for_image(
+                media.caption, resp_upload.source_url
+            )
+            media_id = resp_upload.media_id
+        elif media.media_type == "VIDEO":
+            resp_upload = await self.transfer(
+                wordpress_service, media.media_url, "VIDEO", media.id
+            )
+            html = wordpress_service.get_html_for_video(
+                media.caption, resp_upload.source_url
+            )
+            media_id = resp_upload.media_id
+        elif media.media_type == "CAROUSEL_ALBUM":
+            # gather は入力順で結果を返すので、カルーセルの並び順は保たれる
+            resp_uploads = await asyncio.gather(
+                *(
+                    self.transfer(
+                        wordpress_service, child.media_url, child.media_type, child.id
+                    )
+                    for child in media.children
+                    if child.media_type in ("IMAGE", "VIDEO")
+                )
+            )
+            html = wordpress_service.get_html_for_carousel(media.caption, resp_uploads)
+            media_id = resp_uploads[0].media_id
+        else:
+            return None
+
+        resp_post = await self.create_post(
+            wordpress_service, media.caption, html, int(media_id)
+        )
+        result = {
+            "media_id": media.id,
+            "timestamp": media.timestamp,
+            "media_url": media.media_url,
+            "permalink": media.permalink,
+            "wordpress_link": resp_post["post_url"],
+        }
+        if journal is not None:
+            await asyncio.to_thread(journal.record_created, result)
+        return result
+
+    async def transfer(
+        self, wordpress_service, media_url: str, media_type: str, source_id=None
+    ) -> WordPressSource:
+        host = wordpress_service.host
+        cached = await asyncio.to_thread(upload_cache.get, host, source_id)
+        if cached is not None:
+            return cached
+        if media_type == "VIDEO":
+            filename, mime = media_transfer.generate_filename(".mp4"), "video/mp4"
+        else:
+            filename, mime = media_transfer.generate_filename(".jpeg"), "image/jpeg"
+        optimize = media_type == "IMAGE" and image_optimizer.enabled
+
+        async with self.client.stream(
+            "GET", media_url, headers={"Accept-Encoding": "identity"}
+        ) as source:
+            source.raise_for_status()
+            content_length = source.headers.get("Content-Length")
+            size = int(content_length) if content_length else UNKNOWN_SIZE_ESTIMATE
+            async with self.byte_budget.reserve(size):
+                content = await source.aread()
+                # IDが違っても内容が同じファイルはアップロード済みのものを使う
+                sha256 = hashlib.sha256(content).hexdigest()
+                cached = await asyncio.to_thread(upload_cache.find_by_hash, host, sha256)
+                if cached is not None:
+                    await asyncio.to_thread(upload_cache.put, host, source_id, cached)
+                    return cached
+                original_size = len(content)
+                if optimize:
+                    # 縮小はプロセスプールで行い、その間イベントループは止めない
+                    content, filename, mime = await asyncio.to_thread(
+                        image_optimizer.transform, content, filename, mime
+                    )
+                url, fields, headers = wordpress_service.upload_request(filename)
+                async with self.host_slot(wordpress_service.host):
+                    response = await self.client.post(
+                        url,
+                        data=fields,
+                        files={"file": (filename, content, mime)},
+                        headers=headers,
+                    )
+        if 200 <= response.status_code < 300:
+            j = response.json()
+            uploaded = WordPressSource(j["id"], media_type, j["source_url"])
+            await asyncio.to_thread(upload_cache.put, host, source_id, uploaded, sha256)
+            if optimize:
+                await asyncio.to_thread(
+                    image_optimizer.record, host, original_size, len(content)
+                )
+            return uploaded
+        raise WordpressApiError(response.text)
+
+    async def create_post(self, wordpress_service, title, content, media_id) -> dict:
+        url, headers, body = wordpress_service.create_post_request(
+            title, content, media_id
+        )
+        async with self.host_slot(wordpress_service.host):
+            response = await self.client.post(
+                url, headers=headers, content=body, timeout=30.0
+            )
+        if 200 <= response.status_code < 300:
+            return response.json()
+        raise WordpressApiError({"status": response.status_code, "text": response.text})
+
+
+def run_async_batch(
+    customers: list[Customer],
+    load_linked: Callable[[Customer, list[InstagramMedia]], set[str]],
+    save_results: Callable[[Customer, list[dict], list[InstagramMedia]], None],
+    on_error: Callable[[Customer, Exception], None],
+) -> dict[int, bool]:
+    engine = AsyncBatchEngine(load_linked, save_results, on_error)
+    return asyncio.run(engine.run(customers))
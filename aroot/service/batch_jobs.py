@@ -0,0 +1,249 @@
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+import redis
+
+
+QUEUE_KEY = "batch:queue"
+LOCK_KEY = "batch:lock"
+# 同じバッチが二重に起動されないようにするロックの有効期限（ワーカー停止時の保険）
+LOCK_TTL = int(os.getenv("BATCH_LOCK_TTL", "7200"))
+# ジョブ情報の保持期間
+JOB_TTL = int(os.getenv("BATCH_JOB_TTL", str(7 * 24 * 3600)))
+# 失敗したタスクを自動で再投入する回数
+MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "0"))
+# ワーカーの生存確認の有効期限。これを過ぎたワーカーが処理中だったタスクは回収する
+WORKER_TTL = int(os.getenv("BATCH_WORKER_TTL", "120"))
+WORKERS_KEY = "batch:workers"
+RECOVER_LOCK_KEY = "batch:recover_lock"
+
+
+def _job_key(job_id: str) -> str:
+    return f"batch:job:{job_id}"
+
+
+def _failed_key(job_id: str) -> str:
+    return f"batch:job:{job_id}:failed"
+
+
+def _processing_key(worker_id: str) -> str:
+    return f"batch:processing:{worker_id}"
+
+
+def _heartbeat_key(worker_id: str) -> str:
+    return f"batch:worker:{worker_id}"
+
+
+class BatchJobService:
+    """
+    Redisをキューにしたバッチジョブ（顧客単位のタスク）の管理。
+    ワーカーは取り出したタスクを自分の処理中リストへ移し、完了（成功・失敗・再投入）時に消す。
+    生存確認が途絶えたワーカーの処理中リストは recover_stale で回収する。
+    """
+
+    def __init__(self, redis_cli, worker_id: Optional[str] = None):
+        self.redis_cli = redis_cli
+        self.worker_id = worker_id
+
+    def enqueue(self, customer_ids: list[int]) -> tuple[str, bool]:
+        """
+        ジョブを登録してタスクをキューに積む。
+        実行中のジョブがあれば新規登録せず、そのジョブIDを返す。
+        :return: (job_id, 新規登録したかどうか)
+        """
+        job_id = uuid.uuid4().hex
+        if not self.redis_cli.set(LOCK_KEY, job_id, nx=True, ex=LOCK_TTL):
+            running_job_id = self.redis_cli.get(LOCK_KEY)
+            if running_job_id is not None:
+                return running_job_id, False
+            # ロックがちょうど失効した場合は取り直す
+            return self.enqueue(customer_ids)
+
+        try:
+            self._create_job(job_id, customer_ids)
+        except redis.RedisError:
+            # 登録できなかったジョブのロックが残ると LOCK_TTL の間バッチが起動できない
+            try:
+                if self.redis_cli.get(LOCK_KEY) == job_id:
+                    self.redis_cli.delete(LOCK_KEY)
+            except redis.RedisError:
+                pass
+            raise
+        return job_id, True
+
+    def _create_job(self, job_id: str, customer_ids: list[int]) -> None:
+        pipe = self.redis_cli.pipeline()
+        pipe.hset(
+            _job_key(job_id),
+            mapping={
+                "status": "running" if customer_ids else "finished",
+                "total": len(customer_ids),
+                "done": 0,
+                "failed": 0,
+                "created_at": time.time(),
+            },
+        )
+        pipe.expire(_job_key(job_id), JOB_TTL)
+        for customer_id in customer_ids:
+            pipe.lpush(QUEUE_KEY, self._task(job_id, customer_id, 0))
+        if not customer_ids:
+            pipe.delete(LOCK_KEY)
+        pipe.execute()
+
+    @staticmethod
+    def _task(job_id: str, customer_id: int, attempt: int) -> str:
+        return json.dumps(
+            {"job_id": job_id, "customer_id": customer_id, "attempt": attempt}
+        )
+
+    def pop(self, timeout: int = 2) -> Optional[dict]:
+        """タスクを1件、処理中リストへ移して取り出す（timeout秒待っても無ければNone）"""
+        item = self.redis_cli.blmove(
+            QUEUE_KEY, _processing_key(self.worker_id), timeout, "RIGHT", "LEFT"
+        )
+        if item is None:
+            return None
+        return json.loads(item)
+
+    def pop_many(self, count: int, timeout: int = 2) -> list[dict]:
+        """最初の1件だけ待ち、残りはキューにある分だけまとめて取り出す"""
+        first = self.pop(timeout)
+        if first is None:
+            return []
+        tasks = [first]
+        if count > 1:
+            pipe = self.redis_cli.pipeline(transaction=False)
+            for _ in range(count - 1):
+                pipe.lmove(QUEUE_KEY, _processing_key(self.worker_id), "RIGHT", "LEFT")
+            tasks.extend(json.loads(item) for item in pipe.execute() if item is not None)
+        return tasks
+
+    def _ack(self, pipe, task: dict, worker_id: Optional[str] = None) -> None:
+        """処理中リストからタスクを消す（結果の記録と同じ MULTI で行う）"""
+        worker_id = worker_id or self.worker_id
+        if worker_id is None:
+            return
+        pipe.lrem(
+            _processing_key(worker_id),
+            1,
+            self._task(task["job_id"], task["customer_id"], task["attempt"]),
+        )
+
+    def requeue(self, task: dict, worker_id: Optional[str] = None) -> bool:
+        """自動リトライの上限内であれば再投入する"""
+        if task["attempt"] >= MAX_RETRIES:
+            return False
+        pipe = self.redis_cli.pipeline()
+        pipe.lpush(
+            QUEUE_KEY, self._task(task["job_id"], task["customer_id"], task["attempt"] + 1)
+        )
+        self._ack(pipe, task, worker_id)
+        pipe.execute()
+        return True
+
+    def mark_done(self, task: dict) -> None:
+        pipe = self.redis_cli.pipeline()
+        pipe.hincrby(_job_key(task["job_id"]), "done", 1)
+        self._ack(pipe, task)
+        pipe.execute()
+        self._finish_if_completed(task["job_id"])
+
+    def mark_failed(self, task: dict, worker_id: Optional[str] = None) -> None:
+        pipe = self.redis_cli.pipeline()
+        pipe.hincrby(_job_key(task["job_id"]), "failed", 1)
+        pipe.sadd(_failed_key(task["job_id"]), task["customer_id"])
+        pipe.expire(_failed_key(task["job_id"]), JOB_TTL)
+        self._ack(pipe, task, worker_id)
+        pipe.execute()
+        self._finish_if_completed(task["job_id"])
+
+    def heartbeat(self, worker_ids: list[str]) -> None:
+        """このプロセスのワーカーが生きていることを記録する（WORKER_TTL より短い間隔で呼ぶ）"""
+        pipe = self.redis_cli.pipeline(transaction=False)
+        pipe.sadd(WORKERS_KEY, *worker_ids)
+        for worker_id in worker_ids:
+            pipe.set(_heartbeat_key(worker_id), 1, ex=WORKER_TTL)
+        pipe.execute()
+
+    def recover_stale(self) -> int:
+        """
+        生存確認が途絶えたワーカーの処理中タスクを、失敗したものとして扱う
+        （リトライの上限内なら再投入し、そうでなければ失敗として記録してジョブを終わらせる）。
+        回収した件数を返す。
+        """
+        if not self.redis_cli.set(RECOVER_LOCK_KEY, 1, nx=True, ex=WORKER_TTL):
+            return 0
+        recovered = 0
+        try:
+            for worker_id in self.redis_cli.smembers(WORKERS_KEY):
+                if self.redis_cli.exists(_heartbeat_key(worker_id)):
+                    continue
+                for item in self.redis_cli.lrange(_processing_key(worker_id), 0, -1):
+                    task = json.loads(item)
+                    print(f"<BatchJob> recovered task from {worker_id}: {task}")
+                    if not self.requeue(task, worker_id):
+                        self.mark_failed(task, worker_id)
+                    recovered += 1
+                self.redis_cli.srem(WORKERS_KEY, worker_id)
+        finally:
+            self.redis_cli.delete(RECOVER_LOCK_KEY)
+        return recovered
+
+    def _finish_if_completed(self, job_id: str) -> None:
+        job = self.redis_cli.hgetall(_job_key(job_id))
+        if not job:
+            return
+        if int(job["done"]) + int(job["failed"]) < int(job["total"]):
+            return
+        if job.get("status") == "finished":
+            return
+        self.redis_cli.hset(
+            _job_key(job_id),
+            mapping={"status": "finished", "finished_at": time.time()},
+        )
+        if self.redis_cli.get(LOCK_KEY) == job_id:
+            self.redis_cli.delete(LOCK_KEY)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        job = self.redis_cli.hgetall(_job_key(job_id))
+        if not job:
+            return None
+        total = int(job["total"])
+        done = int(job["done"])
+        failed = int(job["failed"])
+        created_at = float(job["created_at"])
+        finished_at = float(job.get("finished_at") or time.time())
+        elapsed = max(finished_at - created_at, 1e-6)
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "remaining": max(total - done - failed, 0),
+            "elapsed_seconds": round(elapsed, 1),
+            "customers_per_minute": round((done + failed) * 60 / elapsed, 2),
+            "failed_customer_ids": sorted(
+                int(customer_id)
+                for customer_id in self.redis_cli.smembers(_failed_key(job_id))
+            ),
+        }
+
+    def retry_failed(self, job_id: str) -> int:
+        """失敗した顧客のタスクを再投入する。再投入した件数を返す"""
+        customer_ids = self.redis_cli.smembers(_failed_key(job_id))
+        if not customer_ids:
+            return 0
+        pipe = self.redis_cli.pipeline()
+        pipe.delete(_failed_key(job_id))
+        pipe.hincrby(_job_key(job_id), "failed", -len(customer_ids))
+        pipe.hset(_job_key(job_id), "status", "running")
+        pipe.hdel(_job_key(job_id), "finished_at")
+        pipe.set(LOCK_KEY, job_id, nx=True, ex=LOCK_TTL)
+        for customer_id in customer_ids:
+            pipe.lpush(QUEUE_KEY, self._task(job_id, int(customer_id), 1))
+        pipe.execute()
+        return len(customer_ids)
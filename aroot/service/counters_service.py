@@ -0,0 +1,135 @@
+import os
+import time
+from typing import Any
+
+import redis
+
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+
+TOTALS_KEY = "counters:totals"
+CUSTOMER_POSTS_KEY = "counters:customer_posts"
+REBUILT_AT_KEY = "counters:rebuilt_at"
+REBUILD_LOCK_KEY = "counters:rebuild_lock"
+# この秒数ごとにDBから数え直す（増減の取りこぼしを補正する）
+REBUILD_INTERVAL = int(os.getenv("COUNTERS_REBUILD_INTERVAL", "3600"))
+
+
+class CountersService:
+    """
+    管理画面で表示する件数（顧客・管理者・投稿、顧客ごとの投稿数）をRedisで保持する。
+    保存・削除時に増減し、REBUILD_INTERVAL ごとにDBから作り直す。
+    Redisが使えない場合はDBで数える。
+    """
+
+    def __init__(self, redis_cli=None):
+        self.redis_cli = redis_cli
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    def add(self, name: str, amount: int = 1) -> None:
+        """customers / admin_users の件数を増減する"""
+        try:
+            self._cli.hincrby(TOTALS_KEY, name, amount)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def add_posts(self, customer_id: int, amount: int) -> None:
+        if not amount:
+            return
+        try:
+            pipe = self._cli.pipeline()
+            pipe.hincrby(TOTALS_KEY, "posts", amount)
+            pipe.hincrby(CUSTOMER_POSTS_KEY, customer_id, amount)
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def remove_customer(self, customer_id: int) -> None:
+        """顧客の削除に合わせて、顧客数とその顧客の投稿数を差し引く"""
+        try:
+            post_count = int(self._cli.hget(CUSTOMER_POSTS_KEY, customer_id) or 0)
+            pipe = self._cli.pipeline()
+            pipe.hincrby(TOTALS_KEY, "customers", -1)
+            pipe.hincrby(TOTALS_KEY, "posts", -post_count)
+            pipe.hdel(CUSTOMER_POSTS_KEY, customer_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def totals(
+        self, customers_repository: Any, admin_user_repository: Any, posts_repository: Any
+    ) -> dict[str, int]:
+        """{"customers", "admin_users", "posts"} の件数"""
+        repositories = (customers_repository, admin_user_repository, posts_repository)
+        try:
+            self._rebuild_if_stale(*repositories)
+            totals = self._cli.hgetall(TOTALS_KEY)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            totals = {}
+        if not totals:
+            return self._count(*repositories)
+        return {
+            "customers": int(totals.get("customers", 0)),
+            "admin_users": int(totals.get("admin_users", 0)),
+            "posts": int(totals.get("posts", 0)),
+        }
+
+    def customer_post_count(self, customer_id: int, posts_repository: Any) -> int:
+        try:
+            count = self._cli.hget(CUSTOMER_POSTS_KEY, customer_id)
+            rebuilt_at = self._cli.get(REBUILT_AT_KEY)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            count, rebuilt_at = None, None
+        if count is not None:
+            return int(count)
+        if rebuilt_at is not None:
+            # 作り直した後に投稿が無い顧客はハッシュに載らない
+            return 0
+        return posts_repository.count_by_customer_id(customer_id)
+
+    def _rebuild_if_stale(
+        self, customers_repository, admin_user_repository, posts_repository
+    ) -> None:
+        rebuilt_at = self._cli.get(REBUILT_AT_KEY)
+        if rebuilt_at is not None and time.time() - float(rebuilt_at) < REBUILD_INTERVAL:
+            return
+        # 複数のリクエストが同時に数え直さないようにする
+        if not self._cli.set(REBUILD_LOCK_KEY, 1, nx=True, ex=60):
+            return
+        try:
+            self.rebuild(customers_repository, admin_user_repository, posts_repository)
+        finally:
+            self._cli.delete(REBUILD_LOCK_KEY)
+
+    def rebuild(
+        self, customers_repository: Any, admin_user_repository: Any, posts_repository: Any
+    ) -> dict[str, int]:
+        """DBから数え直して置き換える"""
+        per_customer = posts_repository.count_group_by_customer()
+        totals = {
+            "customers": customers_repository.count(),
+            "admin_users": admin_user_repository.count(),
+            "posts": sum(per_customer.values()),
+        }
+        pipe = self._cli.pipeline()
+        pipe.delete(TOTALS_KEY, CUSTOMER_POSTS_KEY)
+        pipe.hset(TOTALS_KEY, mapping=totals)
+        if per_customer:
+            pipe.hset(CUSTOMER_POSTS_KEY, mapping=per_customer)
+        pipe.set(REBUILT_AT_KEY, time.time())
+        pipe.execute()
+        print(f"<Counters> rebuilt: {totals}")
+        return totals
+
+    @staticmethod
+    def _count(customers_repository, admin_user_repository, posts_repository):
+        return {
+            "customers": customers_repository.count(),
+            "admin_users": admin_user_repository.count(),
+            "posts": posts_repository.count(),
+        }
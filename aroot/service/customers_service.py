@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 from domain.customers import Customer
 from domain.errors import (
@@ -10,6 +10,10 @@ from util.const import CONNECTED, NOT_CONNECTED
 from common.base_service import BaseService
 
 
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
 class CustomersService(BaseService[Customer]):
     limit = 30
 
@@ -48,8 +52,35 @@ class CustomersService(BaseService[Customer]):
             return customer
         return None
 
-    def update_facebook_token(self, id_: Union[str, int], access_token: str) -> None:
-        self.customers_repository.update(id_, facebook_token=access_token)
+    def update_facebook_token(
+        self,
+        id_: Union[str, int],
+        access_token: str,
+        expires_at: Optional[datetime.datetime] = None,
+    ) -> None:
+        """トークンと有効期限（UTC）を更新し、更新日時を記録"""
+        self.customers_repository.update(
+            id_,
+            facebook_token=access_token,
+            token_expires_at=expires_at,
+            token_refreshed_at=_utcnow(),
+        )
+
+    def update_token_expires_at(
+        self, id_: Union[str, int], expires_at: datetime.datetime
+    ) -> None:
+        self.customers_repository.update(id_, token_expires_at=expires_at)
+
+    def update_media_synced_at(
+        self, id_: Union[str, int], synced_at: datetime.datetime
+    ) -> None:
+        """差分取得の基準となる、連携済み最新投稿のtimestamp（UTC）を記録"""
+        self.customers_repository.update(
+            id_,
+            media_synced_at=synced_at.astimezone(datetime.timezone.utc).replace(
+                tzinfo=None
+            ),
+        )
 
     def update_instagram_token_status(self, id_: Union[str, int], status: int) -> None:
         self.customers_repository.update(
@@ -63,6 +94,7 @@ class CustomersService(BaseService[Customer]):
         access_token: str,
         instagram_business_account_id: str,
         instagram_user_name: str,
+        token_expires_at: Optional[datetime.datetime] = None,
     ) -> None:
         customer = self.customers_repository.find_by_id(id_)
         start_date = datetime.datetime.now()
@@ -75,6 +107,8 @@ class CustomersService(BaseService[Customer]):
             instagram_business_account_id=instagram_business_account_id,
             instagram_business_account_name=instagram_user_name,
             instagram_token_status=CONNECTED,
+            token_expires_at=token_expires_at,
+            token_refreshed_at=_utcnow(),
         )
 
     # block_count and find_all methods inherited from BaseService
@@ -96,6 +130,8 @@ class CustomersService(BaseService[Customer]):
             instagram_business_account_id=None,
             instagram_business_account_name=None,
             instagram_token_status=NOT_CONNECTED,
+            token_expires_at=None,
+            token_refreshed_at=None,
         )
 
     def set_delete_hash(self, id_: Union[str, int]) -> None:
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import redis
+
+from domain.customers import Customer, is_payment_completed, is_wordpress_reachable
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+
+# この秒数より古い確認結果は、画面表示時にバックグラウンドで確認し直す
+STALE_SECONDS = int(os.getenv("HEALTH_STALE_SECONDS", "300"))
+# 確認結果の保持期間（これを過ぎたら未確認として扱う）
+RESULT_TTL = int(os.getenv("HEALTH_RESULT_TTL", str(24 * 3600)))
+# 一括確認の同時実行数
+PROBE_WORKERS = int(os.getenv("HEALTH_PROBE_WORKERS", "20"))
+# 画面表示をきっかけにした確認の同時実行数
+REFRESH_WORKERS = int(os.getenv("HEALTH_REFRESH_WORKERS", "4"))
+# 同じ顧客の確認が重複しないようにするロックの有効期限
+REFRESH_LOCK_TTL = 60
+
+
+def _result_key(customer_id: int) -> str:
+    return f"health:customer:{customer_id}"
+
+
+def _refresh_lock_key(customer_id: int) -> str:
+    return f"health:refreshing:{customer_id}"
+
+
+_refresh_executor = ThreadPoolExecutor(
+    max_workers=REFRESH_WORKERS, thread_name_prefix="health-refresh"
+)
+# Redis が使えない間にプロセス内で重複して確認しないようにする
+_refreshing: set[int] = set()
+_refreshing_lock = threading.Lock()
+
+
+class HealthService:
+    """
+    顧客のWordPressへの疎通と決済状態の確認結果を、確認時刻とともにRedisに保持する。
+    画面ではキャッシュした結果を表示し、古ければバックグラウンドで確認し直す。
+    """
+
+    def __init__(self, redis_cli=None):
+        self.redis_cli = redis_cli
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    def probe(self, customer: Customer) -> dict:
+        """WordPressと決済状態を確認し、結果を保存する"""
+        result = {
+            "wordpress_reachable": int(is_wordpress_reachable(customer.wordpress_url)),
+            "payment_completed": int(
+                is_payment_completed(customer.payment_type, customer.email)
+            ),
+            "checked_at": time.time(),
+        }
+        try:
+            pipe = self._cli.pipeline()
+            pipe.hset(_result_key(customer.id), mapping=result)
+            pipe.expire(_result_key(customer.id), RESULT_TTL)
+            pipe.delete(_refresh_lock_key(customer.id))
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+        return result
+
+    def probe_all(self, customers: list[Customer]) -> dict[str, int]:
+        """顧客を並列に確認する（バッチ用）。{"checked", "unhealthy", "failed"} を返す"""
+        summary = {"checked": 0, "unhealthy": 0, "failed": 0}
+        if not customers:
+            return summary
+        with ThreadPoolExecutor(
+            max_workers=min(PROBE_WORKERS, len(customers))
+        ) as executor:
+            futures = {
+                executor.submit(self.probe, customer): customer for customer in customers
+            }
+        for future, customer in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"<HealthService> probe failed: customer_id={customer.id}, {e}")
+                summary["failed"] += 1
+                continue
+            summary["checked"] += 1
+            if not (result["wordpress_reachable"] and result["payment_completed"]):
+                summary["unhealthy"] += 1
+        return summary
+
+    def cached(self, customer_id: int) -> Optional[dict]:
+        """保存済みの確認結果。未確認なら None"""
+        try:
+            result = self._cli.hgetall(_result_key(customer_id))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return None
+        if not result:
+            return None
+        return {
+            "wordpress_reachable": bool(int(result.get("wordpress_reachable", 1))),
+            "payment_completed": bool(int(result.get("payment_completed", 1))),
+            "checked_at": float(result.get("checked_at", 0)),
+        }
+
+    def a_root_status(self, customer: Customer) -> int:
+        """
+        Customer.a_root_status をキャッシュした確認結果で求める（画面表示用）。
+        未確認の間は問題なしとして扱い、確認はバックグラウンドで行う。
+        """
+        result = self.cached(customer.id)
+        if result is None or time.time() - result["checked_at"] >= STALE_SECONDS:
+            self.refresh_async(customer)
+        if result is None:
+            return customer.a_root_status(
+                wordpress_reachable=True, payment_completed=True
+            )
+        return customer.a_root_status(
+            wordpress_reachable=result["wordpress_reachable"],
+            payment_completed=result["payment_completed"],
+        )
+
+    def refresh_async(self, customer: Customer) -> bool:
+        """バックグラウンドで確認し直す。他で確認中なら何もしない"""
+        try:
+            if not self._cli.set(
+                _refresh_lock_key(customer.id), 1, nx=True, ex=REFRESH_LOCK_TTL
+            ):
+                return False
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+        with _refreshing_lock:
+            if customer.id in _refreshing:
+                return False
+            _refreshing.add(customer.id)
+        _refresh_executor.submit(self._refresh, customer)
+        return True
+
+    def _refresh(self, customer: Customer) -> None:
+        try:
+            self.probe(customer)
+        except Exception as e:
+            print(f"<HealthService> refresh failed: customer_id={customer.id}, {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(customer.id)
@@ -0,0 +1,68 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# 外部連携（Meta / WordPress / Slack / CAREO）で共有するHTTPセッション
+_session: requests.Session | None = None
+_lock = threading.Lock()
+
+DEFAULT_TIMEOUT = int(os.getenv("HTTP_DEFAULT_TIMEOUT", "30"))
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=int(os.getenv("HTTP_RETRY_TOTAL", "3")),
+        backoff_factor=float(os.getenv("HTTP_RETRY_BACKOFF", "0.5")),
+        status_forcelist=(429, 500, 502, 503, 504),
+        # POSTは冪等でないためリトライしない（urllib3のデフォルト）
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        # ホストごとのプールをいくつ保持するか
+        pool_connections=int(os.getenv("HTTP_POOL_HOSTS", "32")),
+        # 1ホストあたりのkeep-alive接続数（バッチのスレッド数以上にする）
+        pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "16")),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _reset_after_fork() -> None:
+    # 親プロセスのソケットを子プロセスで使い回さない
+    global _session, _lock
+    _session = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
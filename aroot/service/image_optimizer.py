@@ -0,0 +1,162 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse
+
+import redis
+
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow が無い環境では最適化せずにそのまま転送する
+    Image = None
+
+
+# 1 のときだけアップロード前に画像を縮小・再圧縮する
+ENABLED = os.getenv("IMAGE_OPTIMIZE", "0") == "1"
+# 長辺の最大ピクセル数（投稿のHTMLは500×500で表示するので、高解像度の画面向けに倍まで残す）
+MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1080"))
+QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+# JPEG / WEBP
+# WEBP は顧客の WordPress に image/webp を許可した a-root.php が入っている必要がある。
+# 古いプラグインのサイトではアップロードが拒否されるので、全顧客へ再配布するまでは JPEG のままにする
+FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+# 縮小を行うプロセス数
+WORKERS = int(os.getenv("IMAGE_OPTIMIZE_WORKERS", "2"))
+
+_FORMATS = {"JPEG": ("image/jpeg", ".jpeg"), "WEBP": ("image/webp", ".webp")}
+
+
+def _savings_key(host: str) -> str:
+    return f"image:savings:{host}"
+
+
+def _normalize_host(wordpress_url: str) -> str:
+    if "://" in wordpress_url:
+        return urlparse(wordpress_url).netloc
+    return wordpress_url.rstrip("/")
+
+
+def shrink(data: bytes, max_dimension: int, quality: int, image_format: str) -> bytes:
+    """
+    長辺を max_dimension 以下に縮小し、image_format で再圧縮する（プロセスプールで実行する）。
+    EXIF などのメタデータは書き出さない（向きは画素に反映してから捨てる）。
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        icc_profile = image.info.get("icc_profile")
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if image_format == "WEBP":
+            image.save(out, "WEBP", quality=quality, icc_profile=icc_profile)
+        else:
+            image.save(
+                out,
+                "JPEG",
+                quality=quality,
+                optimize=True,
+                progressive=True,
+                icc_profile=icc_profile,
+            )
+    return out.getvalue()
+
+
+class ImageOptimizer:
+    """
+    WordPressへアップロードする画像を縮小・再圧縮する。
+    画像の処理はGILを持ったままになるため、バッチのスレッドではなくプロセスプールで行う。
+    削減できたバイト数はホスト（顧客のサイト）ごとにRedisへ積算する。
+    """
+
+    def __init__(self, redis_cli=None):
+        self.redis_cli = redis_cli
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor: ProcessPoolExecutor = None
+        self.stats = {"optimized": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    @property
+    def enabled(self) -> bool:
+        return ENABLED and Image is not None and FORMAT in _FORMATS
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # フォークした子プロセスでは作り直す。スレッドを持つ親からの fork を避けて spawn で起動する
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn")
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            self._pid = None
+
+    def transform(self, data: bytes, filename: str, mime: str) -> tuple[bytes, str, str]:
+        """
+        (内容, ファイル名, MIME) を縮小したものに置き換えて返す。
+        小さくならない場合や処理できない場合は元のまま返す。
+        """
+        try:
+            optimized = (
+                self._get_executor()
+                .submit(shrink, data, MAX_DIMENSION, QUALITY, FORMAT)
+                .result()
+            )
+        except BrokenProcessPool as e:
+            self._reset_executor()
+            self.stats["failed"] += 1
+            print(f"<ImageOptimizer> process pool is broken: {e}")
+            return data, filename, mime
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"<ImageOptimizer> {filename}: {e}")
+            return data, filename, mime
+        if len(optimized) >= len(data):
+            self.stats["skipped"] += 1
+            return data, filename, mime
+        self.stats["optimized"] += 1
+        self.stats["bytes_saved"] += len(data) - len(optimized)
+        optimized_mime, suffix = _FORMATS[FORMAT]
+        return optimized, f"{os.path.splitext(filename)[0]}{suffix}", optimized_mime
+
+    def record(self, host: str, original_bytes: int, uploaded_bytes: int) -> None:
+        """アップロードした画像1件分の元のサイズと送ったサイズを積算する"""
+        try:
+            pipe = self._cli.pipeline()
+            key = _savings_key(_normalize_host(host))
+            pipe.hincrby(key, "images", 1)
+            pipe.hincrby(key, "original_bytes", original_bytes)
+            pipe.hincrby(key, "uploaded_bytes", uploaded_bytes)
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def savings(self, wordpress_url: str) -> dict:
+        """顧客のサイトへアップロードした画像の {images, original_bytes, uploaded_bytes, bytes_saved}"""
+        try:
+            data = self._cli.hgetall(_savings_key(_normalize_host(wordpress_url)))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            data = {}
+        savings = {
+            name: int(data.get(name, 0))
+            for name in ("images", "original_bytes", "uploaded_bytes")
+        }
+        savings["bytes_saved"] = savings["original_bytes"] - savings["uploaded_bytes"]
+        return savings
+
+
+image_optimizer = ImageOptimizer()
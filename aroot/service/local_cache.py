@@ -0,0 +1,204 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import redis
+
+
+# 1回の操作のついでに期限切れを掃除する最大件数
+ACTIVE_EXPIRE_BATCH = 20
+
+
+def _encode(value) -> str:
+    """redis-py（decode_responses=True）と同じく、値は文字列で保持する"""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+class LocalCache:
+    """
+    Redis に接続できない間に使う、プロセス内のキャッシュ。
+    redis-py のうち文字列の操作（get / set / setex / incr / expire / ttl / exists / delete）と
+    pipeline だけを持つ。ハッシュ・リスト・セットなど Redis でしか扱えないものは
+    get_shared_redis() を使い、LocalCache で呼ぶと redis.ConnectionError になる。
+    キー数が max_keys を超えたら最も使われていないものから捨て、期限切れは操作のたびに少しずつ掃除する。
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._expires: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _expire_active(self, now: float) -> None:
+        for _ in range(ACTIVE_EXPIRE_BATCH):
+            if not self._heap or self._heap[0][0] > now:
+                return
+            expire_at, key = heapq.heappop(self._heap)
+            # 期限が更新・解除されたキーの古いエントリは読み飛ばす
+            if self._expires.get(key) == expire_at:
+                self._remove(key)
+                self._stats["expired"] += 1
+
+    def _alive(self, key: str, now: float) -> bool:
+        if key not in self._data:
+            return False
+        expire_at = self._expires.get(key)
+        if expire_at is not None and expire_at <= now:
+            self._remove(key)
+            self._stats["expired"] += 1
+            return False
+        return True
+
+    def _remove(self, key: str) -> None:
+        self._data.pop(key, None)
+        self._expires.pop(key, None)
+
+    def _set_expire(self, key: str, expire_at: Optional[float]) -> None:
+        if expire_at is None:
+            self._expires.pop(key, None)
+            return
+        self._expires[key] = expire_at
+        heapq.heappush(self._heap, (expire_at, key))
+        if len(self._heap) > 2 * self.max_keys:
+            # 上書き・削除で残った古いエントリを捨てて作り直す
+            self._heap = [(at, k) for k, at in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def _store(self, key: str, value: str) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            evicted, _ = self._data.popitem(last=False)
+            self._expires.pop(evicted, None)
+            self._stats["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            now = time.time()
+            self._expire_active(now)
+            if not self._alive(key, now):
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        with self._lock:
+            now = time.time()
+            self._expire_active(now)
+            exists = self._alive(key, now)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._store(key, _encode(value))
+            if ex is not None:
+                self._set_expire(key, now + int(ex))
+            elif px is not None:
+                self._set_expire(key, now + int(px) / 1000)
+            elif not keepttl:
+                self._set_expire(key, None)
+            return True
+
+    def setex(self, key, time_seconds, value):
+        return self.set(key, value, ex=time_seconds)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            now = time.time()
+            self._expire_active(now)
+            current = int(self._data[key]) if self._alive(key, now) else 0
+            # INCR は有効期限を変えない
+            self._store(key, str(current + amount))
+            return current + amount
+
+    incrby = incr
+
+    def expire(self, key, seconds):
+        with self._lock:
+            now = time.time()
+            if not self._alive(key, now):
+                return False
+            self._set_expire(key, now + int(seconds))
+            return True
+
+    def ttl(self, key) -> int:
+        with self._lock:
+            now = time.time()
+            if not self._alive(key, now):
+                return -2
+            expire_at = self._expires.get(key)
+            if expire_at is None:
+                return -1
+            return int(expire_at - now + 0.999)
+
+    def exists(self, *keys) -> int:
+        with self._lock:
+            now = time.time()
+            return sum(1 for key in keys if self._alive(key, now))
+
+    def delete(self, *keys) -> int:
+        with self._lock:
+            now = time.time()
+            deleted = 0
+            for key in keys:
+                if self._alive(key, now):
+                    deleted += 1
+                self._remove(key)
+            return deleted
+
+    def ping(self):
+        return True
+
+    def close(self):
+        # Flaskのteardownから呼ばれる。プロセス内で共有するので何もしない
+        pass
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def __getattr__(self, name):
+        # 対応していないコマンドは、Redis に接続できないときと同じ例外にする（AttributeError にしない）
+        if name.startswith("_"):
+            raise AttributeError(name)
+        raise redis.ConnectionError(
+            f"redis is unavailable and LocalCache does not support '{name}'"
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire_active(time.time())
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "keys": len(self._data),
+                "max_keys": self.max_keys,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+class LocalPipeline:
+    """LocalCache 用のパイプライン。execute でまとめて（ロックを取ったまま）実行する"""
+
+    def __init__(self, cache: LocalCache):
+        self._cache = cache
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._cache, name)
+
+        def command(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return command
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self._cache._lock:
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
@@ -0,0 +1,73 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# 1顧客あたりの並列数（投稿・カルーセルの子要素それぞれ）
+MEDIA_WORKERS = int(os.getenv("CUSTOMER_MEDIA_WORKERS", "4"))
+# 1つのWordPressホストへ同時に投げるリクエスト数の上限（プロセス全体）
+HOST_CONCURRENCY = int(os.getenv("WORDPRESS_HOST_CONCURRENCY", "3"))
+
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+
+
+def _get_slot(host: str) -> threading.BoundedSemaphore:
+    slot = _host_slots.get(host)
+    if slot is None:
+        with _lock:
+            slot = _host_slots.setdefault(
+                host, threading.BoundedSemaphore(HOST_CONCURRENCY)
+            )
+    return slot
+
+
+@contextmanager
+def host_slot(host: str):
+    """小規模な顧客サイトを詰まらせないよう、ホスト単位で同時実行数を絞る"""
+    slot = _get_slot(host)
+    slot.acquire()
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def map_ordered(
+    fn: Callable[[T], R], items: Iterable[T], max_workers: int = MEDIA_WORKERS
+) -> list[R]:
+    """
+    items を並列に処理し、入力と同じ順序で結果を返す。
+    逐次処理と同じく、1件でも失敗したらまだ始まっていないものは実行しない。
+    実行中のものの完了を待ってから、入力順で最初の例外を送出する。
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [fn(item) for item in items]
+    failed = threading.Event()
+
+    def run(item: T) -> R:
+        if failed.is_set():
+            raise _Skipped()
+        try:
+            return fn(item)
+        except BaseException:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(run, item) for item in items]
+    for future in futures:
+        error = future.exception()
+        # 実行しなかったものは、必ずそれより先に始まった失敗の後ろにある
+        if error is not None and not isinstance(error, _Skipped):
+            raise error
+    return [future.result() for future in futures]
+
+
+class _Skipped(Exception):
+    """先に失敗したものがあったため実行しなかった"""
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import resource
+import tempfile
+import time
+import uuid
+from typing import Callable, Iterable, Iterator
+
+import requests
+
+from service import http_client
+
+
+# CDN → WordPress 転送時のチャンクサイズ
+CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(256 * 1024)))
+# Content-Length が分からない場合、このサイズを超えた分だけディスクに退避する
+SPOOL_THRESHOLD = int(os.getenv("MEDIA_SPOOL_THRESHOLD", str(32 * 1024 * 1024)))
+
+
+class MediaTransferError(Exception):
+    pass
+
+
+class TransferStats:
+    """1回の転送で計測した値"""
+
+    def __init__(self, source_url: str):
+        self.source_url = source_url
+        self.bytes = 0
+        # アップロードしたバイト数（画像を縮小した場合は bytes より小さくなる）
+        self.uploaded_bytes = 0
+        self.mode = "stream"
+        self.disk_bytes = 0
+        self.elapsed = 0.0
+        self.peak_rss_kb = 0
+        self.peak_rss_growth_kb = 0
+        # 転送した内容のハッシュ（アップロード済みファイルの再利用に使う）
+        self.hasher = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self.hasher.hexdigest()
+
+    def __repr__(self):
+        return (
+            f"TransferStats(mode={self.mode}, bytes={self.bytes}, "
+            f"uploaded_bytes={self.uploaded_bytes}, "
+            f"disk_bytes={self.disk_bytes}, elapsed={self.elapsed:.2f}s, "
+            f"peak_rss_kb={self.peak_rss_kb}, "
+            f"peak_rss_growth_kb={self.peak_rss_growth_kb})"
+        )
+
+
+class MultipartStream:
+    """
+    multipart/form-data のボディをチャンク単位で送出する。
+    __len__ を持つので requests は chunked ではなく Content-Length 付きで送信する。
+    """
+
+    def __init__(
+        self,
+        fields: dict,
+        filename: str,
+        mime: str,
+        chunks: Iterable[bytes],
+        content_length: int,
+    ):
+        boundary = uuid.uuid4().hex
+        head = b""
+        for name, value in fields.items():
+            head += (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+        head += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {mime}\r\n\r\n"
+        ).encode("utf-8")
+        self.head = head
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.chunks = chunks
+        self.content_length = content_length
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+    def __len__(self):
+        return len(self.head) + self.content_length + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        sent = 0
+        for chunk in self.chunks:
+            sent += len(chunk)
+            yield chunk
+        if sent != self.content_length:
+            # Content-Length と実データがずれたまま送るとリクエストが壊れる
+            raise MediaTransferError(
+                f"source size mismatch: expected {self.content_length}, got {sent}"
+            )
+        yield self.tail
+
+
+def _peak_rss_kb() -> int:
+    # Linux では KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _counting(chunks: Iterable[bytes], stats: TransferStats) -> Iterator[bytes]:
+    for chunk in chunks:
+        if chunk:
+            stats.bytes += len(chunk)
+            stats.hasher.update(chunk)
+            yield chunk
+
+
+def _spool(source: requests.Response, stats: TransferStats):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD)
+    for chunk in _counting(source.iter_content(CHUNK_SIZE), stats):
+        spool.write(chunk)
+    if getattr(spool, "_rolled", False):
+        stats.mode = "spool-disk"
+        stats.disk_bytes = stats.bytes
+    else:
+        stats.mode = "spool-memory"
+    spool.seek(0)
+    return spool
+
+
+def _read_chunks(fp) -> Iterator[bytes]:
+    while True:
+        chunk = fp.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def stream_upload(
+    source_url: str,
+    upload_url: str,
+    fields: dict,
+    filename: str,
+    mime: str,
+    headers: dict | None = None,
+    timeout: int = 120,
+) -> tuple[requests.Response, TransferStats]:
+    """
+    CDN のレスポンスボディをそのまま multipart でアップロード先へ流す。
+    Content-Length が取れない場合のみ SpooledTemporaryFile に退避してから送る。
+    """
+    stats = TransferStats(source_url)
+    rss_before = _peak_rss_kb()
+    started = time.monotonic()
+
+    source = http_client.get(
+        source_url,
+        stream=True,
+        timeout=timeout,
+        # 圧縮されるとContent-Lengthと実データ長が一致しなくなる
+        headers={"Accept-Encoding": "identity"},
+    )
+    spool = None
+    try:
+        source.raise_for_status()
+        content_length = source.headers.get("Content-Length")
+        if content_length is not None and content_length.isdigit():
+            chunks = _counting(source.iter_content(CHUNK_SIZE), stats)
+            length = int(content_length)
+        else:
+            spool = _spool(source, stats)
+            chunks = _read_chunks(spool)
+            length = stats.bytes
+
+        stats.uploaded_bytes = length
+        body = MultipartStream(fields, filename, mime, chunks, length)
+        upload_headers = dict(headers or {})
+        upload_headers["Content-Type"] = body.content_type
+        response = http_client.post(
+            upload_url, data=body, headers=upload_headers, timeout=timeout
+        )
+    finally:
+        source.close()
+        if spool is not None:
+            spool.close()
+
+    _finish(stats, started, rss_before)
+    return response, stats
+
+
+def transform_upload(
+    source_url: str,
+    upload_request: Callable[[str], tuple[str, dict, dict]],
+    filename: str,
+    mime: str,
+    transform: Callable[[bytes, str, str], tuple[bytes, str, str]],
+    timeout: int = 120,
+) -> tuple[requests.Response, TransferStats]:
+    """
+    CDN から全体を読み込み、transform で (内容, ファイル名, MIME) を置き換えてから送る。
+    署名にファイル名を含むため、アップロード先は upload_request(ファイル名) で決める。
+    """
+    stats = TransferStats(source_url)
+    stats.mode = "transform"
+    rss_before = _peak_rss_kb()
+    started = time.monotonic()
+
+    source = http_client.get(
+        source_url,
+        stream=True,
+        timeout=timeout,
+        headers={"Accept-Encoding": "identity"},
+    )
+    try:
+        source.raise_for_status()
+        content = b"".join(_counting(source.iter_content(CHUNK_SIZE), stats))
+    finally:
+        source.close()
+
+    content, filename, mime = transform(content, filename, mime)
+    upload_url, fields, headers = upload_request(filename)
+    stats.uploaded_bytes = len(content)
+    body = MultipartStream(fields, filename, mime, [content], len(content))
+    upload_headers = dict(headers or {})
+    upload_headers["Content-Type"] = body.content_type
+    response = http_client.post(
+        upload_url, data=body, headers=upload_headers, timeout=timeout
+    )
+
+    _finish(stats, started, rss_before)
+    return response, stats
+
+
+def _finish(stats: TransferStats, started: float, rss_before: int) -> None:
+    stats.elapsed = time.monotonic() - started
+    stats.peak_rss_kb = _peak_rss_kb()
+    stats.peak_rss_growth_kb = stats.peak_rss_kb - rss_before
+
+
+def generate_filename(suffix: str) -> str:
+    return f"{uuid.uuid4().hex}{suffix}"
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from typing import Mapping, Optional
+
+import redis
+
+from service.redis_client import create_redis
+
+
+USAGE_KEY = "meta:usage"
+PAUSE_KEY = "meta:pause_until"
+METRICS_KEY = "meta:metrics"
+
+# この使用率（%）を超えたらリクエストの間隔を空け始める
+SLOW_THRESHOLD = float(os.getenv("META_USAGE_SLOW_THRESHOLD", "75"))
+# この使用率（%）を超えたら一時停止する
+PAUSE_THRESHOLD = float(os.getenv("META_USAGE_PAUSE_THRESHOLD", "95"))
+# SLOW_THRESHOLD〜PAUSE_THRESHOLD の間で1リクエストあたり最大何秒待つか
+MAX_DELAY = float(os.getenv("META_USAGE_MAX_DELAY", "10"))
+# 一時停止する秒数（使用率は1時間の移動窓なので、数分待てば下がる）
+PAUSE_SECONDS = int(os.getenv("META_USAGE_PAUSE_SECONDS", "300"))
+# 記録した使用率の有効期間。これより古い値は 0% とみなす
+USAGE_TTL = int(os.getenv("META_USAGE_TTL", "600"))
+# Redis から共有の状態を読み直す間隔（秒）
+REFRESH_INTERVAL = 1.0
+# Redis に接続できなかった場合、次に試すまでの秒数
+REDIS_RETRY_INTERVAL = 30.0
+# レート制限を示す Graph API のエラーコード
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80001, 80002, 80004}
+
+
+def _load(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def _max_percent(usage: dict) -> float:
+    return float(
+        max(
+            usage.get("call_count") or 0,
+            usage.get("total_cputime") or 0,
+            usage.get("total_time") or 0,
+        )
+    )
+
+
+def parse_usage(headers: Mapping[str, str]) -> Optional[dict]:
+    """
+    X-App-Usage / X-Business-Use-Case-Usage ヘッダーから使用率（%）と回復までの秒数を取り出す。
+    どちらのヘッダーも無ければ None
+    """
+    app_usage = _load(headers.get("X-App-Usage"))
+    business_usage = _load(headers.get("X-Business-Use-Case-Usage"))
+    if not isinstance(app_usage, dict) and not isinstance(business_usage, dict):
+        return None
+    usage = {"app": 0.0, "business": 0.0, "regain_seconds": 0}
+    if isinstance(app_usage, dict):
+        usage["app"] = _max_percent(app_usage)
+    if isinstance(business_usage, dict):
+        for entries in business_usage.values():
+            for entry in entries if isinstance(entries, list) else []:
+                usage["business"] = max(usage["business"], _max_percent(entry))
+                regain_minutes = entry.get("estimated_time_to_regain_access") or 0
+                usage["regain_seconds"] = max(
+                    usage["regain_seconds"], int(regain_minutes) * 60
+                )
+    return usage
+
+
+class MetaRateGovernor:
+    """
+    Graph API の使用率をプロセス間で共有し、上限に達する前にリクエストを減速・停止させる。
+    Redis に接続できない場合は、このプロセス内で観測した値だけで判断する。
+    """
+
+    def __init__(self, redis_cli=None):
+        self._redis = redis_cli
+        self._lock = threading.Lock()
+        self._level = 0.0
+        self._pause_until = 0.0
+        self._refreshed_at = 0.0
+        self._redis_retry_at = 0.0
+
+    def _execute(self, build) -> Optional[list]:
+        """build(pipeline) で積んだコマンドを実行。Redis が落ちている間は何もしない"""
+        if time.time() < self._redis_retry_at:
+            return None
+        try:
+            if self._redis is None:
+                self._redis = create_redis()
+            pipe = self._redis.pipeline()
+            build(pipe)
+            return pipe.execute()
+        except redis.RedisError as e:
+            print(f"<MetaRateGovernor> redis error: {e}")
+            self._redis_retry_at = time.time() + REDIS_RETRY_INTERVAL
+            return None
+
+    def record(self, headers: Mapping[str, str], error_code: Optional[int] = None):
+        """レスポンスごとに呼び出し、使用率を記録する"""
+        usage = parse_usage(headers)
+        throttled = error_code in RATE_LIMIT_ERROR_CODES
+        if usage is None and not throttled:
+            return
+        usage = usage or {"app": 0.0, "business": 0.0, "regain_seconds": 0}
+        level = max(usage["app"], usage["business"])
+        now = time.time()
+        pause_until = 0.0
+        if usage["regain_seconds"] > 0:
+            pause_until = now + usage["regain_seconds"]
+        elif throttled or level >= PAUSE_THRESHOLD:
+            pause_until = now + PAUSE_SECONDS
+
+        with self._lock:
+            self._level = level
+            self._pause_until = max(self._pause_until, pause_until)
+
+        def build(pipe):
+            pipe.hset(
+                USAGE_KEY,
+                mapping={
+                    "app": usage["app"],
+                    "business": usage["business"],
+                    "level": level,
+                    "updated_at": now,
+                },
+            )
+            pipe.expire(USAGE_KEY, USAGE_TTL)
+            if pause_until:
+                pipe.set(PAUSE_KEY, pause_until, ex=int(pause_until - now) + 1)
+                pipe.hincrby(METRICS_KEY, "pauses", 1)
+            if throttled:
+                pipe.hincrby(METRICS_KEY, "rate_limit_errors", 1)
+
+        self._execute(build)
+        if pause_until:
+            print(
+                f"<MetaRateGovernor> pause: level={level}, "
+                f"seconds={int(pause_until - now)}, error_code={error_code}"
+            )
+
+    def _refresh(self):
+        """他のプロセスが記録した使用率を取り込む"""
+        now = time.time()
+        if now - self._refreshed_at < REFRESH_INTERVAL:
+            return
+        self._refreshed_at = now
+        result = self._execute(
+            lambda pipe: pipe.hget(USAGE_KEY, "level").get(PAUSE_KEY)
+        )
+        if result is None:
+            return
+        level, pause_until = result
+        with self._lock:
+            self._level = float(level or 0)
+            self._pause_until = max(self._pause_until, float(pause_until or 0))
+
+    def paused_for(self) -> float:
+        """一時停止中なら残り秒数"""
+        self._refresh()
+        return max(self._pause_until - time.time(), 0.0)
+
+    def delay(self) -> float:
+        """次のリクエストまでに待つべき秒数"""
+        wait = self.paused_for()
+        if wait == 0 and self._level >= SLOW_THRESHOLD:
+            ratio = (self._level - SLOW_THRESHOLD) / max(
+                PAUSE_THRESHOLD - SLOW_THRESHOLD, 1
+            )
+            wait = MAX_DELAY * min(ratio, 1.0)
+        if wait > 0:
+            self._execute(
+                lambda pipe: pipe.hincrby(METRICS_KEY, "throttled_calls", 1).hincrbyfloat(
+                    METRICS_KEY, "throttled_seconds", round(wait, 3)
+                )
+            )
+        return wait
+
+    def wait(self):
+        wait = self.delay()
+        if wait > 0:
+            time.sleep(wait)
+
+    def metrics(self) -> dict:
+        result = self._execute(
+            lambda pipe: pipe.hgetall(USAGE_KEY).get(PAUSE_KEY).hgetall(METRICS_KEY)
+        )
+        if result is None:
+            return {"error": "redis unavailable", "level": self._level}
+        usage, pause_until, counters = result
+        return {
+            "usage": {key: float(value) for key, value in usage.items()},
+            "paused_for": round(max(float(pause_until or 0) - time.time(), 0.0), 1),
+            "slow_threshold": SLOW_THRESHOLD,
+            "pause_threshold": PAUSE_THRESHOLD,
+            "throttled_calls": int(counters.get("throttled_calls", 0)),
+            "throttled_seconds": float(counters.get("throttled_seconds", 0)),
+            "pauses": int(counters.get("pauses", 0)),
+            "rate_limit_errors": int(counters.get("rate_limit_errors", 0)),
+        }
+
+
+# プロセス内で共有する
+governor = MetaRateGovernor()
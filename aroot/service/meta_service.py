@@ -1,36 +1,98 @@
+import json
 import os
-import requests
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice, takewhile
+from typing import Iterator, Optional, Union
+from urllib.parse import urlencode
 
+from service import http_client
+from service.meta_rate_governor import governor
 from domain.instagram_media import InstagramMedia
 
+MEDIA_FIELDS = (
+    "id,permalink,caption,timestamp,"
+    + "media_type,media_url,children{id,media_type,media_url}"
+)
+# バッチでの取得方式: incremental（前回連携分以降のみ） / full（最新100件）
+FETCH_MODE = os.getenv("META_FETCH_MODE", "incremental")
+# /media エッジの1ページあたりの件数
+PAGE_SIZE = int(os.getenv("META_MEDIA_PAGE_SIZE", "25"))
+# /media エッジの limit に指定できる上限
+MAX_PAGE_SIZE = 100
+# iter_media が辿るページ数の上限（投稿数の多いアカウントで際限なく取得しないため）
+MAX_PAGES = int(os.getenv("META_MEDIA_MAX_PAGES", "40"))
+# Graph API のバッチリクエスト1回にまとめる顧客数（APIの上限は50）
+BATCH_SIZE = min(int(os.getenv("META_BATCH_SIZE", "50")), 50)
+# 有効期限の無いトークン（debug_token の expires_at が 0）の有効期限として記録する値
+TOKEN_NEVER_EXPIRES = datetime(9999, 12, 31)
+
 
 class MetaService:
-    def __init__(self):
+    def __init__(self, governed: bool = False):
+        """
+        :param governed: True ならAPIの使用率に応じてリクエスト前に待機する（バッチ用）。
+            画面からの呼び出しでは待たず、使用率の記録だけを行う。
+        """
         self.base_url = "https://graph.facebook.com/v23.0"
         self.client_id = os.getenv("META_CLIENT_ID")
         self.client_secret = os.getenv("META_CLIENT_SECRET")
+        self.governed = governed
+
+    def _request(self, method: str, url: str, **kwargs):
+        if self.governed:
+            governor.wait()
+        response = http_client.request(method, url, **kwargs)
+        error_code = None
+        if not 200 <= response.status_code < 300:
+            error_code = _error_code(response)
+        governor.record(response.headers, error_code)
+        return response
 
-    def refresh_token(self, access_token):
+    def refresh_token(self, access_token) -> tuple[str, Optional[datetime]]:
+        """:return: (新しいトークン, 有効期限（UTC）。レスポンスに無ければ None)"""
         params = dict()
         params["grant_type"] = "ig_refresh_token"
         params["access_token"] = access_token
-        response = requests.get(self.base_url + "/refresh_access_token", params=params)
+        response = self._request(
+            "GET", self.base_url + "/refresh_access_token", params=params
+        )
         print(f"response: {response.json()}, status: {response.status_code}")
         if 200 <= response.status_code < 300:
-            return response.json()["access_token"]
+            return response.json()["access_token"], _expires_at(response.json())
         raise MetaApiError(response.json())
 
-    def get_long_term_token(self, access_token):
+    def debug_token(self, access_token) -> Optional[datetime]:
+        """トークンの有効期限（UTC）。無効なトークン、または取得できなければ None"""
+        params = {
+            "input_token": access_token,
+            "access_token": self.batch_access_token(access_token),
+        }
+        response = self._request("GET", self.base_url + "/debug_token", params=params)
+        if not 200 <= response.status_code < 300:
+            raise MetaApiError(response.json())
+        data = response.json().get("data", {})
+        if not data.get("is_valid"):
+            return None
+        if not data.get("expires_at"):
+            return TOKEN_NEVER_EXPIRES
+        return datetime.fromtimestamp(data["expires_at"], timezone.utc).replace(
+            tzinfo=None
+        )
+
+    def get_long_term_token(self, access_token) -> tuple[str, Optional[datetime]]:
+        """:return: (長期トークン, 有効期限（UTC）。レスポンスに無ければ None)"""
         print("get_long_term_token is invoked")
         params = dict()
         params["grant_type"] = "fb_exchange_token"
         params["fb_exchange_token"] = access_token
         params["client_id"] = self.client_id
         params["client_secret"] = self.client_secret
-        response = requests.get(self.base_url + "/oauth/access_token", params=params)
+        response = self._request(
+            "GET", self.base_url + "/oauth/access_token", params=params
+        )
         print(f"response: {response.json()}, status: {response.status_code}")
         if 200 <= response.status_code < 300:
-            return response.json()["access_token"]
+            return response.json()["access_token"], _expires_at(response.json())
         raise MetaApiError(response.json())
 
     def get_instagram_account(self, access_token):
@@ -38,7 +100,7 @@ class MetaService:
         params = dict()
         params["access_token"] = access_token
         params["fields"] = "accounts{name,instagram_business_account{name,username}}"
-        response = requests.get(self.base_url + "/me", params=params)
+        response = self._request("GET", self.base_url + "/me", params=params)
         if 200 <= response.status_code < 300:
             if "accounts" in response.json():  # 設定が正しくないと、ここがfalseになる。
                 facebook_pages = response.json()["accounts"]["data"]
@@ -54,34 +116,209 @@ class MetaService:
             raise MetaAccountNotFoundError("Not found instagram_business_account")
         raise MetaApiError(response.json())
 
-    def get_media_list(
-        self, access_token, instagram_business_account_id
-    ) -> list[InstagramMedia]:
+    def media_edge_request(
+        self, access_token, instagram_business_account_id, limit: int
+    ) -> tuple[str, dict]:
+        """/{ig-user-id}/media エッジ（新しい順・カーソルでページング）の (url, params)"""
         params = dict()
         params["access_token"] = access_token
-        params["fields"] = (
-            "media{id,permalink,caption,timestamp,"
-            + "media_type,media_url,children{media_type,media_url}}"
+        params["fields"] = MEDIA_FIELDS
+        params["limit"] = limit
+        return self.base_url + f"/{instagram_business_account_id}/media", params
+
+    @staticmethod
+    def parse_media_page(response_json: dict) -> tuple[list[InstagramMedia], Optional[str]]:
+        """1ページ分の投稿（新しい順）と次ページのURL"""
+        medias = [InstagramMedia(media) for media in response_json.get("data", [])]
+        next_url = response_json.get("paging", {}).get("next")
+        return medias, next_url
+
+    def iter_media(
+        self,
+        access_token,
+        instagram_business_account_id,
+        page_size: int = PAGE_SIZE,
+        max_pages: Optional[int] = MAX_PAGES,
+    ) -> Iterator[InstagramMedia]:
+        """
+        投稿を新しい順に1件ずつ返す。paging.next は必要になった時点で取得する。
+        呼び出し側がループを抜ければ、それ以降のページは取得しない。
+        :param max_pages: 取得するページ数の上限（None なら最後まで）
+        """
+        url, params = self.media_edge_request(
+            access_token, instagram_business_account_id, page_size
+        )
+        return self._iter_pages(url, params, max_pages)
+
+    def _iter_pages(
+        self, url: Optional[str], params: Optional[dict], max_pages: Optional[int]
+    ) -> Iterator[InstagramMedia]:
+        pages = 0
+        while url is not None and (max_pages is None or pages < max_pages):
+            response = self._request("GET", url, params=params)
+            pages += 1
+            if not 200 <= response.status_code < 300:
+                raise MetaApiError(response.json())
+            medias, url = self.parse_media_page(response.json())
+            # next のURLにはクエリが含まれている
+            params = None
+            yield from medias
+
+    def get_media_list_since(
+        self, access_token, instagram_business_account_id, since: datetime
+    ) -> list[InstagramMedia]:
+        """
+        since 以降の投稿だけを取得する。
+        新しい順にページを辿り、since より古い投稿に到達した時点で打ち切る。
+        :return: 古い順の投稿リスト（get_media_list と同じ並び）
+        """
+        result = list(
+            takewhile(
+                lambda media: media.timestamp >= since,
+                self.iter_media(
+                    access_token, instagram_business_account_id, max_pages=None
+                ),
+            )
         )
-        params["limit"] = 100
-        response = requests.get(
-            self.base_url + f"/{instagram_business_account_id}", params=params
+        print(
+            f"<Meta> incremental fetch: account={instagram_business_account_id}, "
+            f"media={len(result)}"
         )
-        result = list()
-        if 200 <= response.status_code < 300:
-            print(response.json())
-            response_json = response.json()
-
-            if "media" in response_json and "data" in response_json["media"]:
-                media_data = response_json["media"]["data"]
-                media_data.reverse()
-                for media in media_data:
-                    insta = InstagramMedia(media)
-                    result.append(insta)
-                return result
-            else:
-                return []
-        raise MetaApiError(response.json())
+        result.reverse()
+        return result
+
+    def get_media_list_for_sync(
+        self, access_token, instagram_business_account_id, watermark: Optional[datetime]
+    ) -> list[InstagramMedia]:
+        """バッチ連携用の取得。差分取得モードでは watermark 以降の投稿だけを取得する"""
+        if FETCH_MODE == "incremental" and watermark is not None:
+            return self.get_media_list_since(
+                access_token, instagram_business_account_id, watermark
+            )
+        return self.get_media_list(access_token, instagram_business_account_id)
+
+    def sync_window(self, customer) -> tuple[Optional[datetime], int]:
+        """get_media_list_for_sync の取得範囲 (since, 1ページの件数)。since が None なら最新100件"""
+        watermark = customer.media_watermark()
+        if FETCH_MODE == "incremental" and watermark is not None:
+            return watermark, PAGE_SIZE
+        return None, MAX_PAGE_SIZE
+
+    def get_media_lists_for_sync(
+        self, customers: list
+    ) -> dict[int, Union[list[InstagramMedia], "MetaApiError"]]:
+        """
+        複数顧客の get_media_list_for_sync を Graph API のバッチリクエストでまとめて行う。
+        顧客ごとのエラーは送出せず、MetaApiError を値として返す。
+        """
+        result = dict()
+        for i in range(0, len(customers), BATCH_SIZE):
+            result.update(self._fetch_media_batch(customers[i : i + BATCH_SIZE]))
+        return result
+
+    def _fetch_media_batch(self, customers: list) -> dict:
+        windows = [self.sync_window(customer) for customer in customers]
+        batch = list()
+        for customer, (_, limit) in zip(customers, windows):
+            url, params = self.media_edge_request(
+                customer.facebook_token, customer.instagram_business_account_id, limit
+            )
+            batch.append(
+                {
+                    "method": "GET",
+                    "relative_url": url[len(self.base_url) + 1 :] + "?" + urlencode(params),
+                }
+            )
+        response = self._request(
+            "POST",
+            self.base_url,
+            data={
+                # サブリクエストごとのトークンが優先され、これはフォールバックとして使われる
+                "access_token": self.batch_access_token(customers[0].facebook_token),
+                "include_headers": "false",
+                "batch": json.dumps(batch),
+            },
+        )
+        print(
+            f"<Meta> batch fetch: customers={len(customers)}, status={response.status_code}"
+        )
+        if not 200 <= response.status_code < 300:
+            return {customer.id: self._fetch_single(customer) for customer in customers}
+
+        result = dict()
+        for customer, (since, limit), item in zip(customers, windows, response.json()):
+            if item is None:
+                # タイムアウトしたサブリクエストは個別に取り直す
+                result[customer.id] = self._fetch_single(customer)
+                continue
+            body = json.loads(item.get("body") or "{}")
+            if not 200 <= item.get("code", 0) < 300:
+                error = MetaApiError(body)
+                governor.record({}, error.code)
+                result[customer.id] = error
+                continue
+            medias, next_url = self.parse_media_page(body)
+            pages = chain(medias, self._iter_pages(next_url, None, None))
+            try:
+                if since is None:
+                    media_list = list(islice(pages, limit))
+                else:
+                    media_list = list(
+                        takewhile(lambda media: media.timestamp >= since, pages)
+                    )
+            except MetaApiError as e:
+                result[customer.id] = e
+                continue
+            media_list.reverse()
+            result[customer.id] = media_list
+        return result
+
+    def _fetch_single(self, customer) -> Union[list[InstagramMedia], "MetaApiError"]:
+        try:
+            return self.get_media_list_for_sync(
+                customer.facebook_token,
+                customer.instagram_business_account_id,
+                customer.media_watermark(),
+            )
+        except MetaApiError as e:
+            return e
+
+    def batch_access_token(self, fallback: str) -> str:
+        """バッチリクエスト本体のトークン。アプリトークンが作れればそれを使う"""
+        if self.client_id and self.client_secret:
+            return f"{self.client_id}|{self.client_secret}"
+        return fallback
+
+    def get_media_list(
+        self, access_token, instagram_business_account_id, limit: int = 100
+    ) -> list[InstagramMedia]:
+        """最新 limit 件の投稿を古い順で返す"""
+        # limit 件が1ページに収まるなら1回の呼び出しで済ませる
+        pages = self.iter_media(
+            access_token,
+            instagram_business_account_id,
+            page_size=min(limit, MAX_PAGE_SIZE),
+        )
+        result = list(islice(pages, limit))
+        result.reverse()
+        return result
+
+
+def _expires_at(response_json: dict) -> Optional[datetime]:
+    """トークン発行レスポンスの expires_in（秒）から有効期限（UTC）を求める"""
+    expires_in = response_json.get("expires_in")
+    if not expires_in:
+        return None
+    return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(
+        seconds=int(expires_in)
+    )
+
+
+def _error_code(response) -> Optional[int]:
+    try:
+        return response.json().get("error", {}).get("code")
+    except ValueError:
+        return None
 
 
 class MetaAccountNotFoundError(Exception):
@@ -1,11 +1,17 @@
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
-
+import httpx
+import redis
 from openai import OpenAI
 
 
 from domain.prompt import get_prompt
-from service.redis_client import get_redis
+from service.redis_client import get_shared_redis, local_cache, mark_shared_redis_failed
 from util.const import (
     NOT_CONNECTED,
     EXPIRED,
@@ -14,10 +20,37 @@ from util.const import (
 )
 
 
+# DashboardStatus ごとに作り置きするメッセージの数
+POOL_SIZE = int(os.getenv("MAIKA_POOL_SIZE", "5"))
+# 作り置きしたメッセージの有効期間（秒）
+POOL_TTL = int(os.getenv("MAIKA_POOL_TTL", str(24 * 3600)))
+# 補充中を示すロックの有効期限（補充するプロセスが落ちた場合の保険）
+REFILL_LOCK_TTL = 120
+# 他のリクエストが生成中のメッセージを待つ最大秒数
+GENERATE_WAIT_SECONDS = 60
+
+
+def _pool_key(dashboard_status: DashboardStatus) -> str:
+    return f"maika:messages:{dashboard_status.value}"
+
+
+# 同じ状態のメッセージ生成をプロセス内で1回にまとめる
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_refill_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="maika-refill")
+# OpenAI クライアント間で接続を使い回す（httpx 0.28 では openai 側の既定クライアントが作れないため明示する）
+_http_client = httpx.Client(timeout=30)
+
+
 class OpenAIService:
     def __init__(self):
-        self.client: OpenAI = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.model = "gpt-4o-mini"
+        # OPENAI_BASE_URL を指定すると、互換APIのサーバー（ローカルのモック等）に接続する
+        self.client: OpenAI = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            http_client=_http_client,
+        )
+        self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         self.messages = [
             {
                 "role": "system",
@@ -37,20 +70,97 @@ class OpenAIService:
     def generate_message(
         self, customer_id: int, dashboard_status: DashboardStatus
     ) -> str:
-        redis_client = get_redis()
-        key = f"customer_id:{customer_id}_dashboard_status:{dashboard_status}"
-        msg = redis_client.get(key)
-        if msg is not None:
-            return msg.decode("utf-8").replace("\n", " ")
-        prompt = get_prompt(dashboard_status)
-        ai_message = self.create(prompt).replace("\n", " ")
-        redis_client.set(key, ai_message, ex=60)
-        return ai_message
+        """
+        プロンプトは DashboardStatus だけで決まるため、状態ごとに POOL_SIZE 件作り置きした中から返す。
+        足りなければバックグラウンドで補充し、1件も無いときだけその場で生成する。
+        """
+        if get_prompt(dashboard_status) is None:
+            return ""
+        messages = self._load_pool(dashboard_status)
+        if len(messages) < POOL_SIZE:
+            self.refill_async(dashboard_status)
+        if messages:
+            return random.choice(messages)
+        return self._generate_once(dashboard_status)
 
     def create(self, user_message: str) -> str:
-        self.messages.append({"role": "user", "content": user_message})
         completion = self.client.chat.completions.create(
             model=self.model,
-            messages=self.messages,
+            messages=self.messages + [{"role": "user", "content": user_message}],
         )
         return completion.choices[0].message.content
+
+    def _create_variant(self, dashboard_status: DashboardStatus) -> str:
+        return self.create(get_prompt(dashboard_status)).replace("\n", " ")
+
+    def _generate_once(self, dashboard_status: DashboardStatus) -> str:
+        """同じ状態の生成が進行中なら、その結果を待って使う"""
+        key = _pool_key(dashboard_status)
+        with _inflight_lock:
+            future = _inflight.get(key)
+            owner = future is None
+            if owner:
+                future = _inflight[key] = Future()
+        if not owner:
+            return future.result(timeout=GENERATE_WAIT_SECONDS)
+        try:
+            message = self._create_variant(dashboard_status)
+            self._append(dashboard_status, message)
+            future.set_result(message)
+            return message
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+    def refill_async(self, dashboard_status: DashboardStatus) -> bool:
+        """POOL_SIZE 件になるまでバックグラウンドで生成する。他で補充中なら何もしない"""
+        lock_key = f"{_pool_key(dashboard_status)}:refilling"
+        try:
+            if not _cli().set(lock_key, 1, nx=True, ex=REFILL_LOCK_TTL):
+                return False
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return False
+        _refill_executor.submit(self._refill, dashboard_status, lock_key)
+        return True
+
+    def _refill(self, dashboard_status: DashboardStatus, lock_key: str) -> None:
+        try:
+            while len(self._load_pool(dashboard_status)) < POOL_SIZE:
+                self._append(dashboard_status, self._create_variant(dashboard_status))
+        except Exception as e:
+            print(f"<Maika> refill failed: status={dashboard_status.name}, {e}")
+        finally:
+            try:
+                _cli().delete(lock_key)
+            except redis.RedisError as e:
+                mark_shared_redis_failed(e)
+
+    def _load_pool(self, dashboard_status: DashboardStatus) -> list[str]:
+        try:
+            data = _cli().get(_pool_key(dashboard_status))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return []
+        if data is None:
+            return []
+        return json.loads(data)["messages"]
+
+    def _append(self, dashboard_status: DashboardStatus, message: str) -> None:
+        messages = (self._load_pool(dashboard_status) + [message])[-POOL_SIZE:]
+        data = json.dumps({"messages": messages, "updated_at": time.time()})
+        try:
+            _cli().set(_pool_key(dashboard_status), data, ex=POOL_TTL)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+
+def _cli():
+    """Redis に接続できない間はプロセス内のキャッシュに作り置きする"""
+    try:
+        return get_shared_redis()
+    except redis.ConnectionError:
+        return local_cache
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import redis
+import stripe
+
+from domain.customers import Customer, get_payment_info
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+
+# この秒数以内に取得した値はそのまま返す
+PAYMENT_INFO_TTL = int(os.getenv("PAYMENT_INFO_CACHE_TTL", "3600"))
+INVOICES_TTL = int(os.getenv("INVOICES_CACHE_TTL", "600"))
+# 期限切れ後もこの秒数までは古い値を返し、裏で取り直す
+STALE_TTL = int(os.getenv("PAYMENT_CACHE_STALE_TTL", str(24 * 3600)))
+# 取得する請求書の件数
+INVOICE_LIMIT = 10
+# 同じキーの取り直しが重複しないようにするロックの有効期限
+REFRESH_LOCK_TTL = 30
+
+
+def _payment_info_key(customer_id: int) -> str:
+    return f"payment:info:{customer_id}"
+
+
+def _invoices_key(customer_id: int) -> str:
+    return f"payment:invoices:{customer_id}"
+
+
+def _stripe_customer_key(stripe_customer_id: str) -> str:
+    return f"payment:stripe_customer:{stripe_customer_id}"
+
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="payment-refresh")
+_refreshing: set[str] = set()
+_refreshing_lock = threading.Lock()
+
+
+def fetch_invoices(stripe_customer_id: str) -> list[dict]:
+    """Stripeから請求書を取得して、画面で使う項目だけにする"""
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    invoices = stripe.Invoice.list(customer=stripe_customer_id, limit=INVOICE_LIMIT)
+    return [
+        {
+            "id": invoice.id,
+            "number": invoice.number,
+            "amount_paid": invoice.amount_paid / 100,  # centから円に変換
+            "amount_due": invoice.amount_due / 100,
+            "currency": invoice.currency,
+            "status": invoice.status,
+            "created": invoice.created,
+            "due_date": invoice.due_date,
+            "hosted_invoice_url": invoice.hosted_invoice_url,
+            "invoice_pdf": invoice.invoice_pdf,
+        }
+        for invoice in invoices.data
+    ]
+
+
+class PaymentCacheService:
+    """
+    CAREOの支払い情報とStripeの請求書一覧を顧客ごとにRedisへキャッシュする。
+    TTLを過ぎた値は STALE_TTL までそのまま返し、バックグラウンドで取り直す。
+    Stripe側で変更があった場合は invalidate で破棄する。
+    """
+
+    def __init__(self, redis_cli=None):
+        self.redis_cli = redis_cli
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    def payment_info(self, customer: Customer) -> dict:
+        return self._get(
+            _payment_info_key(customer.id),
+            PAYMENT_INFO_TTL,
+            lambda: self._fetch_payment_info(customer),
+        )
+
+    def fresh_payment_info(self, customer: Customer) -> dict:
+        """キャッシュを使わずに取得する（退会など、古い値で処理してはいけない場合用）"""
+        try:
+            return self._store(
+                _payment_info_key(customer.id), self._fetch_payment_info(customer)
+            )
+        except PaymentInfoUnavailable as e:
+            return e.payment_info
+
+    def invoices(self, customer: Customer) -> Optional[list[dict]]:
+        """請求書一覧。stripe_customer_id が取得できない場合は None"""
+        stripe_customer_id = self.payment_info(customer).get("stripe_customer_id")
+        if not stripe_customer_id:
+            return None
+        return self._get(
+            _invoices_key(customer.id),
+            INVOICES_TTL,
+            lambda: fetch_invoices(stripe_customer_id),
+        )
+
+    def invalidate(self, customer_id: int) -> None:
+        try:
+            self._cli.delete(_payment_info_key(customer_id), _invoices_key(customer_id))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def find_customer_id(self, stripe_customer_id: str) -> Optional[int]:
+        """キャッシュした支払い情報から、Stripeの顧客IDに対応する顧客IDを引く"""
+        try:
+            customer_id = self._cli.get(_stripe_customer_key(stripe_customer_id))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return None
+        return int(customer_id) if customer_id is not None else None
+
+    def _fetch_payment_info(self, customer: Customer) -> dict:
+        payment_info = get_payment_info(customer.payment_type, customer.email)
+        if payment_info.get("status") == "error":
+            # 取得に失敗した結果はキャッシュしない
+            raise PaymentInfoUnavailable(payment_info)
+        stripe_customer_id = payment_info.get("stripe_customer_id")
+        if stripe_customer_id:
+            try:
+                self._cli.set(
+                    _stripe_customer_key(stripe_customer_id), customer.id, ex=STALE_TTL
+                )
+            except redis.RedisError as e:
+                mark_shared_redis_failed(e)
+        return payment_info
+
+    def _get(self, key: str, ttl: int, fetch: Callable):
+        try:
+            cached = self._cli.get(key)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            cached = None
+        if cached is not None:
+            entry = json.loads(cached)
+            if time.time() - entry["fetched_at"] >= ttl:
+                self._refresh_async(key, fetch)
+            return entry["value"]
+        try:
+            return self._store(key, fetch())
+        except PaymentInfoUnavailable as e:
+            return e.payment_info
+
+    def _store(self, key: str, value):
+        entry = json.dumps({"value": value, "fetched_at": time.time()})
+        try:
+            self._cli.set(key, entry, ex=STALE_TTL)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+        return value
+
+    def _refresh_async(self, key: str, fetch: Callable) -> None:
+        try:
+            if not self._cli.set(f"{key}:refreshing", 1, nx=True, ex=REFRESH_LOCK_TTL):
+                return
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+        _refresh_executor.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key: str, fetch: Callable) -> None:
+        try:
+            self._store(key, fetch())
+        except PaymentInfoUnavailable:
+            pass
+        except Exception as e:
+            # 取り直しに失敗しても古い値を返し続ける
+            print(f"<PaymentCache> refresh failed: {key}, {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+
+class PaymentInfoUnavailable(Exception):
+    def __init__(self, payment_info: dict):
+        super().__init__("payment info is unavailable")
+        self.payment_info = payment_info
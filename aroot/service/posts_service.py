@@ -1,9 +1,16 @@
 import datetime
-from typing import Any, Dict, List, Union
+import os
+from itertools import takewhile
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from common.base_service import Page
 from domain.instagram_media import InstagramMedia
 from domain.posts import Post
 
 
+# 分析APIを post_daily_stats（集計済みテーブル）から返す。save_posts での更新もこの設定で行う
+ANALYTICS_ROLLUP = os.getenv("ANALYTICS_ROLLUP", "false").lower() == "true"
+
+
 class PostsService:
     limit = 30
 
@@ -13,17 +20,39 @@ class PostsService:
     def save_post(self, post: Dict[str, Any]) -> Any:
         return self.posts_repository.add(post)
 
-    def save_posts(self, posts: List[Dict[str, Any]], customer_id: int) -> None:
-        linked_ids = []
+    def save_posts(
+        self, posts: List[Dict[str, Any]], customer_id: int
+    ) -> Dict[str, int]:
+        """
+        連携結果をまとめて保存する。同じ投稿を再度保存しても重複しない。
+        :return: {"inserted": 追加した件数, "updated": 更新した件数}
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        created_at = str(now)
         for post in posts:
             post["customer_id"] = customer_id
-            post["created_at"] = str(datetime.datetime.now(datetime.UTC))
-            self.save_post(post)
-            linked_ids.append(post["media_id"])
+            post["created_at"] = created_at
+        inserted, updated = self.posts_repository.upsert_many(customer_id, posts)
+        if ANALYTICS_ROLLUP and inserted:
+            self.posts_repository.add_daily_stats(customer_id, now.date(), inserted)
+        if updated:
+            print(
+                f"<SavePosts> customer_id: {customer_id}, "
+                f"inserted: {inserted}, updated: {updated}"
+            )
+        return {"inserted": inserted, "updated": updated}
 
     def find_by_customer_id(self, customer_id: int) -> list[Post]:
         return self.posts_repository.find_by_customer_id(customer_id)
 
+    def find_linked_media_ids(
+        self, customer_id: int, media_list: Iterable[InstagramMedia]
+    ) -> Set[str]:
+        """取得した投稿のうち、すでに連携済みのもののmedia_id"""
+        return self.posts_repository.find_linked_media_ids(
+            customer_id, [media.id for media in media_list]
+        )
+
     def find_by_customer_id_for_page(
         self, customer_id: int, page: int = 1
     ) -> list[Post]:
@@ -32,6 +61,33 @@ class PostsService:
             customer_id, limit=self.limit, offset=offset
         )
 
+    def find_page_by_customer_id(
+        self,
+        customer_id: int,
+        after_id: Optional[int] = None,
+        before_id: Optional[int] = None,
+    ) -> Page[Post]:
+        rows = self.posts_repository.find_page_by_customer_id(
+            customer_id, self.limit, after_id, before_id
+        )
+        return Page.build(rows, self.limit, after_id, before_id)
+
+    def daily_counts(self, customer_id: int) -> Dict[str, int]:
+        """連携済み投稿の日別件数 {"YYYY-MM-DD": 件数}"""
+        return self._synced_counts(customer_id, "%Y-%m-%d")
+
+    def monthly_counts(self, customer_id: int) -> Dict[str, int]:
+        """連携済み投稿の月別件数 {"YYYY-MM": 件数}"""
+        return self._synced_counts(customer_id, "%Y-%m")
+
+    def _synced_counts(self, customer_id: int, date_format: str) -> Dict[str, int]:
+        if ANALYTICS_ROLLUP:
+            return self.posts_repository.daily_stats_by(customer_id, date_format)
+        return self.posts_repository.count_synced_by(customer_id, date_format)
+
+    def count_by_customer_id(self, customer_id: int) -> int:
+        return self.posts_repository.count_by_customer_id(customer_id)
+
     def block_count(self) -> int:
         return self.posts_repository.count() // PostsService.limit + 1
 
@@ -42,33 +98,51 @@ class PostsService:
     @staticmethod
     def abstract_targets(
         media_list: list[InstagramMedia],
-        linked_posts: list[Post],
+        linked_media_ids: Set[str],
         start_date: datetime.datetime,
     ) -> list[InstagramMedia]:
         """
         instagramから取得した投稿のデータのうち、連携開始日以降にあるデータを抽出する。
         :param media_list: 取得したinstagramの投稿データのリスト
-        :param linked_posts: すでに連携した投稿
+        :param linked_media_ids: すでに連携した投稿のmedia_id（find_linked_media_ids）
         :param start_date: 認証が完了した日付。
         :return: 連携すべきinstagramの投稿データのリスト
         """
         targets: list[InstagramMedia] = []
-        linked_id_list = [post.media_id for post in linked_posts]
+        start_date = start_date.replace(tzinfo=datetime.timezone.utc)
         for media in media_list:
-            start_date = start_date.replace(tzinfo=datetime.timezone.utc)
             if media.timestamp < start_date:
                 continue
-            if media.id in linked_id_list:
+            if media.id in linked_media_ids:
                 continue
             if media.media_url is None:
                 continue
             targets.append(media)
         return targets
 
+    def collect_targets(
+        self,
+        customer_id: int,
+        media_iter: Iterable[InstagramMedia],
+        start_date: datetime.datetime,
+    ) -> list[InstagramMedia]:
+        """
+        新しい順の投稿（MetaService.iter_media）から連携対象を抽出する。
+        連携開始日より前の投稿に到達した時点で、それ以降のページは取得しない。
+        :return: 連携すべきinstagramの投稿データのリスト（古い順）
+        """
+        start_date = start_date.replace(tzinfo=datetime.timezone.utc)
+        media_list = list(
+            takewhile(lambda media: media.timestamp >= start_date, media_iter)
+        )
+        media_list.reverse()
+        linked_media_ids = self.find_linked_media_ids(customer_id, media_list)
+        return self.abstract_targets(media_list, linked_media_ids, start_date)
+
     @staticmethod
     def exclude_linked_media(linked_post: List[Post], media_ids: List[int]) -> List[int]:
         targets: list[int] = []
-        linked_post_id_list = [int(post.media_id) for post in linked_post]
+        linked_post_id_list = {int(post.media_id) for post in linked_post}
         for media_id in media_ids:
             if media_id in linked_post_id_list:
                 continue
@@ -1,90 +1,143 @@
 import redis
 import os
+import threading
 import time
+from typing import Any, Callable, TypeVar
 from flask import g, current_app
 
+from service.local_cache import LocalCache
+
+
+# 接続を使い回す前に PING で確認する間隔（秒）。これより短い間隔では確認しない
+HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+# ワーカープロセスあたりの最大接続数
+MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# Redis に接続できない間に使うプロセス内キャッシュの最大キー数
+LOCAL_CACHE_MAX_KEYS = int(os.getenv("LOCAL_CACHE_MAX_KEYS", "10000"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> redis.ConnectionPool:
+    """プロセス内で共有するコネクションプール（フォーク後は redis-py が作り直す）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool(
+                    host=os.getenv("REDIS_HOST", "localhost"),
+                    port=int(os.getenv("REDIS_PORT", "6379")),
+                    decode_responses=True,
+                    socket_connect_timeout=5,
+                    socket_timeout=5,
+                    health_check_interval=HEALTH_CHECK_INTERVAL,
+                    max_connections=MAX_CONNECTIONS,
+                )
+    return _pool
+
+
+def create_redis() -> redis.Redis:
+    """Flaskのコンテキスト外（バッチワーカー等）でも使えるRedisクライアント"""
+    return redis.Redis(connection_pool=get_pool())
+
+
+# get_shared_redis で接続に失敗した後、再接続を試すまでの秒数
+SHARED_RETRY_INTERVAL = 30.0
+
+_shared_redis = None
+_shared_retry_at = 0.0
+_checked_at = 0.0
+
+# 接続できない間のログイン失敗回数なども保持できるよう、プロセス内で共有する
+local_cache = LocalCache(max_keys=LOCAL_CACHE_MAX_KEYS)
+
+
+def get_shared_redis() -> redis.Redis:
+    """
+    リクエストに依存しない、プロセス内で共有するRedisクライアント（バッチワーカー・バックグラウンド処理用）。
+    接続に失敗した直後は、タイムアウトを待たずに ConnectionError を送出する。
+    """
+    global _shared_redis
+    if time.time() < _shared_retry_at:
+        raise redis.ConnectionError("redis is unavailable")
+    if _shared_redis is None:
+        _shared_redis = create_redis()
+    return _shared_redis
+
+
+def mark_shared_redis_failed(e: Exception) -> None:
+    global _shared_retry_at
+    # 待機中に送出した ConnectionError で再接続の時刻を延ばさない
+    if time.time() < _shared_retry_at:
+        return
+    print(f"<Redis> {e}")
+    _shared_retry_at = time.time() + SHARED_RETRY_INTERVAL
+
 
 def get_redis():
+    """
+    リクエスト内で使うRedisクライアント。接続はプールから借りる。
+    PING はプロセス全体で HEALTH_CHECK_INTERVAL ごとにしか行わず、
+    接続できない間はプロセス内の LocalCache を返す。
+    """
+    global _checked_at
     if "redis" not in g:
         try:
-            redis_host = os.getenv("REDIS_HOST", "localhost")
-            redis_port = int(os.getenv("REDIS_PORT", "6379"))
-            
-            g.redis = redis.Redis(
-                host=redis_host,
-                port=redis_port,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
-            
-            # Test connection
-            g.redis.ping()
-            
+            redis_cli = get_shared_redis()
+            if time.time() - _checked_at >= HEALTH_CHECK_INTERVAL:
+                redis_cli.ping()
+                _checked_at = time.time()
+            g.redis = redis_cli
         except (redis.ConnectionError, redis.TimeoutError, ValueError) as e:
-            current_app.logger.error(f"Redis connection failed: {e}")
-            # Return a mock Redis client for development
-            g.redis = MockRedis()
-            
+            if time.time() >= _shared_retry_at:
+                current_app.logger.error(f"Redis connection failed: {e}")
+            mark_shared_redis_failed(e)
+            g.redis = local_cache
+
     return g.redis
 
 
-class MockRedis:
-    """Mock Redis client for development when Redis is not available"""
-    
-    def __init__(self):
-        self._data = {}
-        self._expires = {}
-    
-    def _is_expired(self, key):
-        """Check if a key has expired"""
-        if key in self._expires:
-            if time.time() > self._expires[key]:
-                # Key has expired, remove it
-                self._data.pop(key, None)
-                self._expires.pop(key, None)
-                return True
-        return False
-    
-    def get(self, key):
-        if self._is_expired(key):
-            return None
-        return self._data.get(key)
-    
-    def set(self, key, value, ex=None):
-        self._data[key] = value
-        if ex is not None:
-            # Set expiration time
-            self._expires[key] = time.time() + ex
-        else:
-            # Remove expiration if no ex parameter
-            self._expires.pop(key, None)
-        return True
-    
-    def delete(self, key):
-        deleted = key in self._data
-        self._data.pop(key, None)
-        self._expires.pop(key, None)
-        return deleted
-    
-    def incr(self, key):
-        if self._is_expired(key):
-            current_value = 0
-        else:
-            current_value = int(self._data.get(key, 0))
-        new_value = current_value + 1
-        self._data[key] = str(new_value)
-        return new_value
-    
-    def expire(self, key, seconds):
-        if key in self._data and not self._is_expired(key):
-            self._expires[key] = time.time() + seconds
-            return True
-        return False
-    
-    def ping(self):
-        return True
-    
-    def close(self):
-        # Mock close method for Flask teardown compatibility
-        pass
+T = TypeVar("T")
+
+
+def redis_call(fn: Callable[[Any], T]) -> T:
+    """
+    get_redis() のクライアントで fn を実行する。
+    PING の確認の間に接続が切れていた場合は、その場で LocalCache に切り替えてやり直す。
+    """
+    redis_cli = get_redis()
+    try:
+        return fn(redis_cli)
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        if redis_cli is local_cache:
+            raise
+        current_app.logger.error(f"Redis command failed: {e}")
+        mark_shared_redis_failed(e)
+        g.redis = local_cache
+        return fn(local_cache)
+
+
+def is_degraded() -> bool:
+    """Redis に接続できず LocalCache で動いている間は True"""
+    return time.time() < _shared_retry_at
+
+
+def pipelined(redis_cli, build: Callable, transaction: bool = False) -> list:
+    """build(pipe) で積んだコマンドを1往復で実行し、結果を順に返す"""
+    pipe = redis_cli.pipeline(transaction=transaction)
+    build(pipe)
+    return pipe.execute()
+
+
+def incr_with_ttl(redis_cli, key: str, ttl: int) -> int:
+    """
+    カウンターを1増やす。キーが無ければ有効期限 ttl 秒で作る（期限は延長しない）。
+    MULTI/EXEC で1往復にまとめる。
+    """
+    _, count = pipelined(
+        redis_cli,
+        lambda pipe: pipe.set(key, 0, nx=True, ex=ttl).incr(key),
+        transaction=True,
+    )
+    return int(count)
@@ -0,0 +1,233 @@
+import atexit
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from service import http_client
+
+
+# 送信待ちの上限。一杯のときは破棄する（呼び出し側を待たせない）
+QUEUE_SIZE = int(os.getenv("SLACK_QUEUE_SIZE", "1000"))
+# 同じWebhookへの送信間隔（秒）。Incoming Webhook は1秒1件が目安
+MIN_INTERVAL = float(os.getenv("SLACK_MIN_INTERVAL", "1.0"))
+TIMEOUT = float(os.getenv("SLACK_TIMEOUT", "5"))
+# 同じエラー（スタックトレースが同じもの）を再通知しない秒数
+DEDUPE_WINDOW = int(os.getenv("SLACK_ALERT_DEDUPE_WINDOW", "600"))
+# 投稿の通知は、この秒数新しいものが来なければまとめて送る
+DIGEST_WINDOW = int(os.getenv("SLACK_DIGEST_WINDOW", "30"))
+# ただし最初の1件からこの秒数たったら送る
+DIGEST_MAX_AGE = int(os.getenv("SLACK_DIGEST_MAX_AGE", "300"))
+# 1メッセージの最大文字数（超える分は分けて送る）
+MAX_TEXT_LENGTH = 3500
+# 抑止したアラートのまとめに載せる見出し（顧客名など）の最大数
+MAX_SUPPRESSED_LABELS = 20
+
+_FRAME = re.compile(r'File "[^"]+", line \d+, in \S+')
+
+
+def alert_label(text: str) -> str:
+    """アラート本文の最初の行（バッチのアラートでは顧客名）"""
+    for line in text.split("\n"):
+        line = line.strip("` ")
+        if line:
+            return line[:100]
+    return ""
+
+
+def fingerprint(text: str) -> str:
+    """スタックトレースの呼び出し位置から作るキー。トレースが無ければ数字を除いた本文から作る"""
+    frames = _FRAME.findall(text)
+    source = "\n".join(frames) if frames else re.sub(r"\d+", "0", text)
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class SlackDispatcher:
+    """
+    Slackへの送信をバックグラウンドのスレッドで行う。
+    同じエラーは DEDUPE_WINDOW の間は1回だけ送り、投稿の通知はダイジェストにまとめる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: queue.Queue = None
+        self._alerts: dict[str, dict] = {}
+        self._digests: dict[tuple, dict] = {}
+        self._sent_at: dict[str, float] = {}
+        self.stats = {"sent": 0, "failed": 0, "dropped": 0, "deduplicated": 0}
+
+    def _ensure_worker(self) -> None:
+        # フォークした子プロセスでは作り直す
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+            self._digests = {}
+            threading.Thread(target=self._run, daemon=True, name="slack").start()
+            self._pid = os.getpid()
+
+    def _put(self, item) -> bool:
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            print("<Slack> queue is full, message dropped")
+            return False
+
+    def submit(self, url: Optional[str], payload: dict) -> bool:
+        return self._put(("message", url, payload))
+
+    def submit_alert(
+        self, url: Optional[str], payload: dict, key: str, label: str = ""
+    ) -> bool:
+        """
+        同じ key のアラートは DEDUPE_WINDOW の間は送らず、回数と label（顧客名など）だけ記録する。
+        抑止期間が終わったら、抑止したものの label をまとめて送る。
+        """
+        now = time.time()
+        with self._lock:
+            alert = self._alerts.get(key)
+            if alert is not None and now - alert["sent_at"] < DEDUPE_WINDOW:
+                alert["suppressed"] += 1
+                labels = alert["labels"]
+                if label and label not in labels and len(labels) < MAX_SUPPRESSED_LABELS:
+                    labels.append(label)
+                self.stats["deduplicated"] += 1
+                return False
+            self._alerts[key] = {
+                "sent_at": now,
+                "suppressed": 0,
+                "labels": [],
+                "url": url,
+                "payload": payload,
+            }
+        return self.submit(url, payload)
+
+    def add_digest(self, url: Optional[str], key: str, entry: str, payload: dict) -> bool:
+        """entry を key ごとにまとめ、payload の text として送る"""
+        return self._put(("digest", url, (key, entry, payload)))
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """送信待ちとダイジェストを送り切るまで待つ（終了時用）"""
+        if self._pid != os.getpid():
+            return
+        done = threading.Event()
+        if self._put(("flush", None, done)):
+            done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                kind, url, data = self._queue.get(timeout=1)
+            except queue.Empty:
+                kind = None
+            try:
+                if kind == "message":
+                    self._send(url, data)
+                elif kind == "digest":
+                    self._collect(url, *data)
+                elif kind == "flush":
+                    self._flush_digests(force=True)
+                    data.set()
+                self._flush_digests()
+                self._flush_alerts()
+            except Exception as e:
+                print(f"<Slack> dispatcher error: {e}")
+
+    def _collect(self, url, key: str, entry: str, payload: dict) -> None:
+        now = time.time()
+        digest = self._digests.setdefault(
+            (url, key), {"entries": [], "started_at": now, "payload": payload}
+        )
+        digest["entries"].append(entry)
+        digest["updated_at"] = now
+
+    def _flush_digests(self, force: bool = False) -> None:
+        now = time.time()
+        for digest_key, digest in list(self._digests.items()):
+            if not (
+                force
+                or now - digest["updated_at"] >= DIGEST_WINDOW
+                or now - digest["started_at"] >= DIGEST_MAX_AGE
+            ):
+                continue
+            del self._digests[digest_key]
+            url = digest_key[0]
+            for text in _chunk(digest["entries"]):
+                self._send(url, {**digest["payload"], "text": text})
+
+    def _flush_alerts(self) -> None:
+        """抑止期間が終わったアラートのうち、抑止したものがあれば回数を送る"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                (key, alert)
+                for key, alert in self._alerts.items()
+                if now - alert["sent_at"] >= DEDUPE_WINDOW
+            ]
+            for key, _ in expired:
+                del self._alerts[key]
+        for _, alert in expired:
+            if alert["suppressed"]:
+                summary = alert["payload"]["text"].split("\n")[:3]
+                summary.append(
+                    f"…（同じエラーが{DEDUPE_WINDOW}秒間にさらに {alert['suppressed']} 回発生）"
+                )
+                summary.extend(f"● {label}" for label in alert["labels"])
+                if len(alert["labels"]) >= MAX_SUPPRESSED_LABELS:
+                    summary.append("● …")
+                self._send(
+                    alert["url"], {**alert["payload"], "text": "\n".join(summary)}
+                )
+
+    def _send(self, url: Optional[str], payload: dict) -> None:
+        if not url:
+            print(f"<Slack> webhook url is not set: {payload.get('text', '')[:100]}")
+            return
+        wait = MIN_INTERVAL - (time.time() - self._sent_at.get(url, 0))
+        if wait > 0:
+            time.sleep(wait)
+        for _ in range(2):
+            try:
+                response = http_client.post(url, json=payload, timeout=TIMEOUT)
+            except requests.RequestException as e:
+                self.stats["failed"] += 1
+                print(f"<Slack> {e}")
+                return
+            finally:
+                self._sent_at[url] = time.time()
+            if response.status_code != 429:
+                break
+            # レート制限に掛かったら Retry-After だけ待って1回だけ再送する
+            time.sleep(min(float(response.headers.get("Retry-After", 1)), 30))
+        if response.status_code == 200:
+            self.stats["sent"] += 1
+        else:
+            self.stats["failed"] += 1
+            print(response.text)
+
+
+def _chunk(entries: list[str]) -> list[str]:
+    chunks, current = [], ""
+    for entry in entries:
+        if current and len(current) + len(entry) + 1 > MAX_TEXT_LENGTH:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{entry}" if current else entry
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+dispatcher = SlackDispatcher()
+atexit.register(dispatcher.flush)
@@ -1,30 +1,29 @@
 import os
-import json
-import requests
 
+from service.slack_dispatcher import alert_label, dispatcher, fingerprint
 from domain.customers import Customer
 
 
 class SlackService(object):
+    """送信は SlackDispatcher がバックグラウンドで行うので、呼び出し側は待たない"""
+
     def __init__(self):
         self.webhook_url = os.getenv("SLACK_WEBHOOK_URL")
 
     def request(self, payload):
-        response = requests.post(
-            self.webhook_url,
-            data=json.dumps(payload),
-            headers={"Content-Type": "application/json"},
-        )
-        if response.status_code != 200:
-            print(response.text)
+        dispatcher.submit(self.webhook_url, payload)
 
     def send_alert(self, message):
-        self.request(
+        # 同じスタックトレースのアラートは一定時間まとめる
+        dispatcher.submit_alert(
+            self.webhook_url,
             {
                 "icon_emoji": ":cold_sweat:",
                 "username": "A-Root",
                 "text": f"<@U04P797HYPM>\n{message}",
-            }
+            },
+            fingerprint(message),
+            alert_label(message),
         )
 
     def send_message(self, message):
@@ -32,30 +31,37 @@ class SlackService(object):
             {"icon_emoji": ":wink:", "username": "A-Root", "text": f"{message}"}
         )
 
+    def send_posted(self, customer_name: str, results: list[dict]):
+        """連携した投稿の通知。顧客ごとに1件にし、バッチの間はダイジェストにまとめて送る"""
+        if not results:
+            return
+        lines = [f"● {customer_name}"]
+        for result in results:
+            lines.append(f"{result['permalink']}\n{result['wordpress_link']}")
+        dispatcher.add_digest(
+            self.webhook_url,
+            "posted",
+            "```" + "\n".join(lines) + "```",
+            {"icon_emoji": ":wink:", "username": "A-Root"},
+        )
+
 
 def send_support_team(customer: Customer):
     msg = "トークンの期限が切れましたので、ご連絡、再認証お願いします。"
     msg += f"\n- {customer.name}"
     if customer.type == 1:
-        response = requests.post(
+        dispatcher.submit(
             os.getenv("SLACK_WEBHOOK_URL_PARTNER"),
-            data=json.dumps(
-                {
-                    "username": "池澤勇輝",
-                    "text": f"<@U04NMGHEHEC>\n{msg}",
-                }
-            ),
-            headers={"Content-Type": "application/json"},
+            {
+                "username": "池澤勇輝",
+                "text": f"<@U04NMGHEHEC>\n{msg}",
+            },
         )
     else:
-        response = requests.post(
+        dispatcher.submit(
             os.getenv("SLACK_WEBHOOK_URL_AROOT"),
-            data=json.dumps(
-                {
-                    "username": "池澤勇輝",
-                    "text": f"<@U08JVHM4KV3>\n{msg}",
-                }
-            ),
-            headers={"Content-Type": "application/json"},
+            {
+                "username": "池澤勇輝",
+                "text": f"<@U08JVHM4KV3>\n{msg}",
+            },
         )
-    response.raise_for_status()
@@ -0,0 +1,88 @@
+import json
+import os
+from datetime import datetime
+from typing import Iterable
+
+import redis
+
+from domain.instagram_media import InstagramMedia
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+
+# 記録されないまま残った投稿を覚えておく期間
+JOURNAL_TTL = int(os.getenv("SYNC_JOURNAL_TTL", str(7 * 24 * 3600)))
+
+
+def _journal_key(customer_id: int) -> str:
+    return f"sync:journal:{customer_id}"
+
+
+class SyncJournal:
+    """
+    顧客ごとの連携の途中経過。WordPressに投稿できたメディアを1件ずつ記録し、
+    postsテーブルへ保存（コミット）できたら消す。
+    途中で失敗した場合、次回は投稿済みのものを投稿し直さずに保存だけ行う。
+    （アップロード済みのファイルは UploadCache で再利用する）
+    """
+
+    def __init__(self, customer_id: int, redis_cli=None):
+        self.customer_id = customer_id
+        self.redis_cli = redis_cli
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    def created(self) -> dict[str, dict]:
+        """投稿済みで未保存のもの {media_id: 連携結果}"""
+        try:
+            entries = self._cli.hgetall(_journal_key(self.customer_id))
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return {}
+        created = {}
+        for media_id, entry in entries.items():
+            result = json.loads(entry)
+            result["timestamp"] = datetime.fromisoformat(result["timestamp"])
+            created[media_id] = result
+        return created
+
+    def record_created(self, result: dict) -> None:
+        entry = json.dumps({**result, "timestamp": result["timestamp"].isoformat()})
+        try:
+            pipe = self._cli.pipeline()
+            pipe.hset(_journal_key(self.customer_id), result["media_id"], entry)
+            pipe.expire(_journal_key(self.customer_id), JOURNAL_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def clear(self, media_ids: Iterable[str]) -> None:
+        """postsテーブルへ保存できたものを消す"""
+        media_ids = list(media_ids)
+        if not media_ids:
+            return
+        try:
+            self._cli.hdel(_journal_key(self.customer_id), *media_ids)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def split(
+        self, targets: list[InstagramMedia]
+    ) -> tuple[list[InstagramMedia], list[dict]]:
+        """(これから投稿するもの, 前回までに投稿済みの連携結果)"""
+        created = self.created()
+        if not created:
+            return targets, []
+        pending = [media for media in targets if media.id not in created]
+        resumed = [created[media.id] for media in targets if media.id in created]
+        if resumed:
+            print(
+                f"<SyncJournal> customer_id: {self.customer_id}, resumed: {len(resumed)}"
+            )
+        return pending, resumed
+
+    def sync(self, wordpress_service, targets: list[InstagramMedia]) -> list[dict]:
+        """targets をWordPressへ投稿する。投稿済みのものは投稿し直さずに結果だけ返す"""
+        pending, resumed = self.split(targets)
+        return resumed + wordpress_service.posts(pending, self.record_created)
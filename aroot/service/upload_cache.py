@@ -0,0 +1,109 @@
+import json
+import os
+import time
+from typing import Optional
+
+import redis
+
+from domain.wordpress_source import WordPressSource
+from service.redis_client import get_shared_redis, mark_shared_redis_failed
+
+
+# アップロード済みメディアを覚えておく期間（WordPress側で削除された場合もこの期間で忘れる）
+TTL = int(os.getenv("UPLOAD_CACHE_TTL", str(30 * 24 * 3600)))
+# 保持する最大件数。超えたら最後に使われたのが古いものから捨てる
+MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", "200000"))
+LRU_KEY = "upload:lru"
+
+
+def _source_key(host: str, source_id: str) -> str:
+    return f"upload:{host}:id:{source_id}"
+
+
+def _hash_key(host: str, sha256: str) -> str:
+    return f"upload:{host}:sha256:{sha256}"
+
+
+class UploadCache:
+    """
+    Instagramのメディア（子要素を含む）をWordPressへアップロードした結果を、
+    ホストごとにメディアID・内容のハッシュで引けるようにRedisへ保存する。
+    同じメディアを再度連携する場合に、CDNからのダウンロードとアップロードを省く。
+    """
+
+    def __init__(self, redis_cli=None):
+        self.redis_cli = redis_cli
+
+    @property
+    def _cli(self):
+        return self.redis_cli or get_shared_redis()
+
+    def get(self, host: str, source_id: Optional[str]) -> Optional[WordPressSource]:
+        if not source_id:
+            return None
+        return self._get(_source_key(host, source_id))
+
+    def find_by_hash(self, host: str, sha256: Optional[str]) -> Optional[WordPressSource]:
+        """同じ内容のファイルがアップロード済みならそれを返す"""
+        if not sha256:
+            return None
+        return self._get(_hash_key(host, sha256))
+
+    def put(
+        self,
+        host: str,
+        source_id: Optional[str],
+        source: WordPressSource,
+        sha256: Optional[str] = None,
+    ) -> None:
+        keys = []
+        if source_id:
+            keys.append(_source_key(host, source_id))
+        if sha256:
+            keys.append(_hash_key(host, sha256))
+        if not keys:
+            return
+        entry = json.dumps(
+            {
+                "media_id": source.media_id,
+                "media_type": source.media_type,
+                "source_url": source.source_url,
+            }
+        )
+        now = time.time()
+        try:
+            pipe = self._cli.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(key, entry, ex=TTL)
+                pipe.zadd(LRU_KEY, {key: now})
+            # 有効期限切れで消えたキーを索引からも外す
+            pipe.zremrangebyscore(LRU_KEY, 0, now - TTL)
+            pipe.zcard(LRU_KEY)
+            size = pipe.execute()[-1]
+            if size > MAX_ENTRIES:
+                self._evict(size - MAX_ENTRIES)
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+
+    def _get(self, key: str) -> Optional[WordPressSource]:
+        try:
+            pipe = self._cli.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+            entry = pipe.execute()[0]
+        except redis.RedisError as e:
+            mark_shared_redis_failed(e)
+            return None
+        if entry is None:
+            return None
+        data = json.loads(entry)
+        return WordPressSource(data["media_id"], data["media_type"], data["source_url"])
+
+    def _evict(self, count: int) -> None:
+        evicted = [key for key, _ in self._cli.zpopmin(LRU_KEY, count)]
+        if evicted:
+            self._cli.delete(*evicted)
+            print(f"<UploadCache> evicted {len(evicted)} entries")
+
+
+upload_cache = UploadCache()
@@ -3,13 +3,12 @@ import hmac
 import json
 import os
 import re
-import tempfile
 import time
-import mimetypes
-import requests
 from urllib.parse import urlparse
-from urllib.request import urlretrieve
 
+from service import http_client, media_pipeline, media_transfer
+from service.image_optimizer import image_optimizer
+from service.upload_cache import upload_cache
 from service.slack_service import SlackService
 from domain.instagram_media import InstagramMedia
 from domain.wordpress_source import WordPressSource
@@ -151,102 +150,109 @@ class WordpressService:
         return capt.split("\n")[0]
 
     # ---- メインフロー ----
-    def posts(self, posts: list[InstagramMedia]):
-        results = []
-        for post in posts:
-            if post.media_type == "IMAGE":
-                results.append(self.post_for_image(post))
-            elif post.media_type == "VIDEO":
-                results.append(self.post_for_video(post))
-            elif post.media_type == "CAROUSEL_ALBUM":
-                results.append(self.post_for_carousel(post))
-
-        if results:
-            for result in results:
-                SlackService().send_message(
-                    f"""```● {self.name}
-{result["permalink"]}
-{result["wordpress_link"]}```"""
-                )
+    def posts(self, posts: list[InstagramMedia], on_created=None):
+        """:param on_created: 投稿できたメディアごとに連携結果を渡して呼ぶ（SyncJournal の記録用）"""
+
+        def post(media: InstagramMedia):
+            result = self.post(media)
+            if result is not None and on_created is not None:
+                on_created(result)
+            return result
+
+        # 投稿ごとに並列実行（ホストへの同時リクエスト数は media_pipeline 側で制限）
+        results = [
+            result
+            for result in media_pipeline.map_ordered(post, posts)
+            if result is not None
+        ]
+
+        SlackService().send_posted(self.name, results)
         return results
 
+    def post(self, post: InstagramMedia):
+        if post.media_type == "IMAGE":
+            return self.post_for_image(post)
+        elif post.media_type == "VIDEO":
+            return self.post_for_video(post)
+        elif post.media_type == "CAROUSEL_ALBUM":
+            return self.post_for_carousel(post)
+        return None
+
+    @property
+    def host(self) -> str:
+        return _normalize_domain(self.wordpress_url)
+
     # ---- アップロード（HMAC/multipart） ----
-    def upload_image(self, image_path) -> WordPressSource:
-        email = self.admin_email
-        filename = os.path.basename(image_path)
-
-        # MIME 推定（サーバ側制約: jpeg/png/mp4）
-        mime, _ = mimetypes.guess_type(filename)
-        if mime not in ("image/jpeg", "image/png"):
-            # 明示的に jpeg にしたい場合は上書き: mime = "image/jpeg"
-            raise ValueError(f"Unsupported mime type for image: {mime}")
-
-        headers = sign_upload_headers(email, filename, self.api_key)
-        data = {"email": email}
-        with open(image_path, "rb") as img:
-            files = {"file": (filename, img, mime)}
-            resp = requests.post(
-                f"https://{_normalize_domain(self.wordpress_url)}/?rest_route=/rodut/v1/upload-media",
-                data=data,
-                files=files,
-                headers=headers,
-                timeout=60,
-            )
+    def transfer_media(
+        self,
+        media_url,
+        filename: str,
+        mime: str,
+        media_type: str,
+        timeout: int,
+        source_id: str | None = None,
+    ) -> WordPressSource:
+        """CDNから一時ファイルを介さずに upload-media へストリーミング転送する"""
+        # 同じメディアをこのホストへアップロード済みなら、ダウンロードもアップロードもしない
+        cached = upload_cache.get(self.host, source_id)
+        if cached is not None:
+            print(f"<Transfer> {self.name}: cached {source_id}")
+            return cached
+        with media_pipeline.host_slot(self.host):
+            if media_type == "IMAGE" and image_optimizer.enabled:
+                # 縮小・再圧縮してから送る（ファイル名が変わるので署名はその後に作る）
+                resp, stats = media_transfer.transform_upload(
+                    media_url,
+                    self.upload_request,
+                    filename,
+                    mime,
+                    image_optimizer.transform,
+                    timeout=timeout,
+                )
+            else:
+                url, fields, headers = self.upload_request(filename)
+                resp, stats = media_transfer.stream_upload(
+                    media_url, url, fields, filename, mime, headers=headers, timeout=timeout
+                )
+        print(f"<Transfer> {self.name}: {stats}")
         if 200 <= resp.status_code < 300:
             j = resp.json()
-            return WordPressSource(j["id"], "IMAGE", j["source_url"])
+            source = WordPressSource(j["id"], media_type, j["source_url"])
+            upload_cache.put(self.host, source_id, source, stats.sha256)
+            if stats.mode == "transform":
+                image_optimizer.record(self.host, stats.bytes, stats.uploaded_bytes)
+            return source
         raise WordpressApiError(resp.text)
 
-    def upload_video(self, video_path) -> WordPressSource:
-        email = self.admin_email
-        filename = os.path.basename(video_path)
-
-        mime, _ = mimetypes.guess_type(filename)
-        if mime != "video/mp4":
-            mime = "video/mp4"  # Instagram動画はたいていmp4に寄せる
-
-        headers = sign_upload_headers(email, filename, self.api_key)
-        data = {"email": email}
-        with open(video_path, "rb") as f:
-            files = {"file": (filename, f, mime)}
-            resp = requests.post(
-                f"https://{_normalize_domain(self.wordpress_url)}/?rest_route=/rodut/v1/upload-media",
-                data=data,
-                files=files,
-                headers=headers,
-                timeout=120,
-            )
-        if 200 <= resp.status_code < 300:
-            j = resp.json()
-            return WordPressSource(j["id"], "VIDEO", j["source_url"])
-        raise WordpressApiError(resp.text)
+    def upload_request(self, filename: str) -> tuple[str, dict, dict]:
+        """upload-media 呼び出しの (url, フォーム項目, ヘッダ)"""
+        return (
+            f"https://{self.host}/?rest_route=/rodut/v1/upload-media",
+            {"email": self.admin_email},
+            sign_upload_headers(self.admin_email, filename, self.api_key),
+        )
 
-    def transfer_image(self, media_url) -> WordPressSource:
-        with tempfile.NamedTemporaryFile(suffix=".jpeg", delete=False) as temp_file:
-            try:
-                urlretrieve(media_url, temp_file.name)
-            finally:
-                temp_file.close()
-            try:
-                resp_upload = self.upload_image(temp_file.name)
-            finally:
-                os.remove(temp_file.name)
-        return resp_upload
-
-    def transfer_video(self, media_url) -> WordPressSource:
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp_file:
-            try:
-                urlretrieve(media_url, temp_file.name)
-            finally:
-                temp_file.close()
-            try:
-                resp_upload = self.upload_video(temp_file.name)
-            finally:
-                os.remove(temp_file.name)
-        return resp_upload
+    def transfer_image(
+        self, media_url, source_id: str | None = None
+    ) -> WordPressSource:
+        filename = media_transfer.generate_filename(".jpeg")
+        return self.transfer_media(
+            media_url, filename, "image/jpeg", "IMAGE", 60, source_id
+        )
+
+    def transfer_video(
+        self, media_url, source_id: str | None = None
+    ) -> WordPressSource:
+        filename = media_transfer.generate_filename(".mp4")
+        return self.transfer_media(
+            media_url, filename, "video/mp4", "VIDEO", 120, source_id
+        )
 
     # ---- 投稿作成（HMAC/JSON） ----
-    def create_post(self, title: str, content: str, media_id: int):
+    def create_post_request(
+        self, title: str, content: str, media_id: int
+    ) -> tuple[str, dict, bytes]:
+        """create-post 呼び出しの (url, ヘッダ, ボディ)"""
         payload = {
             "email": self.admin_email,
             "title": self.get_title(title),
@@ -254,12 +260,16 @@ class WordpressService:
             "featured_media": media_id,
         }
         headers, body_bytes = sign_json_headers(payload, self.api_key)
-        resp = requests.post(
-            f"https://{_normalize_domain(self.wordpress_url)}/?rest_route=/rodut/v1/create-post",
-            headers=headers,
-            data=body_bytes,
-            timeout=30,
+        return (
+            f"https://{self.host}/?rest_route=/rodut/v1/create-post",
+            headers,
+            body_bytes,
         )
+
+    def create_post(self, title: str, content: str, media_id: int):
+        url, headers, body_bytes = self.create_post_request(title, content, media_id)
+        with media_pipeline.host_slot(self.host):
+            resp = http_client.post(url, headers=headers, data=body_bytes, timeout=30)
         if 200 <= resp.status_code < 300:
             return resp.json()
         try:
@@ -269,7 +279,7 @@ class WordpressService:
 
     # ---- 各メディア種別の投稿 ----
     def post_for_image(self, media: InstagramMedia):
-        resp_upload = self.transfer_image(media.media_url)
+        resp_upload = self.transfer_image(media.media_url, media.id)
         html = self.get_html_for_image(media.caption, resp_upload.source_url)
         resp_post = self.create_post(media.caption, html, int(resp_upload.media_id))
         return {
@@ -280,13 +290,22 @@ class WordpressService:
             "wordpress_link": resp_post["post_url"],
         }
 
+    def transfer_child(self, child) -> WordPressSource | None:
+        if child.media_type == "IMAGE":
+            return self.transfer_image(child.media_url, child.id)
+        elif child.media_type == "VIDEO":
+            return self.transfer_video(child.media_url, child.id)
+        return None
+
     def post_for_carousel(self, media: InstagramMedia):
-        resp_uploads: list[WordPressSource] = []
-        for child in media.children:
-            if child.media_type == "IMAGE":
-                resp_uploads.append(self.transfer_image(child.media_url))
-            elif child.media_type == "VIDEO":
-                resp_uploads.append(self.transfer_video(child.media_url))
+        # 子要素は並列に転送し、HTML上の並び順は元の順序を維持する
+        resp_uploads: list[WordPressSource] = [
+            resp_upload
+            for resp_upload in media_pipeline.map_ordered(
+                self.transfer_child, media.children
+            )
+            if resp_upload is not None
+        ]
         html = self.get_html_for_carousel(media.caption, resp_uploads)
         resp_post = self.create_post(media.caption, html, int(resp_uploads[0].media_id))
         return {
@@ -298,7 +317,7 @@ class WordpressService:
         }
 
     def post_for_video(self, media: InstagramMedia):
-        resp_upload = self.transfer_video(media.media_url)
+        resp_upload = self.transfer_video(media.media_url, media.id)
         html = self.get_html_for_video(media.caption, resp_upload.source_url)
         resp_post = self.create_post(media.caption, html, int(resp_upload.media_id))
         return {
@@ -1,11 +1,11 @@
-import os
+import json
 import re
-import tempfile
 
 import requests
 
-from urllib.request import urlretrieve
-
+from service import http_client, media_pipeline, media_transfer
+from service.image_optimizer import image_optimizer
+from service.upload_cache import upload_cache
 from service.slack_service import SlackService
 from domain.instagram_media import InstagramMedia
 from domain.wordpress_source import WordPressSource
@@ -65,133 +65,141 @@ class WordpressServiceStripe:
         capt = str(caption)
         return capt.split("\n")[0]
 
-    def posts(self, posts: list[InstagramMedia]):
-        results = []
-        for post in posts:
-            if post.media_type == "IMAGE":
-                result = self.post_for_image(post)
-                results.append(result)
-            elif post.media_type == "VIDEO":
-                result = self.post_for_video(post)
-                results.append(result)
-            elif post.media_type == "CAROUSEL_ALBUM":
-                result = self.post_for_carousel(post)
-                results.append(result)
-        if len(results) > 0:
-            for result in results:
-                SlackService().send_message(
-                    f"""```● {self.name}
-{result["permalink"]}
-{result["wordpress_link"]}```"""
-                )
+    def posts(self, posts: list[InstagramMedia], on_created=None):
+        """:param on_created: 投稿できたメディアごとに連携結果を渡して呼ぶ（SyncJournal の記録用）"""
+
+        def post(media: InstagramMedia):
+            result = self.post(media)
+            if result is not None and on_created is not None:
+                on_created(result)
+            return result
+
+        # 投稿ごとに並列実行（ホストへの同時リクエスト数は media_pipeline 側で制限）
+        results = [
+            result
+            for result in media_pipeline.map_ordered(post, posts)
+            if result is not None
+        ]
+        SlackService().send_posted(self.name, results)
         return results
 
+    def post(self, post: InstagramMedia):
+        if post.media_type == "IMAGE":
+            return self.post_for_image(post)
+        elif post.media_type == "VIDEO":
+            return self.post_for_video(post)
+        elif post.media_type == "CAROUSEL_ALBUM":
+            return self.post_for_carousel(post)
+        return None
+
+    @property
+    def host(self) -> str:
+        return self.wordpress_url
+
     def get_wordpress_posts(self):
         params = {"per_page": 1, "page": 1}
         try:
-            response = requests.get(
+            response = http_client.get(
                 f"https://{self.wordpress_url}/wp-json/wp/v2/posts", params=params
             )
             response.raise_for_status()  # HTTPエラーチェック
         except requests.exceptions.RequestException as e:
             raise WordpressStripeAuthError("Wordpressの疎通に失敗")
 
-    def upload_image(self, image_path) -> WordPressSource:
-        data = {"api_key": self.secret_phrase, "email": "stripe@a-root.com"}
-        print(f"https://{self.wordpress_url}?rest_route=/rodut/v1/upload-media")
-        with open(image_path, "rb") as img:
-            files = {"file": (image_path, img, "image/jpeg")}
-            response = requests.post(
-                f"https://{self.wordpress_url}?rest_route=/rodut/v1/upload-media",
-                data=data,
-                files=files,
-            )
-            print(response)
-            if 200 <= response.status_code < 300:
-                return WordPressSource(
-                    response.json()["id"], "IMAGE", response.json()["source_url"]
+    def transfer_media(
+        self,
+        media_url,
+        filename: str,
+        mime: str,
+        media_type: str,
+        timeout: int,
+        source_id: str | None = None,
+    ) -> WordPressSource:
+        # CDNのレスポンスを一時ファイルに書かずにそのままアップロードする
+        # 同じメディアをこのホストへアップロード済みなら、ダウンロードもアップロードもしない
+        cached = upload_cache.get(self.host, source_id)
+        if cached is not None:
+            print(f"<Transfer> {self.name}: cached {source_id}")
+            return cached
+        with media_pipeline.host_slot(self.host):
+            if media_type == "IMAGE" and image_optimizer.enabled:
+                # 縮小・再圧縮してから送る（ファイル名が変わるので署名はその後に作る）
+                response, stats = media_transfer.transform_upload(
+                    media_url,
+                    self.upload_request,
+                    filename,
+                    mime,
+                    image_optimizer.transform,
+                    timeout=timeout,
                 )
-            raise WordpressStripeApiError(response.text)
-
-    def upload_video(self, video_path):
-        data = {
-            "api_key": self.secret_phrase,
-            "email": "stripe@a-root.com",
-        }
-        with open(video_path, "rb") as img:
-            files = {"file": (video_path, img, "video/mp4")}
-            response = requests.post(
-                f"https://{self.wordpress_url}?rest_route=/rodut/v1/upload-media",
-                data=data,
-                files=files,
-            )
-            print(response)
-            if 200 <= response.status_code < 300:
-                return WordPressSource(
-                    response.json()["id"], "VIDEO", response.json()["source_url"]
+            else:
+                url, fields, headers = self.upload_request(filename)
+                response, stats = media_transfer.stream_upload(
+                    media_url, url, fields, filename, mime, headers=headers, timeout=timeout
                 )
-            raise WordpressStripeApiError(response.text)
-
-    def transfer_image(self, media_url) -> WordPressSource:
-        with tempfile.NamedTemporaryFile(suffix=".jpeg", delete=False) as temp_file:
-            try:
-                # URLからファイルをダウンロード
-                urlretrieve(media_url, temp_file.name)
-                print(f"Downloaded image to: {temp_file.name}")
-            finally:
-                # temp_fileが閉じられているか確認して、明示的に削除する
-                temp_file.close()
-
-            # 画像をアップロード
-            try:
-                resp_upload = self.upload_image(temp_file.name)
-            finally:
-                # アップロード後にファイルを削除
-                os.remove(temp_file.name)
-        return resp_upload
-
-    def transfer_video(self, media_url) -> WordPressSource:
-        # NamedTemporaryFile を使って自動的に一時ファイルを作成
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp_file:
-            try:
-                # URLからファイルをダウンロード
-                urlretrieve(media_url, temp_file.name)
-                print(f"Downloaded image to: {temp_file.name}")
-            finally:
-                # temp_fileが閉じられているか確認して、明示的に削除する
-                temp_file.close()
-
-            # 画像をアップロード
-            try:
-                resp_upload = self.upload_video(temp_file.name)
-            finally:
-                # アップロード後にファイルを削除
-                os.remove(temp_file.name)
-        return resp_upload
+        print(f"<Transfer> {self.name}: {stats}")
+        if 200 <= response.status_code < 300:
+            source = WordPressSource(
+                response.json()["id"], media_type, response.json()["source_url"]
+            )
+            upload_cache.put(self.host, source_id, source, stats.sha256)
+            if stats.mode == "transform":
+                image_optimizer.record(self.host, stats.bytes, stats.uploaded_bytes)
+            return source
+        raise WordpressStripeApiError(response.text)
 
-    def create_post(self, title: str, content: str, media_id: int):
-        title = self.get_title(title)
-        print("create_post is invoked")
+    def upload_request(self, filename: str) -> tuple[str, dict, dict]:
+        return (
+            f"https://{self.wordpress_url}?rest_route=/rodut/v1/upload-media",
+            {"api_key": self.secret_phrase, "email": "stripe@a-root.com"},
+            {},
+        )
+
+    def transfer_image(
+        self, media_url, source_id: str | None = None
+    ) -> WordPressSource:
+        filename = media_transfer.generate_filename(".jpeg")
+        return self.transfer_media(
+            media_url, filename, "image/jpeg", "IMAGE", 60, source_id
+        )
+
+    def transfer_video(
+        self, media_url, source_id: str | None = None
+    ) -> WordPressSource:
+        filename = media_transfer.generate_filename(".mp4")
+        return self.transfer_media(
+            media_url, filename, "video/mp4", "VIDEO", 120, source_id
+        )
+
+    def create_post_request(
+        self, title: str, content: str, media_id: int
+    ) -> tuple[str, dict, bytes]:
         headers = {"Content-Type": "application/json"}
         data = {
             "api_key": self.secret_phrase,
             "email": "stripe@a-root.com",
-            "title": title,
+            "title": self.get_title(title),
             "content": content,
             "featured_media": media_id,
         }
-        response = requests.post(
+        return (
             f"https://{self.wordpress_url}/?rest_route=/rodut/v1/create-post",
-            headers=headers,
-            json=data,
+            headers,
+            json.dumps(data).encode("utf-8"),
         )
+
+    def create_post(self, title: str, content: str, media_id: int):
+        print("create_post is invoked")
+        url, headers, body = self.create_post_request(title, content, media_id)
+        with media_pipeline.host_slot(self.host):
+            response = http_client.post(url, headers=headers, data=body)
         print(f"response: {response.json()}, status: {response.status_code}")
         if 200 <= response.status_code < 300:
             return response.json()
         raise WordpressStripeApiError(response.json())
 
     def post_for_image(self, media: InstagramMedia):
-        resp_upload = self.transfer_image(media.media_url)
+        resp_upload = self.transfer_image(media.media_url, media.id)
         html = self.get_html_for_image(media.caption, resp_upload.source_url)
         resp_post = self.create_post(
             media.caption,
@@ -206,13 +214,22 @@ class WordpressServiceStripe:
             "wordpress_link": resp_post["post_url"],
         }
 
+    def transfer_child(self, child):
+        if child.media_type == "IMAGE":
+            return self.transfer_image(child.media_url, child.id)
+        elif child.media_type == "VIDEO":
+            return self.transfer_video(child.media_url, child.id)
+        return None
+
     def post_for_carousel(self, media: InstagramMedia):
-        resp_uploads = []
-        for post in media.children:
-            if post.media_type == "IMAGE":
-                resp_uploads.append(self.transfer_image(post.media_url))
-            elif post.media_type == "VIDEO":
-                resp_uploads.append(self.transfer_video(post.media_url))
+        # 子要素は並列に転送し、HTML上の並び順は元の順序を維持する
+        resp_uploads = [
+            resp_upload
+            for resp_upload in media_pipeline.map_ordered(
+                self.transfer_child, media.children
+            )
+            if resp_upload is not None
+        ]
         html = self.get_html_for_carousel(media.caption, resp_uploads)
         resp_post = self.create_post(media.caption, html, int(resp_uploads[0].media_id))
         return {
@@ -224,7 +241,7 @@ class WordpressServiceStripe:
         }
 
     def post_for_video(self, media: InstagramMedia):
-        resp_upload = self.transfer_video(media.media_url)
+        resp_upload = self.transfer_video(media.media_url, media.id)
         html = self.get_html_for_video(media.caption, resp_upload.source_url)
         resp_post = self.create_post(
             media.caption,
@@ -1,9 +1,40 @@
 import os
+import threading
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 
+# プロセス内で共有するエンジン（DSNごと）
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_engine(connection_string):
+    engine = _engines.get(connection_string)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(connection_string)
+            if engine is None:
+                engine = create_engine(
+                    connection_string,
+                    pool_size=int(os.getenv("DATABASE_POOL_SIZE", "5")),
+                    max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", "10")),
+                    pool_recycle=int(os.getenv("DATABASE_POOL_RECYCLE", "3600")),
+                    pool_pre_ping=True,
+                )
+                _engines[connection_string] = engine
+    return engine
+
+
+def _dispose_after_fork():
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
 class UnitOfWork:
     def __init__(self):
         connection_string = (
@@ -11,9 +42,7 @@ class UnitOfWork:
             f"{os.getenv('DATABASE_PASSWORD')}@{os.getenv('DATABASE_HOST')}"
             f"/{os.getenv('DATABASE_SCHEME')}"
         )
-        self.session_maker = sessionmaker(
-            bind=create_engine(connection_string, pool_size=5, max_overflow=10, pool_recycle=3600),
-        )
+        self.session_maker = sessionmaker(bind=get_engine(connection_string))
 
     def __enter__(self):
         self.session = self.session_maker()